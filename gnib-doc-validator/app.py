@@ -1,16 +1,45 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session, g, has_app_context, has_request_context, stream_template, stream_with_context, Response, send_file, before_render_template, template_rendered
 import os
+import io
+import csv
+import base64
+import json
+import multiprocessing
+import signal
+import socket
+import sqlite3
+import sys
+import threading
 from datetime import datetime
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-import sqlite3
 import string
 import secrets
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from jinja2 import FileSystemBytecodeCache
+import click
+
+import blobstore
+import bundle
+import chunked
+import db
+import image_ingest
+import jobs
+import metrics
+import ocr_cache
+import pdf_text
+import previews
+import slowlog
+from session_store import ServerSideSessionInterface, SqliteSessionStore
+from ingest import IngestRequest, EXTENSION_TYPES
 
 
 app = Flask(__name__)
 app.secret_key = "gnib-school-project-key"
+# file parts are streamed to disk (size + sha256 + type in one pass), see ingest.py
+app.request_class = IngestRequest
 
 # adding the upload logic and determining the file type
 # that is acceptable and the maximum size it should take.
@@ -68,6 +97,23 @@ DOC_MAP = {
 # some docs like scholarship_proof are optional, so we don't force upload errors for them
 OPTIONAL_DOCS = {"scholarship_proof"}
 
+# request level limits, checked by Werkzeug before/while the body is read:
+# the biggest category can send MAX_DOCS files of MAX_FILE_SIZE_MB each, plus a
+# little room for the multipart headers and form fields. anything bigger gets a
+# 413 straight from the Content-Length header, without reading the body.
+# reference: https://flask.palletsprojects.com/en/latest/config/#MAX_CONTENT_LENGTH
+MAX_DOCS = max(len(docs) for cats in DOC_MAP.values() for docs in cats.values())
+app.config["INGEST_MAX_FILE_BYTES"] = MAX_FILE_SIZE_MB * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = (MAX_DOCS * MAX_FILE_SIZE_MB + 1) * 1024 * 1024
+# non-file fields only, but Werkzeug's multipart parser also checks it against its
+# read buffer (64 KB reads + whatever is left after the last line break), so it
+# has to stay well above 64 KB or binary files get a spurious 413
+app.config["MAX_FORM_MEMORY_SIZE"] = 512 * 1024
+app.config["MAX_FORM_PARTS"] = 4 * MAX_DOCS + 10
+# chunked uploads (chunked.py): size of each PUT the browser sends
+app.config["UPLOAD_CHUNK_SIZE"] = int(
+    os.getenv("UPLOAD_CHUNK_SIZE", str(chunked.DEFAULT_CHUNK_SIZE)))
+
 # SQLite setup (Python sqlite3 docs pattern:
 # https://docs.python.org/3/library/sqlite3.html)
 
@@ -80,6 +126,16 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 DB_PATH = os.path.join(BASE_DIR, "gnib_uploads.db")
+app.config["DB_PATH"] = DB_PATH
+
+# sqlite tuning for the pooled connections in db.py, can be overridden in .env
+# (see https://sqlite.org/pragma.html for what each one does)
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "8192")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    "synchronous": "NORMAL",
+}
 
 # reading admin login details and OCR key from environment variables
 
@@ -87,18 +143,771 @@ ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 # will be used later for document/OCR scanning
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY")
+OCR_SPACE_ENGINE = os.getenv("OCR_SPACE_ENGINE", "1")
+OCR_SPACE_URL = os.getenv("OCR_SPACE_URL", "https://api.ocr.space/parse/image")
+# provider quota, shared by every worker process (token bucket in the db)
+OCR_RATE_PER_MINUTE = float(os.getenv("OCR_RATE_PER_MINUTE", "60"))
+OCR_RATE_BURST = int(os.getenv("OCR_RATE_BURST", "5"))
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "3"))
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+# OCR results are cached per (content hash, engine, language), see ocr_cache.py
+OCR_ENGINE_KEY = f"ocr.space/{OCR_SPACE_ENGINE}"
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_MB", "50")) * 1024 * 1024
+# how many documents of one application are OCR'd at the same time
+OCR_BATCH_WORKERS = int(os.getenv("OCR_BATCH_WORKERS", "4"))
+
+# request / SQL / OCR metrics for /admin/metrics (metrics.py). every process
+# writes its numbers to the db at most every METRICS_FLUSH_SECONDS.
+# METRICS_TOKEN lets Prometheus scrape with "Authorization: Bearer <token>".
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# slow-query log (slowlog.py), off unless SLOW_QUERY_MS is set: statements over
+# that many ms are logged with their parameter types and EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = os.getenv("SLOW_QUERY_MS")
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", os.path.join(BASE_DIR, "logs", "slow_queries.log"))
+slow_query_log = None
+if SLOW_QUERY_MS:
+    slow_query_log = slowlog.SlowQueryLog(
+        SLOW_QUERY_LOG,
+        float(SLOW_QUERY_MS),
+        max_bytes=int(os.getenv("SLOW_QUERY_LOG_MAX_MB", "5")) * 1024 * 1024,
+        backups=int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3")),
+        context=lambda: request.endpoint if has_request_context() else None,
+    )
+
+# admin document viewer (/admin/uploads/<id>/file). FILE_OFFLOAD lets the front
+# web server send the bytes instead of a Python worker:
+#   x-sendfile  Apache mod_xsendfile / lighttpd, gets the absolute path
+#   x-accel     nginx, gets FILE_ACCEL_PREFIX + the path inside uploads/
+#               (an `internal` location aliased to the uploads folder)
+# reference: https://tn123.org/mod_xsendfile/ and
+# https://nginx.org/en/docs/http/ngx_http_core_module.html#internal
+FILE_OFFLOAD = os.getenv("FILE_OFFLOAD", "").lower()
+FILE_ACCEL_PREFIX = os.getenv("FILE_ACCEL_PREFIX", "/protected-uploads/")
+# stored files never change under their content hash, so browsers may keep them
+FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+FILE_MIMETYPES = {"pdf": "application/pdf", "jpeg": "image/jpeg", "png": "image/png"}
+
+# dashboard previews (previews.py): longest side in px, and the size the
+# uploads/.previews cache is kept under (least recently viewed go first)
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", str(previews.DEFAULT_SIZE)))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_MB", "100")) * 1024 * 1024
+
+# uploaded JPEG/PNGs are normalized before they are stored (image_ingest.py):
+# EXIF rotation applied, downsampled to IMAGE_MAX_PIXELS, JPEGs re-encoded at
+# IMAGE_QUALITY. IMAGE_KEEP_ORIGINAL=1 keeps the uploaded file in the blob store too.
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1") == "1"
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(image_ingest.DEFAULT_MAX_PIXELS)))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", str(image_ingest.DEFAULT_QUALITY)))
+IMAGE_KEEP_ORIGINAL = os.getenv("IMAGE_KEEP_ORIGINAL", "0") == "1"
 
 
 def get_db_connection():
-    """simple helper to open sqlite connection with row factory (so we can use row['col'])"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """returns this thread's pooled sqlite connection (row factory set, WAL mode).
+    the connection is shared by everything in the request, so callers commit
+    but never close it - it is handed back to the pool on teardown below.
+    """
+    conn = db.get_connection(
+        app.config["DB_PATH"],
+        SQLITE_PRAGMAS,
+        factory=metrics.TimedConnection
+        if METRICS_ENABLED or slow_query_log else sqlite3.Connection,
+    )
+    if isinstance(conn, metrics.TimedConnection):
+        conn.slow_log = slow_query_log
+    if has_app_context():
+        g._db_conn = conn
     return conn
 
 
+# pattern from the Flask docs "Using SQLite 3 with Flask":
+# https://flask.palletsprojects.com/en/latest/patterns/sqlite3/
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        db.release(conn)
+
+
+# sessions are kept server-side (session_store.py): the cookie only carries an
+# id and purpose/category/uploaded_docs are read with one indexed lookup, the
+# same for every worker. SESSION_BACKEND=cookie goes back to Flask's signed cookie.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+if SESSION_BACKEND == "sqlite":
+    app.session_interface = ServerSideSessionInterface(
+        SqliteSessionStore(get_db_connection),
+        lru_size=int(os.getenv("SESSION_LRU_SIZE", "1024")),
+    )
+
+
+# -------- Metrics --------
+# every request is timed per route (endpoint name, not the raw path, so ids do
+# not turn into new series) and split into phases: sql, template, body
+# (receiving the upload) and file (storing it). see metrics.py
+
+
+@app.before_request
+def start_request_timer():
+    if METRICS_ENABLED:
+        g._metrics_started = time.perf_counter()
+        metrics.begin_phases()
+
+
+@app.after_request
+def remember_response_status(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+# runs after a streamed template has been sent, so its rendering is included
+@app.teardown_request
+def record_request_metrics(exc):
+    started = g.pop("_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = request.endpoint or "unmatched"
+    status = 500 if exc is not None else g.pop("_metrics_status", 500)
+    metrics.HTTP_REQUESTS.inc(route=route, method=request.method, status=status)
+    metrics.HTTP_SECONDS.observe(elapsed, route=route, method=request.method)
+    for phase, seconds in metrics.end_phases().items():
+        metrics.HTTP_PHASE_SECONDS.observe(seconds, route=route, phase=phase)
+    metrics.maybe_flush(get_db_connection(), METRICS_FLUSH_SECONDS)
+
+
+def _template_started(sender, template, context, **extra):
+    g._template_started = time.perf_counter()
+
+
+def _template_finished(sender, template, context, **extra):
+    started = g.pop("_template_started", None)
+    if started is not None:
+        metrics.add_phase("template", time.perf_counter() - started)
+
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
+
+# review statuses; documents.status stores the index into this tuple
+UPLOAD_STATUSES = ("pending", "approved", "rejected")
+
+
+def normalize_uploads(conn):
+    """Migration 9: split the flat uploads table into applications + documents.
+
+    uploads repeated application_code/purpose/category on every row and kept
+    status and dates as text. Now:
+      applications  one row per application code (unique index on code)
+      doc_types     lookup table, documents point at it by integer id
+      documents     integer FKs, status as a small int (index in
+                    UPLOAD_STATUSES), uploaded_at as a unix timestamp
+    Document ids are kept, so jobs and links that point at an upload id still
+    work. uploads becomes a view with the old columns (plus status_code and
+    uploaded_ts) so read-only code and ad-hoc queries keep working.
+    Runs inside run_migrations' transaction.
+    """
+    conn.execute(
+        """
+        CREATE TABLE applications (
+            id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE,
+            purpose TEXT NOT NULL,
+            category TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE doc_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            application_id INTEGER NOT NULL REFERENCES applications (id),
+            doc_type_id INTEGER NOT NULL REFERENCES doc_types (id),
+            filename TEXT NOT NULL,
+            expiry_date TEXT,
+            status INTEGER NOT NULL DEFAULT 0 CHECK (status IN (0, 1, 2)),
+            uploaded_at INTEGER NOT NULL,
+            blob_sha256 TEXT REFERENCES blobs (sha256)
+        )
+        """
+    )
+
+    # known doc types first so their ids follow DOC_MAP, then anything odd in old rows
+    names = [d for cats in DOC_MAP.values() for docs in cats.values() for d in docs]
+    names += [r[0] for r in conn.execute("SELECT DISTINCT doc_type FROM uploads")]
+    conn.executemany(
+        "INSERT OR IGNORE INTO doc_types (name) VALUES (?)",
+        [(name,) for name in dict.fromkeys(names)],
+    )
+
+    # old text times are local time, strftime(.., 'utc') turns them into unix time
+    # purpose/category come from the newest row of each application
+    conn.execute(
+        """
+        INSERT INTO applications (code, purpose, category, created_at)
+        SELECT u.application_code, latest.purpose, latest.category,
+               CAST(strftime('%s', MIN(u.uploaded_at), 'utc') AS INTEGER)
+        FROM uploads u
+        JOIN uploads latest ON latest.id = (
+            SELECT id FROM uploads
+            WHERE application_code = u.application_code
+            ORDER BY uploaded_at DESC, id DESC LIMIT 1
+        )
+        GROUP BY u.application_code
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO documents (id, application_id, doc_type_id, filename,
+                               expiry_date, status, uploaded_at, blob_sha256)
+        SELECT u.id, a.id, t.id, u.filename, u.expiry_date,
+               CASE u.status WHEN 'approved' THEN 1 WHEN 'rejected' THEN 2 ELSE 0 END,
+               CAST(strftime('%s', u.uploaded_at, 'utc') AS INTEGER),
+               u.blob_sha256
+        FROM uploads u
+        JOIN applications a ON a.code = u.application_code
+        JOIN doc_types t ON t.name = u.doc_type
+        """
+    )
+    # keep AUTOINCREMENT from ever handing out an old uploads id again
+    # (sqlite_sequence has no unique key on name, so update or insert by hand)
+    old_seq = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'uploads'").fetchone()
+    if old_seq:
+        if not conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'documents'",
+            (old_seq[0],),
+        ).rowcount:
+            conn.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('documents', ?)",
+                (old_seq[0],),
+            )
+
+    # dropping the table also drops its indexes and the blob refcount triggers
+    # (without firing them, so blobs.refcount stays as it is)
+    conn.execute("DROP TABLE uploads")
+
+    for sql in (
+        "CREATE INDEX idx_documents_uploaded_at ON documents (uploaded_at, id)",
+        "CREATE INDEX idx_documents_application ON documents (application_id, uploaded_at, id)",
+        "CREATE INDEX idx_documents_status ON documents (status, uploaded_at, id)",
+        "CREATE INDEX idx_documents_blob ON documents (blob_sha256)",
+        "CREATE INDEX idx_applications_category ON applications (category, purpose)",
+        """
+        CREATE TRIGGER documents_blob_ref AFTER INSERT ON documents
+        WHEN NEW.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER documents_blob_unref AFTER DELETE ON documents
+        WHEN OLD.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER documents_blob_reref AFTER UPDATE OF blob_sha256 ON documents
+        WHEN OLD.blob_sha256 IS NOT NEW.blob_sha256
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+        """
+        CREATE VIEW uploads AS
+        SELECT d.id, d.application_id, a.code AS application_code, a.purpose,
+               a.category, t.name AS doc_type, d.filename, d.expiry_date,
+               CASE d.status WHEN 1 THEN 'approved' WHEN 2 THEN 'rejected'
+                             ELSE 'pending' END AS status,
+               d.status AS status_code,
+               datetime(d.uploaded_at, 'unixepoch', 'localtime') AS uploaded_at,
+               d.uploaded_at AS uploaded_ts,
+               d.blob_sha256
+        FROM documents d
+        JOIN applications a ON a.id = d.application_id
+        JOIN doc_types t ON t.id = d.doc_type_id
+        """,
+    ):
+        conn.execute(sql)
+
+
+# application_summary keeps, per application: how many doc types its category
+# requires, how many of those it has at least one document for, and how many
+# documents are pending / approved / rejected. The triggers below update one
+# summary row on every document insert, status change or delete, so "complete
+# applications awaiting review" is an index lookup, not a pass over documents.
+# The required doc types per category live in category_doc_types, kept in step
+# with DOC_MAP by sync_required_docs().
+
+# rebuilds the summary of the applications matched by {where} (on applications a)
+SUMMARY_REFRESH_SQL = """
+    INSERT OR REPLACE INTO application_summary
+    (application_id, required_count, uploaded_count, pending_count,
+     approved_count, rejected_count, last_upload_at)
+    SELECT a.id,
+           (SELECT COUNT(*) FROM category_doc_types r
+            WHERE r.purpose = a.purpose AND r.category = a.category),
+           (SELECT COUNT(*) FROM category_doc_types r
+            WHERE r.purpose = a.purpose AND r.category = a.category
+              AND EXISTS (SELECT 1 FROM documents d WHERE d.application_id = a.id
+                          AND d.doc_type_id = r.doc_type_id)),
+           (SELECT COUNT(*) FROM documents d WHERE d.application_id = a.id AND d.status = 0),
+           (SELECT COUNT(*) FROM documents d WHERE d.application_id = a.id AND d.status = 1),
+           (SELECT COUNT(*) FROM documents d WHERE d.application_id = a.id AND d.status = 2),
+           COALESCE((SELECT MAX(uploaded_at) FROM documents d
+                     WHERE d.application_id = a.id), a.created_at)
+    FROM applications a
+    WHERE {where}
+"""
+
+# 1 if NEW/OLD's doc type is one its application's category requires
+_REQUIRED_SQL = """
+    EXISTS (SELECT 1 FROM applications a JOIN category_doc_types r
+            ON r.purpose = a.purpose AND r.category = a.category
+            WHERE a.id = {row}.application_id AND r.doc_type_id = {row}.doc_type_id)
+"""
+
+# 1 if no other document of the application has the same doc type
+_ONLY_ONE_SQL = """
+    NOT EXISTS (SELECT 1 FROM documents o WHERE o.application_id = {row}.application_id
+                AND o.doc_type_id = {row}.doc_type_id AND o.id <> {row}.id)
+"""
+
+
+def required_docs_by_category() -> set:
+    """(purpose, category, doc_type) for every doc type that has to be uploaded"""
+    return {
+        (purpose, category, doc_type)
+        for purpose, cats in DOC_MAP.items()
+        for category, docs in cats.items()
+        for doc_type in docs
+        if doc_type not in OPTIONAL_DOCS
+    }
+
+
+def required_docs_in_db(conn) -> set:
+    return {tuple(r) for r in conn.execute(
+        """
+        SELECT r.purpose, r.category, t.name
+        FROM category_doc_types r JOIN doc_types t ON t.id = r.doc_type_id
+        """
+    )}
+
+
+def sync_required_docs(conn) -> bool:
+    """make category_doc_types match DOC_MAP. when it changed, every summary is
+    rebuilt (required counts move). returns True if anything changed.
+    the caller commits.
+    """
+    wanted = required_docs_by_category()
+    if required_docs_in_db(conn) == wanted:
+        return False
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO doc_types (name) VALUES (?)",
+        [(doc_type,) for doc_type in sorted({d for _, _, d in wanted})],
+    )
+    conn.execute("DELETE FROM category_doc_types")
+    conn.executemany(
+        """
+        INSERT INTO category_doc_types (purpose, category, doc_type_id)
+        SELECT ?, ?, id FROM doc_types WHERE name = ?
+        """,
+        sorted(wanted),
+    )
+    conn.execute(SUMMARY_REFRESH_SQL.format(where="1"))
+    return True
+
+
+def add_application_summary(conn):
+    """Migration 10: application_summary + the triggers that keep it current."""
+    for sql in (
+        """
+        CREATE TABLE category_doc_types (
+            purpose TEXT NOT NULL,
+            category TEXT NOT NULL,
+            doc_type_id INTEGER NOT NULL REFERENCES doc_types (id),
+            PRIMARY KEY (purpose, category, doc_type_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE application_summary (
+            application_id INTEGER PRIMARY KEY REFERENCES applications (id),
+            required_count INTEGER NOT NULL,
+            uploaded_count INTEGER NOT NULL,
+            pending_count INTEGER NOT NULL,
+            approved_count INTEGER NOT NULL,
+            rejected_count INTEGER NOT NULL,
+            last_upload_at INTEGER NOT NULL,
+            ready INTEGER GENERATED ALWAYS AS
+                (required_count > 0 AND uploaded_count >= required_count) VIRTUAL,
+            awaiting_review INTEGER GENERATED ALWAYS AS
+                (required_count > 0 AND uploaded_count >= required_count
+                 AND pending_count > 0) VIRTUAL
+        )
+        """,
+        # dashboard listings: one readiness state, newest activity first
+        "CREATE INDEX idx_summary_ready ON application_summary (ready, last_upload_at, application_id)",
+        "CREATE INDEX idx_summary_awaiting ON application_summary (awaiting_review, last_upload_at, application_id)",
+        # for the "first/last document of this type" checks in the triggers
+        "CREATE INDEX idx_documents_app_type ON documents (application_id, doc_type_id)",
+        """
+        CREATE TRIGGER applications_summary_add AFTER INSERT ON applications
+        BEGIN
+        """ + SUMMARY_REFRESH_SQL.format(where="a.id = NEW.id") + """;
+        END
+        """,
+        """
+        CREATE TRIGGER applications_summary_recategorize
+        AFTER UPDATE OF purpose, category ON applications
+        WHEN OLD.purpose IS NOT NEW.purpose OR OLD.category IS NOT NEW.category
+        BEGIN
+        """ + SUMMARY_REFRESH_SQL.format(where="a.id = NEW.id") + """;
+        END
+        """,
+        """
+        CREATE TRIGGER documents_summary_add AFTER INSERT ON documents
+        BEGIN
+            UPDATE application_summary SET
+                pending_count = pending_count + (NEW.status = 0),
+                approved_count = approved_count + (NEW.status = 1),
+                rejected_count = rejected_count + (NEW.status = 2),
+                uploaded_count = uploaded_count + (""" + _REQUIRED_SQL.format(row="NEW")
+        + " AND " + _ONLY_ONE_SQL.format(row="NEW") + """),
+                last_upload_at = MAX(last_upload_at, NEW.uploaded_at)
+            WHERE application_id = NEW.application_id;
+        END
+        """,
+        """
+        CREATE TRIGGER documents_summary_status AFTER UPDATE OF status ON documents
+        WHEN OLD.status <> NEW.status
+        BEGIN
+            UPDATE application_summary SET
+                pending_count = pending_count - (OLD.status = 0) + (NEW.status = 0),
+                approved_count = approved_count - (OLD.status = 1) + (NEW.status = 1),
+                rejected_count = rejected_count - (OLD.status = 2) + (NEW.status = 2)
+            WHERE application_id = NEW.application_id;
+        END
+        """,
+        """
+        CREATE TRIGGER documents_summary_remove AFTER DELETE ON documents
+        BEGIN
+            UPDATE application_summary SET
+                pending_count = pending_count - (OLD.status = 0),
+                approved_count = approved_count - (OLD.status = 1),
+                rejected_count = rejected_count - (OLD.status = 2),
+                uploaded_count = uploaded_count - (""" + _REQUIRED_SQL.format(row="OLD")
+        + " AND " + _ONLY_ONE_SQL.format(row="OLD") + """)
+            WHERE application_id = OLD.application_id;
+        END
+        """,
+        # moving a document to another application / doc type is rare: rebuild both
+        """
+        CREATE TRIGGER documents_summary_move
+        AFTER UPDATE OF application_id, doc_type_id ON documents
+        BEGIN
+        """ + SUMMARY_REFRESH_SQL.format(
+            where="a.id IN (OLD.application_id, NEW.application_id)") + """;
+        END
+        """,
+    ):
+        conn.execute(sql)
+    # fills category_doc_types and builds every summary row
+    sync_required_docs(conn)
+
+
+def adopt_loose_uploads(conn):
+    """Migration 13: put the files saved before the blob store into it.
+
+    Rows without a blob_sha256 had to be hashed every time they were served
+    (ETag, preview key). adopt_file hard-links, so the loose copy stays valid
+    until this commits; `flask dedupe-uploads` deletes it afterwards. Files
+    missing on disk keep blob_sha256 NULL.
+    """
+    folder = app.config["UPLOAD_FOLDER"]
+    rows = conn.execute(
+        "SELECT DISTINCT filename FROM documents WHERE blob_sha256 IS NULL"
+    ).fetchall()
+    for row in rows:
+        path = os.path.join(folder, row["filename"])
+        if not os.path.isfile(path):
+            continue
+        conn.execute(
+            "UPDATE documents SET blob_sha256 = ? WHERE filename = ? AND blob_sha256 IS NULL",
+            (blobstore.adopt_file(conn, folder, path), row["filename"]),
+        )
+
+
+# schema migrations applied on top of the original uploads table.
+# the db file remembers how far it got in PRAGMA user_version, so each step
+# runs exactly once (reference: https://sqlite.org/pragma.html#pragma_user_version).
+# a step is a list of SQL statements, or a function taking the connection.
+# new steps always go at the END of this list.
+MIGRATIONS = [
+    # 1: secondary indexes for the admin dashboard search, filters and
+    # keyset pagination (every index ends in uploaded_at, id = the sort order)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_uploads_uploaded_at ON uploads (uploaded_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_code ON uploads (application_code, uploaded_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_status ON uploads (status, uploaded_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_category ON uploads (category, uploaded_at, id)",
+    ],
+    # 2: content-addressed blob store (blobstore.py). uploads rows point at a
+    # blob by hash and the triggers keep blobs.refcount in step with them.
+    [
+        """
+        CREATE TABLE blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE uploads ADD COLUMN blob_sha256 TEXT REFERENCES blobs (sha256)",
+        "CREATE INDEX idx_uploads_blob ON uploads (blob_sha256)",
+        """
+        CREATE TRIGGER uploads_blob_ref AFTER INSERT ON uploads
+        WHEN NEW.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER uploads_blob_unref AFTER DELETE ON uploads
+        WHEN OLD.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER uploads_blob_reref AFTER UPDATE OF blob_sha256 ON uploads
+        WHEN OLD.blob_sha256 IS NOT NEW.blob_sha256
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+    ],
+    # 3: background job queue (jobs.py). times are unix timestamps.
+    [
+        """
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            dedupe_key TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL,
+            leased_by TEXT,
+            lease_expires REAL,
+            result TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_jobs_ready ON jobs (status, run_after)",
+        "CREATE INDEX idx_jobs_lease ON jobs (status, lease_expires)",
+        "CREATE INDEX idx_jobs_dedupe ON jobs (dedupe_key, status)",
+    ],
+    # 4: OCR results cache (ocr_cache.py) + its shared hit/miss counters
+    [
+        """
+        CREATE TABLE ocr_cache (
+            sha256 TEXT NOT NULL,
+            engine TEXT NOT NULL,
+            language TEXT NOT NULL,
+            text TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            PRIMARY KEY (sha256, engine, language)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_ocr_cache_lru ON ocr_cache (last_used_at)",
+        """
+        CREATE TABLE ocr_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO ocr_cache_stats (name, value)
+        VALUES ('hits', 0), ('misses', 0), ('evictions', 0), ('bytes', 0)
+        """,
+    ],
+    # 5: remember how each cached text was produced: 'ocr' (remote provider),
+    # 'text-layer' (read locally from the PDF) or 'text-layer+ocr' (mixed)
+    [
+        "ALTER TABLE ocr_cache ADD COLUMN source TEXT NOT NULL DEFAULT 'ocr'",
+    ],
+    # 6: token buckets shared between processes (ocr_client.SharedTokenBucket)
+    [
+        """
+        CREATE TABLE rate_limits (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 7: server-side sessions (session_store.py)
+    [
+        """
+        CREATE TABLE sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_sessions_expires ON sessions (expires_at)",
+    ],
+    # 8: resumable chunked uploads (chunked.py)
+    [
+        """
+        CREATE TABLE chunked_uploads (
+            id TEXT PRIMARY KEY,
+            doc_type TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            chunks INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_chunked_uploads_created ON chunked_uploads (created_at)",
+        """
+        CREATE TABLE chunked_upload_parts (
+            upload_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            PRIMARY KEY (upload_id, idx)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 9: normalized applications / doc_types / documents schema
+    normalize_uploads,
+    # 10: per-application completeness summary kept up to date by triggers
+    add_application_summary,
+    # 11: one metrics snapshot per process, added up by /admin/metrics (metrics.py)
+    [
+        """
+        CREATE TABLE metric_snapshots (
+            process TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 12: before/after of every image normalized on ingest (image_ingest.py)
+    [
+        """
+        CREATE TABLE image_normalizations (
+            original_sha256 TEXT PRIMARY KEY,
+            stored_sha256 TEXT NOT NULL,
+            original_bytes INTEGER NOT NULL,
+            stored_bytes INTEGER NOT NULL,
+            original_width INTEGER NOT NULL,
+            original_height INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            rotated INTEGER NOT NULL,
+            kept_original INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 13: hash and adopt the pre-blob-store files once, not on every request
+    adopt_loose_uploads,
+    # 14: an original kept next to its normalized copy (IMAGE_KEEP_ORIGINAL)
+    # is referenced by its image_normalizations row, count it in blobs.refcount
+    [
+        """
+        CREATE TRIGGER normalizations_original_ref AFTER INSERT ON image_normalizations
+        WHEN NEW.kept_original
+        BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.original_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER normalizations_original_unref AFTER DELETE ON image_normalizations
+        WHEN OLD.kept_original
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.original_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER normalizations_original_reref
+        AFTER UPDATE OF kept_original ON image_normalizations
+        WHEN OLD.kept_original IS NOT NEW.kept_original
+        BEGIN
+            UPDATE blobs SET refcount = refcount - OLD.kept_original + NEW.kept_original
+            WHERE sha256 = NEW.original_sha256;
+        END
+        """,
+        """
+        UPDATE blobs SET refcount = refcount + (
+            SELECT COUNT(*) FROM image_normalizations
+            WHERE original_sha256 = blobs.sha256 AND kept_original = 1)
+        """,
+    ],
+]
+
+
+def run_migrations(conn):
+    """apply any MIGRATIONS the db has not seen yet, one transaction per step"""
+    for version, step in enumerate(MIGRATIONS, start=1):
+        # BEGIN IMMEDIATE takes the write lock first, so when two workers
+        # start together only one of them runs the step
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                conn.rollback()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for sql in step:
+                    conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def schema_is_current(conn) -> bool:
+    """every migration applied and category_doc_types in step with DOC_MAP.
+    only reads, so workers starting together don't queue up on the write lock"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        return False
+    return required_docs_in_db(conn) == required_docs_by_category()
+
+
 def init_db():
-    """Create uploads table if it does not exist."""
+    """Create the original uploads table if it does not exist, then run pending
+    migrations (which turn it into the applications/documents schema)."""
     conn = get_db_connection()
+    if schema_is_current(conn):
+        return
     cur = conn.cursor()
     cur.execute(
         """
@@ -116,7 +925,16 @@ def init_db():
         """
     )
     conn.commit()
-    conn.close()
+    run_migrations(conn)
+
+    # DOC_MAP may have changed since the summaries were built
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        sync_required_docs(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def generate_application_code(length: int = 8) -> str:
@@ -161,6 +979,42 @@ def ensure_session_store():
     session.setdefault("uploaded_docs", {})
 
 
+def document_file(doc_type):
+    """the file sent for one document: a normal file part (document_<doc_type>),
+    or a finished chunked upload (upload_<doc_type>=<id>, see chunked.py) joined
+    into the same kind of spooled file. raises chunked.ChunkError if that upload
+    is unknown or not complete yet.
+    """
+    upload_id = request.form.get(f"upload_{doc_type}")
+    if not upload_id:
+        return request.files.get(f"document_{doc_type}")
+
+    assembled = g.setdefault("_chunked_files", {})
+    if doc_type not in assembled:
+        conn = get_db_connection()
+        upload = chunked.get(conn, upload_id)
+        if upload is None or upload["doc_type"] != doc_type:
+            raise chunked.ChunkError("Upload expired, please select the file again.")
+        spool = chunked.assemble(
+            conn,
+            app.config["UPLOAD_FOLDER"],
+            upload,
+            os.path.join(app.config["UPLOAD_FOLDER"], ".incoming"),
+            app.config["INGEST_MAX_FILE_BYTES"],
+        )
+        if spool is None:
+            raise chunked.ChunkError("Upload is not complete yet, please try again.")
+        assembled[doc_type] = FileStorage(stream=spool, filename=upload["filename"])
+    return assembled[doc_type]
+
+
+@app.teardown_request
+def close_chunked_files(exc):
+    # joined chunked uploads nobody kept are deleted, like normal file parts
+    for file in g.pop("_chunked_files", {}).values():
+        file.stream.close()
+
+
 # Remodified the route to fit my project
 @app.route("/")
 def index():
@@ -168,6 +1022,162 @@ def index():
     return render_template("index.html")
 
 
+def insert_document(conn, application_code, purpose, category, doc_type,
+                    filename, expiry_date, uploaded_at: int, blob_sha256=None,
+                    status: str = "pending") -> int:
+    """Record one document (normalized schema, see normalize_uploads) and return its id.
+    the application row is created on first use and otherwise keeps the latest
+    purpose/category. The caller commits.
+    """
+    row = conn.execute(
+        """
+        INSERT INTO applications (code, purpose, category, created_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (code) DO NOTHING
+        RETURNING id
+        """,
+        (application_code, purpose, category, uploaded_at),
+    ).fetchone()
+    if row is not None:
+        application_id = row[0]
+    else:
+        # a plain UPDATE, not ON CONFLICT DO UPDATE: under an upsert SQLite runs
+        # the trigger's INSERT OR REPLACE into application_summary as ABORT,
+        # so switching category failed with a UNIQUE constraint error
+        application_id = conn.execute(
+            "SELECT id FROM applications WHERE code = ?", (application_code,)
+        ).fetchone()[0]
+        conn.execute(
+            """
+            UPDATE applications SET purpose = ?, category = ?
+            WHERE id = ? AND (purpose IS NOT ? OR category IS NOT ?)
+            """,
+            (purpose, category, application_id, purpose, category),
+        )
+
+    row = conn.execute(
+        "SELECT id FROM doc_types WHERE name = ?", (doc_type,)).fetchone()
+    doc_type_id = row[0] if row else conn.execute(
+        "INSERT INTO doc_types (name) VALUES (?) RETURNING id", (doc_type,)
+    ).fetchone()[0]
+
+    return conn.execute(
+        """
+        INSERT INTO documents
+        (application_id, doc_type_id, filename, expiry_date, status,
+         uploaded_at, blob_sha256)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+        """,
+        (application_id, doc_type_id, filename, expiry_date,
+         UPLOAD_STATUSES.index(status), uploaded_at, blob_sha256),
+    ).fetchone()[0]
+
+
+def store_upload(conn, spool) -> str:
+    """put a validated upload into the blob store and return the hash of what
+    was kept: the normalized copy for a big or sideways image (image_ingest.py),
+    the file as uploaded otherwise.
+    """
+    folder = app.config["UPLOAD_FOLDER"]
+    if not IMAGE_NORMALIZE or spool.kind not in image_ingest.KINDS:
+        return blobstore.store_spooled(conn, folder, spool)
+
+    done = image_ingest.lookup(conn, spool.sha256)
+    if done is not None and os.path.exists(
+            blobstore.blob_path(folder, done["stored_sha256"])):
+        # this exact file was normalized before, the blob row exists already.
+        # the original may not have been kept then (or its blob was removed)
+        if IMAGE_KEEP_ORIGINAL:
+            blobstore.store_spooled(conn, folder, spool)
+            if not done["kept_original"]:
+                image_ingest.keep_original(conn, spool.sha256)
+        return done["stored_sha256"]
+
+    result = image_ingest.normalize(
+        spool,
+        os.path.join(folder, ".incoming"),
+        app.config["INGEST_MAX_FILE_BYTES"],
+        IMAGE_MAX_PIXELS,
+        IMAGE_QUALITY,
+    )
+    if result is None:
+        return blobstore.store_spooled(conn, folder, spool)
+    normalized, info = result
+    try:
+        sha256 = blobstore.store_spooled(conn, folder, normalized)
+    finally:
+        normalized.close()
+    if IMAGE_KEEP_ORIGINAL:
+        blobstore.store_spooled(conn, folder, spool)
+    image_ingest.record(conn, info, kept_original=IMAGE_KEEP_ORIGINAL)
+    return sha256
+
+
+def save_document(conn, application_code, purpose, category, doc_type,
+                  spool, original_name, expiry_date):
+    """Keep one validated document and record it as a 'pending' upload.
+    the content goes into the hash-addressed blob store (see blobstore.py), so a
+    file we already have is not written again. returns the info dict we keep
+    in the session for the checklist.
+    """
+    now = datetime.now()
+    safe_name = secure_filename(original_name)
+    final_name = f"{doc_type}_{int(now.timestamp())}_{safe_name}"
+    with metrics.timed_phase("file"):
+        sha256 = store_upload(conn, spool)
+    metrics.UPLOADED_DOCUMENTS.inc(doc_type=doc_type)
+    metrics.UPLOADED_BYTES.inc(spool.size, doc_type=doc_type)
+
+    insert_document(
+        conn,
+        application_code,
+        purpose,
+        category,
+        doc_type,
+        final_name,
+        expiry_date,
+        int(now.timestamp()),
+        sha256,
+    )
+    queue_preview(conn, sha256,
+                  blobstore.blob_path(app.config["UPLOAD_FOLDER"], sha256), spool.kind)
+    return {
+        "filename": final_name,
+        "expiry": expiry_date,
+        "uploaded_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def upload_file_path(upload_row) -> str:
+    """where the file for an uploads row lives on disk.
+    rows from before the blob store only have their own file in uploads/.
+    """
+    if upload_row["blob_sha256"]:
+        return blobstore.blob_path(
+            app.config["UPLOAD_FOLDER"], upload_row["blob_sha256"])
+    return os.path.join(app.config["UPLOAD_FOLDER"], upload_row["filename"])
+
+
+def queue_preview(conn, sha256: str, path: str, kind: str):
+    """have a worker make the dashboard preview of this content (previews.py),
+    unless it is cached already or known to be impossible. the caller commits.
+    returns the job id, or None when nothing was queued.
+    """
+    folder = app.config["UPLOAD_FOLDER"]
+    if not previews.available() or kind not in FILE_MIMETYPES:
+        return None
+    if os.path.exists(previews.preview_path(folder, sha256)) or \
+            os.path.exists(previews.marker_path(folder, sha256)):
+        return None
+    return jobs.enqueue(
+        conn,
+        "preview",
+        {"sha256": sha256, "path": os.path.relpath(path, folder), "kind": kind},
+        dedupe_key=f"preview:{sha256}",
+    )
+
+
 # routing the upload document, using template
 @app.route("/upload", methods=["GET", "POST"])
 def upload():
@@ -195,13 +1205,17 @@ def upload():
         # this logic is aligned with the dynamic inputs generated in validation.js
         # where each file field is like: name="document_passport" etc.
         for doc_type in required_docs:
-            field_name = f"document_{doc_type}"
-            file = request.files.get(field_name)
             expiry_field = f"expiry_{doc_type}"
             expiry_date = request.form.get(expiry_field)
 
             label = doc_type.replace("_", " ").title()
 
+            try:
+                file = document_file(doc_type)
+            except chunked.ChunkError as e:
+                errors.append(f"{label}: {e}")
+                continue
+
             # if file is missing
             if not file or file.filename == "":
                 if doc_type in OPTIONAL_DOCS:
@@ -217,16 +1231,23 @@ def upload():
                 )
                 continue
 
-            # checking file size by seeking to end and back
-            file.seek(0, os.SEEK_END)
-            size_bytes = file.tell()
-            file.seek(0)
-            if size_bytes > MAX_FILE_SIZE_MB * 1024 * 1024:
+            # size, hash and type were already worked out while the file was
+            # streamed to disk (see ingest.py), so nothing is re-read here
+            spool = file.stream
+            if spool.too_large:
                 errors.append(
                     f"{label}: File must be under {MAX_FILE_SIZE_MB} MB."
                 )
                 continue
 
+            # the content has to match the extension, not just the name
+            ext = file.filename.rsplit(".", 1)[1].lower()
+            if spool.kind != EXTENSION_TYPES[ext]:
+                errors.append(
+                    f"{label}: File content is not a valid {ext.upper()} file."
+                )
+                continue
+
             # Passport expiry validation
             if doc_type == "passport":
                 if not expiry_date:
@@ -262,53 +1283,34 @@ def upload():
             required_docs = get_required_docs(purpose, category)
 
             conn = get_db_connection()
-            cur = conn.cursor()
 
             for doc_type in required_docs:
-                field_name = f"document_{doc_type}"
-                file = request.files.get(field_name)
+                file = document_file(doc_type)
                 if not file or file.filename == "":
                     # optional or missing doc, skip saving
                     continue
 
-                safe_name = secure_filename(file.filename)
-                final_name = f"{doc_type}_{int(datetime.now().timestamp())}_{safe_name}"
-                filepath = os.path.join(
-                    app.config["UPLOAD_FOLDER"], final_name)
-                file.save(filepath)
-
                 expiry_field = f"expiry_{doc_type}"
                 expiry_date = request.form.get(expiry_field)
 
-                uploaded_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                uploaded_docs[doc_type] = {
-                    "filename": final_name,
-                    "expiry": expiry_date,
-                    "uploaded_at": uploaded_at,
-                }
-
-                # Insert into SQLite with status 'pending'
-                # basic INSERT pattern follows sqlite3 doc examples
-                cur.execute(
-                    """
-                    INSERT INTO uploads
-                    (application_code, purpose, category, doc_type, filename, expiry_date, status, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        application_code,
-                        purpose,
-                        category,
-                        doc_type,
-                        final_name,
-                        expiry_date,
-                        "pending",
-                        uploaded_at,
-                    ),
+                uploaded_docs[doc_type] = save_document(
+                    conn,
+                    application_code,
+                    purpose,
+                    category,
+                    doc_type,
+                    file.stream,
+                    file.filename,
+                    expiry_date,
                 )
 
             conn.commit()
-            conn.close()
+
+            # the chunks of finished chunked uploads are not needed any more
+            for doc_type in g.get("_chunked_files", {}):
+                chunked.discard(
+                    conn, app.config["UPLOAD_FOLDER"],
+                    request.form[f"upload_{doc_type}"])
 
             session["uploaded_docs"] = uploaded_docs
             flash(
@@ -344,7 +1346,87 @@ def upload():
         category=category,
         required_docs=status_list,
         all_ready=all_ready,
+        # budgets for the in-browser image shrinking (static/js/validation.js)
+        max_file_mb=MAX_FILE_SIZE_MB,
+        image_max_pixels=IMAGE_MAX_PIXELS,
+        image_quality=IMAGE_QUALITY,
+    )
+
+
+# bodies over MAX_CONTENT_LENGTH are refused by Werkzeug with a 413 before
+# upload() even runs, so we turn that into the same flash message as the per-file check
+@app.errorhandler(413)
+def request_too_large(e):
+    flash(
+        f"Upload is too large. Each file must be under {MAX_FILE_SIZE_MB} MB.",
+        "danger",
     )
+    return redirect(url_for("upload"))
+
+
+# -------- Resumable chunked uploads (see chunked.py) --------
+# validation.js sends big files in numbered chunks, several at a time, and
+# finalizes by posting the normal upload form with upload_<doc_type>=<id>.
+
+def chunked_upload_status(conn, upload):
+    return {
+        "ok": True,
+        "upload_id": upload["id"],
+        "chunk_size": upload["chunk_size"],
+        "chunks": upload["chunks"],
+        "received": chunked.received(conn, upload["id"]),
+    }
+
+
+@app.route("/upload/chunked", methods=["POST"])
+def create_chunked_upload():
+    """body: {"doc_type": "passport", "filename": "passport.pdf", "size": 1234567}"""
+    data = request.get_json(silent=True) or {}
+    doc_type = data.get("doc_type")
+    filename = data.get("filename") or ""
+    size = data.get("size")
+
+    errors = []
+    if not any(doc_type in docs for cats in DOC_MAP.values() for docs in cats.values()):
+        errors.append("Unknown document type.")
+    if not allowed_file(filename):
+        errors.append("Only PDF, JPG, JPEG, PNG files are allowed.")
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        errors.append("File size is missing.")
+    elif size > app.config["INGEST_MAX_FILE_BYTES"]:
+        errors.append(f"File must be under {MAX_FILE_SIZE_MB} MB.")
+    if errors:
+        return jsonify({"ok": False, "errors": errors}), 400
+
+    conn = get_db_connection()
+    chunked.purge_expired(conn, app.config["UPLOAD_FOLDER"])
+    upload = chunked.create(
+        conn, app.config["UPLOAD_FOLDER"], doc_type, filename, size,
+        app.config["UPLOAD_CHUNK_SIZE"])
+    return jsonify(chunked_upload_status(conn, upload)), 201
+
+
+@app.route("/upload/chunked/<upload_id>")
+def chunked_upload_info(upload_id):
+    """which chunks the server has, so a client can resume after a failure"""
+    conn = get_db_connection()
+    upload = chunked.get(conn, upload_id)
+    if upload is None:
+        return jsonify({"ok": False, "errors": ["Unknown or expired upload."]}), 404
+    return jsonify(chunked_upload_status(conn, upload))
+
+
+@app.route("/upload/chunked/<upload_id>/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id, index):
+    conn = get_db_connection()
+    upload = chunked.get(conn, upload_id)
+    if upload is None:
+        return jsonify({"ok": False, "errors": ["Unknown or expired upload."]}), 404
+    try:
+        chunked.put_chunk(conn, app.config["UPLOAD_FOLDER"], upload, index, request.stream)
+    except chunked.ChunkError as e:
+        return jsonify({"ok": False, "errors": [str(e)]}), 400
+    return jsonify({"ok": True, "index": index})
 
 
 # modified the checklist rout to better suit the project.
@@ -394,6 +1476,14 @@ def checklist():
 # simple admin login for now (no users table yet)
 
 
+def regenerate_session():
+    """new session id on login/logout against session fixation (session_store.py).
+    Flask's cookie session has no id to swap, so this is a no-op there"""
+    regenerate = getattr(session, "regenerate", None)
+    if regenerate is not None:
+        regenerate()
+
+
 @app.route("/admin/login", methods=["GET", "POST"])
 def admin_login():
     # using ADMIN_USERNAME and ADMIN_PASSWORD loaded from .env above
@@ -405,6 +1495,7 @@ def admin_login():
         if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
             # using Flask session, same pattern used in their docs:
             # https://flask.palletsprojects.com/en/latest/quickstart/#sessions
+            regenerate_session()
             session["admin_logged_in"] = True
             flash("Welcome, admin.", "success")
             return redirect(url_for("admin_dashboard"))
@@ -422,6 +1513,128 @@ def require_admin():
     return bool(session.get("admin_logged_in"))
 
 
+# dashboard paging uses keyset (cursor) pagination instead of OFFSET: the
+# cursor is the (uploaded_ts, id) of the last row shown, so every page seeks
+# straight into one of the (..., uploaded_at, id) indexes and reads only
+# ADMIN_PAGE_SIZE rows, no matter how deep into the history the admin goes.
+# reference: https://use-the-index-luke.com/no-offset
+ADMIN_PAGE_SIZE = 50
+
+# readiness filter value -> (label, condition on application_summary)
+READINESS_FILTERS = {
+    "awaiting": ("Complete, awaiting review", "awaiting_review = 1"),
+    "complete": ("Complete", "ready = 1"),
+    "incomplete": ("Incomplete", "ready = 0"),
+}
+
+
+def encode_cursor(*values) -> str:
+    raw = "|".join(str(v) for v in values).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(token: str, parts: int = 2):
+    """returns the cursor's integers, e.g. (uploaded_ts, id),
+    or None if the token is missing/garbage"""
+    if not token:
+        return None
+    try:
+        values = tuple(int(v) for v in base64.urlsafe_b64decode(
+            token.encode()).decode().split("|"))
+    except ValueError:
+        return None
+    return values if len(values) == parts else None
+
+
+def read_upload_filters(args) -> dict:
+    """pull the dashboard filters out of request.args, dropping invalid values"""
+    filters = {"code": args.get("code", "").strip()}
+
+    status = args.get("status", "")
+    filters["status"] = status if status in UPLOAD_STATUSES else ""
+    purpose = args.get("purpose", "")
+    filters["purpose"] = purpose if purpose in DOC_MAP else ""
+    category = args.get("category", "")
+    all_categories = {c for cats in DOC_MAP.values() for c in cats}
+    filters["category"] = category if category in all_categories else ""
+
+    readiness = args.get("readiness", "")
+    filters["readiness"] = readiness if readiness in READINESS_FILTERS else ""
+
+    for key in ("date_from", "date_to"):
+        value = args.get(key, "").strip()
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+            filters[key] = value
+        except ValueError:
+            filters[key] = ""
+    return filters
+
+
+def upload_filter_sql(filters: dict):
+    """turn the dashboard filters into WHERE clauses + params on the uploads view.
+    the clauses use the raw documents columns (status_code, uploaded_ts) so
+    SQLite can still use the documents indexes through the view.
+    """
+    where, params = [], []
+    if filters.get("code"):
+        where.append("application_code = ?")
+        params.append(filters["code"])
+    if filters.get("status"):
+        where.append("status_code = ?")
+        params.append(UPLOAD_STATUSES.index(filters["status"]))
+    for column in ("purpose", "category"):
+        if filters.get(column):
+            where.append(f"{column} = ?")
+            params.append(filters[column])
+    if filters.get("readiness"):
+        # a correlated EXISTS keeps the newest-first index scan (one PK lookup
+        # per row, stops after a page); IN (...) would collect every matching
+        # application first and then sort all their documents
+        where.append(
+            "EXISTS (SELECT 1 FROM application_summary s"
+            " WHERE s.application_id = uploads.application_id"
+            f" AND {READINESS_FILTERS[filters['readiness']][1]})")
+    # the dates are local days, uploaded_ts is unix time
+    if filters.get("date_from"):
+        where.append("uploaded_ts >= CAST(strftime('%s', ?, 'utc') AS INTEGER)")
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        # date_to is inclusive
+        where.append("uploaded_ts < CAST(strftime('%s', ?, '+1 day', 'utc') AS INTEGER)")
+        params.append(filters["date_to"])
+    return where, params
+
+
+def list_uploads(filters: dict, after=None, limit: int = ADMIN_PAGE_SIZE):
+    """One page of uploads, newest first.
+    returns (rows, next_cursor) where next_cursor is None on the last page.
+    """
+    where, params = upload_filter_sql(filters)
+    if after:
+        where.append("(uploaded_ts, id) < (?, ?)")
+        params.extend(after)
+
+    sql = """
+        SELECT id, application_code, purpose, category, doc_type, filename,
+               expiry_date, status, uploaded_at, uploaded_ts
+        FROM uploads
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY uploaded_ts DESC, id DESC LIMIT ?"
+    # asking for one extra row tells us if there is a next page
+    params.append(limit + 1)
+
+    rows = get_db_connection().execute(sql, params).fetchall()
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last["uploaded_ts"], last["id"])
+    else:
+        next_cursor = None
+    return rows[:limit], next_cursor
+
+
 # admin dashboard route
 @app.route("/admin")
 def admin_dashboard():
@@ -429,67 +1642,385 @@ def admin_dashboard():
     if not require_admin():
         return redirect(url_for("admin_login"))
 
-    # grabbing the optional search query from the URL (?code=XXXX)
+    # grabbing the optional search/filters from the URL (?code=XXXX&status=...)
     # this pattern follows the typical Flask request.args usage:
     # https://flask.palletsprojects.com/en/latest/quickstart/#accessing-request-data
+    filters = read_upload_filters(request.args)
+    after = decode_cursor(request.args.get("after", ""))
 
-    search_code = request.args.get("code", "").strip()
+    uploads, next_cursor = list_uploads(filters, after)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # passing the filters into the template so the form keeps what was searched
+    # and the "next page" link can carry them along
+    return render_template(
+        "admin_dashboard.html",
+        uploads=uploads,
+        search_code=filters["code"],
+        filters=filters,
+        filter_args={k: v for k, v in filters.items() if v},
+        next_cursor=next_cursor,
+        is_first_page=after is None,
+        statuses=UPLOAD_STATUSES,
+        readiness=READINESS_FILTERS,
+        doc_map=DOC_MAP,
+    )
 
-    if search_code:
-        # if admin typed a code, only pull uploads for that application_code
-        cur.execute(
-            """
-            SELECT id, application_code, purpose, category,
-                   doc_type, filename, expiry_date, status, uploaded_at
-            FROM uploads
-            WHERE application_code = ?
-            ORDER BY uploaded_at DESC
-            """,
-            (search_code,),
-        )
+
+# -------- Export --------
+# the whole (filtered) history as CSV or NDJSON, streamed: the response starts
+# with the header line right away and the rows follow in keyset batches of
+# EXPORT_BATCH_SIZE, so memory stays flat however many rows there are. every
+# batch is its own short read, instead of one cursor held open for the whole
+# download, which would keep a read transaction open and stop WAL checkpoints
+# for as long as a slow client takes.
+# reference: https://flask.palletsprojects.com/en/latest/patterns/streaming/
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "application_code", "purpose", "category", "doc_type",
+                  "filename", "expiry_date", "status", "uploaded_at")
+
+
+def iter_uploads(filters: dict, batch_size: int = EXPORT_BATCH_SIZE):
+    """every upload matching the filters, newest first, read batch by batch"""
+    after = None
+    while True:
+        rows, next_cursor = list_uploads(filters, after, batch_size)
+        yield from rows
+        if next_cursor is None:
+            return
+        after = decode_cursor(next_cursor)
+
+
+def _csv_cell(value):
+    # a cell starting with = + - @ is run as a formula by spreadsheet apps
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+
+def export_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    yield _drain(buf)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([_csv_cell(row[c]) for c in EXPORT_COLUMNS])
+        # send a chunk per batch, not per row
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield _drain(buf)
+    yield _drain(buf)
+
+
+def export_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: row[c] for c in EXPORT_COLUMNS}) + "\n")
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+
+def _drain(buf: io.StringIO) -> str:
+    """everything written to buf since the last drain"""
+    text = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return text
+
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+}
+
+
+@app.route("/admin/export.<fmt>")
+def admin_export(fmt):
+    """uploads matching the dashboard filters (?status=&category=&date_from=...)"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"unknown export format {fmt!r}, use csv or ndjson"}), 404
+
+    render, content_type = EXPORT_FORMATS[fmt]
+    rows = iter_uploads(read_upload_filters(request.args), EXPORT_BATCH_SIZE)
+    filename = f"gnib_uploads_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+    return Response(
+        stream_with_context(render(rows)),
+        content_type=content_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            # nginx / Passenger would otherwise collect the response before sending it
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def list_applications(readiness: str = "", after=None, limit: int = ADMIN_PAGE_SIZE):
+    """One page of application summaries, complete ones first, then newest activity.
+    with a readiness filter it is one index range of idx_summary_ready/awaiting.
+    returns (rows, next_cursor) like list_uploads.
+    """
+    where, params = [], []
+    if readiness:
+        # ready is the same for every row of a readiness filter, so the page is
+        # one range of the (state, last_upload_at, application_id) index
+        where.append(READINESS_FILTERS[readiness][1])
+        order = "s.last_upload_at DESC, s.application_id DESC"
+        if after:
+            where.append("(s.last_upload_at, s.application_id) < (?, ?)")
+            params.extend(after[1:])
     else:
-        # no search, show all uploads like before
-        cur.execute(
-            """
-            SELECT id, application_code, purpose, category,
-                   doc_type, filename, expiry_date, status, uploaded_at
-            FROM uploads
-            ORDER BY uploaded_at DESC
-            """
-        )
+        order = "s.ready DESC, s.last_upload_at DESC, s.application_id DESC"
+        if after:
+            where.append("(s.ready, s.last_upload_at, s.application_id) < (?, ?, ?)")
+            params.extend(after)
+
+    sql = """
+        SELECT s.*, a.code, a.purpose, a.category,
+               datetime(s.last_upload_at, 'unixepoch', 'localtime') AS last_upload
+        FROM application_summary s
+        JOIN applications a ON a.id = s.application_id
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order} LIMIT ?"
+    params.append(limit + 1)
+
+    rows = get_db_connection().execute(sql, params).fetchall()
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(
+            last["ready"], last["last_upload_at"], last["application_id"])
+    else:
+        next_cursor = None
+    return rows[:limit], next_cursor
+
 
-    uploads = cur.fetchall()
-    conn.close()
+@app.route("/admin/applications")
+def admin_applications():
+    """applications with their completeness, read from application_summary"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
 
-    # passing search_code into the template so we can show what was searched
+    readiness = request.args.get("readiness", "")
+    if readiness not in READINESS_FILTERS:
+        readiness = ""
+    after = decode_cursor(request.args.get("after", ""), parts=3)
+    applications, next_cursor = list_applications(readiness, after)
     return render_template(
-        "admin_dashboard.html",
-        uploads=uploads,
-        search_code=search_code,
+        "admin_applications.html",
+        applications=applications,
+        readiness=readiness,
+        readiness_filters=READINESS_FILTERS,
+        next_cursor=next_cursor,
+        is_first_page=after is None,
     )
 
-    # this template will loop over "uploads" and show them in a table
-    return render_template("admin_dashboard.html", uploads=uploads)
 
-# route to approve a single document
+BUNDLE_MANIFEST_COLUMNS = ("file", "doc_type", "status", "expiry_date",
+                           "uploaded_at", "sha256")
 
 
-@app.route("/admin/approve/<int:upload_id>")
-def admin_approve(upload_id):
+def bundle_entries(application_code: str, rows):
+    """(name, source, modified) for bundle.stream_zip: manifest.csv, then every
+    document that is still on disk. documents are named <doc_type>/<filename>"""
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(BUNDLE_MANIFEST_COLUMNS + ("note",))
+    files = []
+    for row in rows:
+        name = f"{row['doc_type']}/{row['filename']}"
+        path = upload_file_path(row)
+        note = ""
+        if os.path.exists(path):
+            files.append((name, path, row["uploaded_ts"]))
+        else:
+            name, note = "", "file missing on server"
+        writer.writerow([name, row["doc_type"], row["status"], row["expiry_date"] or "",
+                         row["uploaded_at"], row["blob_sha256"] or "", note])
+    yield f"{application_code}/manifest.csv", manifest.getvalue().encode(), None
+    for name, path, modified in files:
+        yield f"{application_code}/{name}", path, modified
+
+
+@app.route("/admin/applications/<application_code>/bundle.zip")
+def admin_application_bundle(application_code):
+    """every document of one application plus a manifest, as a ZIP streamed
+    while it is built (bundle.py), to forward a case in one download"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    # one application has a handful of rows, reading them all up front is fine;
+    # it is the file contents that are streamed
+    rows = get_db_connection().execute(
+        """
+        SELECT id, doc_type, filename, status, expiry_date, uploaded_at,
+               uploaded_ts, blob_sha256
+        FROM uploads WHERE application_code = ?
+        ORDER BY doc_type, uploaded_ts, id
+        """,
+        (application_code,),
+    ).fetchall()
+    if not rows:
+        flash("No documents found for that application code.", "warning")
+        return redirect(url_for("admin_applications"))
+
+    filename = secure_filename(f"gnib_{application_code}.zip")
+    return Response(
+        stream_with_context(bundle.stream_zip(bundle_entries(application_code, rows))),
+        content_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@app.route("/admin/uploads/<int:upload_id>/file")
+def admin_upload_file(upload_id):
+    """open a stored document in the browser.
+    the ETag is the content hash, so If-None-Match answers 304 without reading
+    the file, and Range requests get 206 (PDF viewers fetch a big file page by
+    page). with FILE_OFFLOAD set the web server sends the bytes (and handles
+    Range itself), the worker only checks the login and the ETag.
+    """
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    upload_row = get_db_connection().execute(
+        "SELECT * FROM uploads WHERE id = ?", (upload_id,)
+    ).fetchone()
+    if upload_row is None:
+        flash("Upload not found.", "danger")
+        return redirect(url_for("admin_dashboard"))
+    file_path = upload_file_path(upload_row)
+    if not os.path.exists(file_path):
+        flash("The file for that upload is missing on disk.", "danger")
+        return redirect(url_for("admin_dashboard"))
+
+    if upload_row["blob_sha256"]:
+        etag = upload_row["blob_sha256"]
+    else:
+        # a loose file migration 13 couldn't adopt: tag it by mtime + size
+        # (like werkzeug's and nginx's own ETags) instead of hashing it per request
+        st = os.stat(file_path)
+        etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    ext = upload_row["filename"].rsplit(".", 1)[-1].lower()
+    mimetype = FILE_MIMETYPES.get(EXTENSION_TYPES.get(ext), "application/octet-stream")
+
+    if FILE_OFFLOAD in ("x-sendfile", "x-accel"):
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetype)
+            response.headers["Content-Disposition"] = (
+                f'inline; filename="{secure_filename(upload_row["filename"])}"')
+            if FILE_OFFLOAD == "x-sendfile":
+                response.headers["X-Sendfile"] = os.path.abspath(file_path)
+            else:
+                relative = os.path.relpath(file_path, app.config["UPLOAD_FOLDER"])
+                response.headers["X-Accel-Redirect"] = (
+                    FILE_ACCEL_PREFIX.rstrip("/") + "/" + relative.replace(os.sep, "/"))
+        response.set_etag(etag)
+        response.cache_control.max_age = FILE_CACHE_MAX_AGE
+    else:
+        # werkzeug does the If-None-Match / Range / 206 / 416 handling
+        response = send_file(
+            file_path,
+            mimetype=mimetype,
+            download_name=upload_row["filename"],
+            conditional=True,
+            etag=etag,
+            max_age=FILE_CACHE_MAX_AGE,
+        )
+        response.cache_control.public = False
+    # these are people's passports: no shared caches, and no content sniffing
+    response.cache_control.private = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
+@app.route("/admin/uploads/<int:upload_id>/preview")
+def admin_upload_preview(upload_id):
+    """the cached preview image of an upload, shown on the dashboard.
+    404 until the worker has made it (or when it can't); an evicted one is
+    queued again.
+    """
     if not require_admin():
         return redirect(url_for("admin_login"))
 
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE uploads SET status = 'approved' WHERE id = ?",
-        (upload_id,),
+    upload_row = conn.execute(
+        "SELECT * FROM uploads WHERE id = ?", (upload_id,)
+    ).fetchone()
+    if upload_row is None:
+        return "", 404
+    file_path = upload_file_path(upload_row)
+    if not os.path.exists(file_path):
+        return "", 404
+
+    # previews are keyed by content hash; a loose file migration 13 couldn't
+    # adopt has none, and hashing it here on every dashboard view is what the
+    # migration is there to avoid
+    sha256 = upload_row["blob_sha256"]
+    if not sha256:
+        return "", 404
+    path = previews.preview_path(app.config["UPLOAD_FOLDER"], sha256)
+    if not os.path.exists(path):
+        ext = upload_row["filename"].rsplit(".", 1)[-1].lower()
+        if queue_preview(conn, sha256, file_path, EXTENSION_TYPES.get(ext)):
+            conn.commit()
+        return "", 404
+
+    previews.touch(path)
+    response = send_file(
+        path,
+        mimetype="image/jpeg",
+        conditional=True,
+        etag=f"{sha256}-{PREVIEW_SIZE}",
+        max_age=FILE_CACHE_MAX_AGE,
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+def set_upload_status(conn, upload_ids, status: str) -> int:
+    """Set the review status of many uploads in one transaction.
+    executemany runs the same prepared UPDATE for every id and we commit once.
+    returns how many rows were changed.
+    """
+    code = UPLOAD_STATUSES.index(status)
+    cur = conn.executemany(
+        "UPDATE documents SET status = ? WHERE id = ?",
+        [(code, upload_id) for upload_id in upload_ids],
     )
     conn.commit()
-    conn.close()
+    return cur.rowcount
+
+
+def set_application_status(conn, application_code: str, status: str) -> list:
+    """same for every document of one application, returns the ids it touched"""
+    rows = conn.execute(
+        """
+        UPDATE documents SET status = ?
+        WHERE application_id = (SELECT id FROM applications WHERE code = ?)
+        RETURNING id
+        """,
+        (UPLOAD_STATUSES.index(status), application_code),
+    ).fetchall()
+    conn.commit()
+    return sorted(r["id"] for r in rows)
+
+
+# route to approve a single document
+@app.route("/admin/approve/<int:upload_id>")
+def admin_approve(upload_id):
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    set_upload_status(get_db_connection(), [upload_id], "approved")
 
     flash("Document has been approved.", "success")
     return redirect(url_for("admin_dashboard"))
@@ -501,23 +2032,64 @@ def admin_reject(upload_id):
     if not require_admin():
         return redirect(url_for("admin_login"))
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE uploads SET status = 'rejected' WHERE id = ?",
-        (upload_id,),
-    )
-    conn.commit()
-    conn.close()
+    set_upload_status(get_db_connection(), [upload_id], "rejected")
 
     flash("Document has been rejected.", "warning")
     return redirect(url_for("admin_dashboard"))
 
 
+# most ids one bulk review request may touch
+MAX_BULK_REVIEW = 500
+
+
+@app.route("/admin/review", methods=["POST"])
+def admin_bulk_review():
+    """Bulk approve/reject, used by the dashboard with fetch().
+
+    body: {"status": "approved", "ids": [1, 2, 3]}
+      or: {"status": "rejected", "application_code": "12345678"}
+    all changes are written in a single transaction, the reply is JSON so the
+    page can update the badges in place instead of reloading.
+    """
+    if not require_admin():
+        return jsonify({"ok": False, "errors": ["Admin login required."]}), 401
+
+    data = request.get_json(silent=True) or {}
+    status = data.get("status")
+    ids = data.get("ids")
+    application_code = (data.get("application_code") or "").strip()
+
+    errors = []
+    if status not in UPLOAD_STATUSES:
+        errors.append("Status must be pending, approved or rejected.")
+    if application_code and ids:
+        errors.append("Send either ids or application_code, not both.")
+    elif not application_code:
+        if not isinstance(ids, list) or not ids:
+            errors.append("No documents selected.")
+        elif not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            errors.append("Document ids must be integers.")
+        elif len(ids) > MAX_BULK_REVIEW:
+            errors.append(f"At most {MAX_BULK_REVIEW} documents per request.")
+    if errors:
+        return jsonify({"ok": False, "errors": errors}), 400
+
+    conn = get_db_connection()
+    if application_code:
+        ids = set_application_status(conn, application_code, status)
+        updated = len(ids)
+    else:
+        ids = sorted(set(ids))
+        updated = set_upload_status(conn, ids, status)
+
+    return jsonify({"ok": True, "status": status, "ids": ids, "updated": updated})
+
+
 # logout route for admin
 @app.route("/admin/logout")
 def admin_logout():
     session.pop("admin_logged_in", None)
+    regenerate_session()
     flash("You have been logged out.", "info")
     return redirect(url_for("admin_login"))
 
@@ -526,52 +2098,148 @@ def admin_logout():
 # OCR API reference: https://ocr.space/OCRAPI
 
 
-def run_ocr_on_file(stored_filename: str) -> str:
-    """Small wrapper that sends the uploaded file to OCR API and returns extracted text.
-       Note: requires OCR_SPACE_API_KEY in .env
-    """
-    if not OCR_SPACE_API_KEY:
-        # failing fast if key is missing
-        raise RuntimeError("OCR_SPACE_API_KEY is not configured in .env")
+def upload_sha256(upload_row) -> str:
+    """content hash of an upload. rows from before the blob store that migration 13
+    couldn't adopt are hashed on the fly, so this is for the OCR worker only"""
+    if upload_row["blob_sha256"]:
+        return upload_row["blob_sha256"]
+    return blobstore.hash_file(upload_file_path(upload_row))[0]
+
 
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], stored_filename)
+def cached_ocr(upload_row, count_miss: bool = True):
+    """the OCR cache row (text + source) we already have for this file's content, or None"""
+    file_path = upload_file_path(upload_row)
     if not os.path.exists(file_path):
-        raise FileNotFoundError("File not found on server.")
+        return None
+    found = ocr_cache.get(
+        get_db_connection(),
+        upload_sha256(upload_row),
+        OCR_ENGINE_KEY,
+        OCR_LANGUAGE,
+        count_miss=count_miss,
+    )
+    if found is not None:
+        metrics.OCR_CACHE_LOOKUPS.inc(result="hit")
+    elif count_miss:
+        metrics.OCR_CACHE_LOOKUPS.inc(result="miss")
+    return found
+
+
+def is_pdf(upload_row) -> bool:
+    return upload_row["filename"].lower().endswith(".pdf")
+
+
+# one OCR client per process: keeps the provider connection alive between
+# calls, retries, circuit breaker + a quota shared by all workers (ocr_client.py)
+_ocr_client = None
+_ocr_client_pid = None
+_ocr_client_lock = threading.Lock()
+
+
+def get_ocr_client():
+    """this process's ocr_client.OcrSpaceClient"""
+    global _ocr_client, _ocr_client_pid
+    # imported here: ocr_client pulls in requests, which costs every worker
+    # ~70 ms at startup while only OCR jobs ever need it
+    from ocr_client import OcrSpaceClient, SharedTokenBucket
+
+    with _ocr_client_lock:
+        stale = _ocr_client is None or _ocr_client_pid != os.getpid() or (
+            (_ocr_client.api_key, _ocr_client.url) != (OCR_SPACE_API_KEY, OCR_SPACE_URL))
+        if stale:
+            _ocr_client = OcrSpaceClient(
+                OCR_SPACE_API_KEY,
+                url=OCR_SPACE_URL,
+                language=OCR_LANGUAGE,
+                engine=OCR_SPACE_ENGINE,
+                max_retries=OCR_MAX_RETRIES,
+                bucket=SharedTokenBucket(
+                    get_db_connection, "ocr.space", OCR_RATE_PER_MINUTE, OCR_RATE_BURST),
+            )
+            _ocr_client_pid = os.getpid()
+        return _ocr_client
 
-    # making an HTTP POST request with the file attached
-    # requests usage follows examples from:
-    # https://requests.readthedocs.io/en/latest/user/quickstart/#post-a-multipart-encoded-file
-    with open(file_path, "rb") as f:
-        resp = requests.post(
-            "https://api.ocr.space/parse/image",
-            files={"file": f},
-            data={
-                "apikey": OCR_SPACE_API_KEY,
-                "language": "eng",
-            },
-            timeout=30,
-        )
 
-    # basic JSON parsing based on OCR.Space docs
-    data = resp.json()
+def ocr_space_pages(fileobj, filename: str) -> list:
+    """send one file to OCR.Space and return the text of each page it parsed"""
+    if not OCR_SPACE_API_KEY:
+        # failing fast if key is missing (and for good, retrying won't add it)
+        raise jobs.PermanentJobError("OCR_SPACE_API_KEY is not configured in .env")
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        pages = get_ocr_client().parse(fileobj, filename)
+        outcome = "ok"
+        return pages
+    finally:
+        metrics.OCR_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
 
-    if data.get("IsErroredOnProcessing"):
-        # the API returns error info in ErrorMessage or ErrorDetails
-        err = data.get("ErrorMessage") or data.get("ErrorDetails")
-        raise RuntimeError(f"OCR error from provider: {err}")
 
-    parsed_results = data.get("ParsedResults") or []
-    if not parsed_results:
-        return "No text detected in document."
+def extract_document_text(upload_row, file_path: str):
+    """Get the text of a document, locally when we can.
 
-    # usually ParsedResults[0]['ParsedText'] holds the extracted text
-    return (parsed_results[0].get("ParsedText") or "").strip()
+    PDFs are read through their text layer first (pdf_text.py); only pages
+    without one are sent to OCR.Space, cut out into a smaller PDF.
+    returns (text, source) where source is 'text-layer', 'text-layer+ocr' or 'ocr'.
+    """
+    page_texts = pdf_text.extract_pages(file_path) if is_pdf(upload_row) else None
+
+    if page_texts is None:
+        with open(file_path, "rb") as f:
+            pages, source = ocr_space_pages(f, upload_row["filename"]), "ocr"
+    else:
+        missing = pdf_text.pages_needing_ocr(page_texts)
+        source = "text-layer"
+        if missing:
+            subset = pdf_text.subset_pdf(file_path, missing)
+            ocr_texts = ocr_space_pages(io.BytesIO(subset), "pages.pdf")
+            for page_index, text in zip(missing, ocr_texts):
+                page_texts[page_index] = text
+            source = "text-layer+ocr" if len(missing) < len(page_texts) else "ocr"
+        pages = page_texts
+
+    text = "\n\n".join(p for p in pages if p)
+    return text or "No text detected in document.", source
+
+
+def ocr_document(upload_row) -> dict:
+    """Text of an uploaded document plus how we got it.
+       Results are cached by content hash (see ocr_cache.py), so a file is only
+       ever read/sent to the provider once.
+       Note: image/scanned documents require OCR_SPACE_API_KEY in .env
+    """
+    file_path = upload_file_path(upload_row)
+    if not os.path.exists(file_path):
+        raise FileNotFoundError("File not found on server.")
+
+    cached = cached_ocr(upload_row)
+    if cached is not None:
+        return {"text": cached["text"], "source": cached["source"], "cached": True}
+
+    text, source = extract_document_text(upload_row, file_path)
+    ocr_cache.put(
+        get_db_connection(),
+        upload_sha256(upload_row),
+        OCR_ENGINE_KEY,
+        OCR_LANGUAGE,
+        text,
+        source,
+        OCR_CACHE_MAX_BYTES,
+    )
+    return {"text": text, "source": source, "cached": False}
+
+
+def run_ocr_on_file(upload_row) -> str:
+    """Small wrapper that returns the extracted text of an uploaded file."""
+    return ocr_document(upload_row)["text"]
 
 
 @app.route("/admin/scan/<int:upload_id>")
 def admin_scan(upload_id):
-    """Admin-only route that runs OCR on a single uploaded document and shows the text.
+    """Admin-only route that queues OCR for a single uploaded document.
        Idea: admin can quickly see if the document looks genuine / matches expectations.
+       The OCR call itself runs in a background worker (flask run-worker), this
+       route only enqueues it and sends the admin to the job status page.
     """
     if not require_admin():
         return redirect(url_for("admin_login"))
@@ -583,33 +2251,356 @@ def admin_scan(upload_id):
         (upload_id,),
     )
     upload_row = cur.fetchone()
-    conn.close()
 
     if upload_row is None:
         flash("Upload not found.", "danger")
         return redirect(url_for("admin_dashboard"))
 
-    if not OCR_SPACE_API_KEY:
+    # content we scanned before is answered straight from the OCR cache,
+    # no job and no provider call needed (a miss is counted by the job later).
+    # a file without a stored hash is left to the worker to hash
+    cached = None
+    if upload_row["blob_sha256"]:
+        cached = cached_ocr(upload_row, count_miss=False)
+    if cached is not None:
+        flash("OCR scan completed successfully (cached result).", "info")
+        return render_template(
+            "admin_scan_result.html",
+            upload=upload_row,
+            ocr_text=cached["text"],
+            ocr_source=cached["source"],
+        )
+
+    # PDFs with a text layer are read locally, everything else needs the key
+    if not OCR_SPACE_API_KEY and not (is_pdf(upload_row) and pdf_text.available()):
         flash(
             "OCR API key is not configured. Please set OCR_SPACE_API_KEY in .env.",
             "danger",
         )
         return redirect(url_for("admin_dashboard"))
 
-    try:
-        ocr_text = run_ocr_on_file(upload_row["filename"])
-        flash("OCR scan completed successfully.", "info")
-    except Exception as e:
-        ocr_text = f"OCR failed: {e}"
-        flash("There was an error while trying to scan the document.", "danger")
+    # clicking "Scan" again while a scan is still queued reuses that job
+    job_id = jobs.enqueue(
+        conn, "ocr", {"upload_id": upload_id}, dedupe_key=f"ocr:{upload_id}")
+    conn.commit()
+
+    return redirect(url_for("admin_job_status", job_id=job_id))
+
+
+def job_status_payload(job) -> dict:
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": json.loads(job["result"]) if job["result"] else None,
+        "error": job["last_error"] if job["status"] == "dead" else None,
+    }
+
+
+@app.route("/admin/jobs/<int:job_id>")
+def admin_job_status(job_id):
+    """status page for a background job, refreshes itself until the job is finished"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    conn = get_db_connection()
+    job = jobs.get(conn, job_id)
+    if job is None:
+        flash("Job not found.", "danger")
+        return redirect(url_for("admin_dashboard"))
+    if job["kind"] != "ocr":
+        # only OCR jobs have a page; previews etc. only have their status as JSON
+        return redirect(url_for("admin_job_status_json", job_id=job_id))
+
+    status = job_status_payload(job)
+    upload_id = json.loads(job["payload"]).get("upload_id")
+    upload_row = conn.execute(
+        "SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+
+    ocr_source = None
+    if job["status"] == "done":
+        ocr_text = status["result"]["text"]
+        ocr_source = status["result"].get("source")
+    elif job["status"] == "dead":
+        # the last line of the traceback is the exception itself
+        lines = (job["last_error"] or "").strip().splitlines()
+        ocr_text = "OCR failed: " + (lines[-1] if lines else "unknown error")
+    else:
+        ocr_text = None
 
     # admin_scan_result.html can show upload details + the extracted text nicely
     return render_template(
         "admin_scan_result.html",
         upload=upload_row,
         ocr_text=ocr_text,
+        ocr_source=ocr_source,
+        job=status,
+    )
+
+
+@app.route("/admin/jobs/<int:job_id>.json")
+def admin_job_status_json(job_id):
+    """same as above for fetch() polling"""
+    if not require_admin():
+        return jsonify({"ok": False, "error": "login required"}), 401
+
+    job = jobs.get(get_db_connection(), job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "job not found"}), 404
+    return jsonify({"ok": True, "job": job_status_payload(job)})
+
+
+def _timed_ocr(upload_row):
+    """runs in a pool thread: OCR one document, never raises"""
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            result, error = ocr_document(upload_row), None
+        except Exception as e:
+            result, error = {"text": None, "source": None}, str(e)
+    return {
+        "upload": upload_row,
+        "text": result["text"],
+        "source": result["source"],
+        "error": error,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def scan_application(application_code: str, summary: dict,
+                     workers: int = OCR_BATCH_WORKERS):
+    """OCR every document of one application concurrently.
+
+    Yields each result as soon as its document is done (not in upload order).
+    When the generator is exhausted, summary holds the wall time next to the
+    sum of the individual scan times, i.e. what a one-by-one scan would cost.
+    reference: https://docs.python.org/3/library/concurrent.futures.html
+    """
+    rows = get_db_connection().execute(
+        "SELECT * FROM uploads WHERE application_code = ? ORDER BY uploaded_ts, id",
+        (application_code,),
+    ).fetchall()
+    summary.update(documents=len(rows), wall_seconds=0.0, sequential_seconds=0.0)
+
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [pool.submit(_timed_ocr, row) for row in rows]
+        for future in as_completed(futures):
+            result = future.result()
+            summary["sequential_seconds"] += result["seconds"]
+            yield result
+    finally:
+        # if the admin closes the page we don't start the remaining scans
+        pool.shutdown(wait=False, cancel_futures=True)
+    summary["wall_seconds"] = time.perf_counter() - started
+
+
+@app.route("/admin/scan/application/<application_code>")
+def admin_scan_application(application_code):
+    """Scan all documents of one application at once.
+    the page is streamed, so every document shows up as soon as its scan finishes.
+    """
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    summary = {}
+    # stream_template renders while the generator runs:
+    # https://flask.palletsprojects.com/en/latest/patterns/streaming/
+    return stream_template(
+        "admin_scan_application.html",
+        application_code=application_code,
+        results=scan_application(application_code, summary),
+        summary=summary,
     )
 
+
+@app.cli.command("scan-application")
+@click.argument("application_code")
+@click.option("--workers", default=OCR_BATCH_WORKERS, show_default=True,
+              help="documents scanned at the same time")
+def scan_application_command(application_code, workers):
+    """OCR every document of an application and compare wall vs sequential time."""
+    init_db()
+    summary = {}
+    for result in scan_application(application_code, summary, workers):
+        row = result["upload"]
+        outcome = "FAILED: " + result["error"] if result["error"] else \
+            f"{len(result['text'])} chars via {result['source']}"
+        print(f"#{row['id']} {row['doc_type']:<20} {result['seconds']:6.2f}s  {outcome}")
+    print(
+        f"{summary['documents']} documents in {summary['wall_seconds']:.2f}s "
+        f"(sequential would be {summary['sequential_seconds']:.2f}s)"
+    )
+
+
+@app.route("/admin/ocr-cache")
+def admin_ocr_cache():
+    """hit/miss numbers for the OCR results cache"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    return render_template(
+        "admin_ocr_cache.html",
+        stats=ocr_cache.stats(get_db_connection()),
+        max_bytes=OCR_CACHE_MAX_BYTES,
+    )
+
+
+@app.route("/admin/metrics")
+def admin_metrics():
+    """Prometheus text format for the whole installation (all worker processes).
+    admins see it in the browser, a scraper sends Authorization: Bearer METRICS_TOKEN
+    """
+    token = request.headers.get("Authorization", "")
+    scraper = bool(METRICS_TOKEN) and secrets.compare_digest(token, f"Bearer {METRICS_TOKEN}")
+    if not (scraper or require_admin()):
+        return redirect(url_for("admin_login"))
+    if not METRICS_ENABLED:
+        return Response("metrics are turned off (METRICS_ENABLED=0)\n",
+                        status=404, content_type=metrics.CONTENT_TYPE)
+
+    conn = get_db_connection()
+    cache = ocr_cache.stats(conn)
+    metrics.OCR_CACHE_ENTRIES.set(cache["entries"])
+    metrics.OCR_CACHE_BYTES.set(cache["bytes"])
+    images = image_ingest.savings(conn)
+    metrics.NORMALIZED_IMAGES.set(images["images"])
+    metrics.NORMALIZED_IMAGE_BYTES.set(images["original_bytes"], stage="original")
+    metrics.NORMALIZED_IMAGE_BYTES.set(images["stored_bytes"], stage="stored")
+    for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+        metrics.JOBS.set(row["n"], status=row["status"])
+    return Response(metrics.collect(conn), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/admin/slow-queries")
+def admin_slow_queries():
+    """statements from the slow-query log, the most total time first"""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+
+    return render_template(
+        "admin_slow_queries.html",
+        enabled=slow_query_log is not None,
+        threshold_ms=slow_query_log.threshold * 1000 if slow_query_log else None,
+        queries=slow_query_log.summary() if slow_query_log else [],
+    )
+
+
+# -------- Background jobs --------
+# slow work runs in `flask run-worker` processes (see jobs.py); request handlers
+# only enqueue it. every job kind has one handler, registered with @job_handler.
+JOB_HANDLERS = {}
+
+
+def job_handler(kind: str):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+@job_handler("ocr")
+def ocr_job(payload: dict) -> dict:
+    upload_row = get_db_connection().execute(
+        "SELECT * FROM uploads WHERE id = ?", (payload["upload_id"],)
+    ).fetchone()
+    if upload_row is None:
+        raise jobs.PermanentJobError(f"upload {payload['upload_id']} no longer exists")
+    try:
+        result = ocr_document(upload_row)
+    except FileNotFoundError as e:
+        # the file was deleted, it won't come back by trying again
+        raise jobs.PermanentJobError(str(e)) from e
+    return {"text": result["text"], "source": result["source"]}
+
+
+@job_handler("preview")
+def preview_job(payload: dict) -> dict:
+    folder = app.config["UPLOAD_FOLDER"]
+    return previews.generate(
+        folder,
+        payload["sha256"],
+        os.path.join(folder, payload["path"]),
+        payload["kind"],
+        size=PREVIEW_SIZE,
+        max_bytes=PREVIEW_CACHE_MAX_BYTES,
+    )
+
+
+def _worker_process(once: bool):
+    """body of one worker process: lease and run jobs until told to stop"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    handlers = JOB_HANDLERS
+    if METRICS_ENABLED:
+        handlers = {kind: _timed_job(kind, func) for kind, func in JOB_HANDLERS.items()}
+    with app.app_context():
+        jobs.work(
+            get_db_connection,
+            handlers,
+            worker_id,
+            once=once,
+            should_stop=lambda: bool(stopping),
+        )
+        if METRICS_ENABLED:
+            metrics.flush(get_db_connection())
+
+
+def _timed_job(kind: str, func):
+    """job handler that also records its duration in the metrics"""
+    def run(payload):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = func(payload)
+            outcome = "ok"
+            return result
+        finally:
+            metrics.JOB_SECONDS.observe(
+                time.perf_counter() - started, kind=kind, outcome=outcome)
+            metrics.maybe_flush(get_db_connection(), METRICS_FLUSH_SECONDS)
+    return run
+
+
+# reference: https://flask.palletsprojects.com/en/latest/cli/#custom-commands
+# and https://docs.python.org/3/library/multiprocessing.html
+@app.cli.command("run-worker")
+@click.option("--processes", default=2, show_default=True,
+              help="number of worker processes to run")
+@click.option("--once", is_flag=True,
+              help="exit when the queue is empty instead of polling")
+def run_worker_command(processes, once):
+    """Run background jobs (OCR etc.) from the jobs table."""
+    init_db()
+    if processes <= 1:
+        _worker_process(once)
+        return
+
+    workers = [
+        multiprocessing.Process(target=_worker_process, args=(once,))
+        for _ in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
+
+
+@app.cli.command("requeue-dead-jobs")
+def requeue_dead_jobs_command():
+    """Give dead-lettered jobs another round of attempts."""
+    init_db()
+    count = jobs.requeue_dead(get_db_connection())
+    print(f"requeued {count} dead jobs")
+
+
 # API Route for JS Validation (optional, for front-end use)
 # client-side validation pattern here is custom for this project,
 # but the JSON response style follows the typical Flask + fetch pattern.
@@ -656,9 +2647,129 @@ def api_validate():
     return jsonify({"ok": True, "message": "Valid data"})
 
 
+# one-off maintenance command for uploads saved before the blob store existed:
+#   flask --app app dedupe-uploads
+# reference: https://flask.palletsprojects.com/en/latest/cli/#custom-commands
+@app.cli.command("dedupe-uploads")
+def dedupe_uploads_command():
+    """Move old per-upload files into the blob store, dropping duplicate copies."""
+    init_db()
+    conn = get_db_connection()
+    folder = app.config["UPLOAD_FOLDER"]
+    rows = conn.execute(
+        "SELECT DISTINCT filename FROM documents WHERE blob_sha256 IS NULL"
+    ).fetchall()
+
+    adopted = missing = removed = 0
+    for row in rows:
+        path = os.path.join(folder, row["filename"])
+        if not os.path.exists(path):
+            missing += 1
+            continue
+        sha256 = blobstore.adopt_file(conn, folder, path)
+        conn.execute(
+            "UPDATE documents SET blob_sha256 = ? WHERE filename = ? AND blob_sha256 IS NULL",
+            (sha256, row["filename"]),
+        )
+        conn.commit()
+        # only drop the loose copy once the db points at the blob
+        os.unlink(path)
+        adopted += 1
+
+    # loose copies migration 13 left behind once their blob was committed
+    rows = conn.execute(
+        "SELECT DISTINCT filename, blob_sha256 FROM documents WHERE blob_sha256 IS NOT NULL"
+    ).fetchall()
+    for row in rows:
+        path = os.path.join(folder, row["filename"])
+        if (os.path.isfile(path)
+                and os.path.exists(blobstore.blob_path(folder, row["blob_sha256"]))
+                and blobstore.hash_file(path)[0] == row["blob_sha256"]):
+            os.unlink(path)
+            removed += 1
+
+    blobs = conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    print(f"adopted {adopted} files into {blobs} blobs, {missing} missing on disk, "
+          f"{removed} leftover copies removed")
+
+
+# -------- Startup --------
+# Passenger starts a fresh worker after every idle shutdown, so the time from
+# spawn to first response matters. create_app() is the one startup path for
+# WSGI servers (passenger_wsgi.py): heavy modules (requests, pypdf) are only
+# imported when OCR runs, the schema is checked once per db file, and the
+# templates are compiled up front through an on-disk bytecode cache, so a new
+# worker loads them instead of parsing them again.
+# reference: https://jinja.palletsprojects.com/en/latest/api/#bytecode-cache
+
+# "" turns the template bytecode cache off
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "jinja"))
+
+_initialized_dbs = set()
+_initialized_dbs_lock = threading.Lock()
+
+
+def ensure_db() -> bool:
+    """init_db() once per db file in this process. returns True if it ran now"""
+    path = os.path.abspath(app.config["DB_PATH"])
+    with _initialized_dbs_lock:
+        if path in _initialized_dbs:
+            return False
+        init_db()
+        _initialized_dbs.add(path)
+    return True
+
+
+def warm_templates() -> int:
+    """compile (or load from the bytecode cache) every template now rather than
+    in the first request that renders it. returns how many there are"""
+    env = app.jinja_env
+    if JINJA_CACHE_DIR and getattr(env.bytecode_cache, "directory", None) != JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def create_app(config: dict = None, started: float = None) -> Flask:
+    """Get the app ready to serve: config overrides, schema, templates.
+    started is a time.perf_counter() taken before `import app`, so the import
+    shows up in the startup timings too (see passenger_wsgi.py).
+    """
+    begun = time.perf_counter()
+    timings = {}
+    if started is not None:
+        timings["import"] = begun - started
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+
+    step = time.perf_counter()
+    ensure_db()
+    timings["init_db"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    templates = warm_templates()
+    timings["templates"] = time.perf_counter() - step
+    timings["total"] = time.perf_counter() - (begun if started is None else started)
+
+    for phase, seconds in timings.items():
+        metrics.STARTUP_SECONDS.observe(seconds, phase=phase)
+    app.config["STARTUP_TIMINGS"] = timings
+    # one line per worker spawn in the Passenger / server log
+    print(
+        f"gnib worker {os.getpid()} ready in {timings['total'] * 1000:.0f} ms ("
+        + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in timings.items() if k != "total")
+        + f", {templates} templates)",
+        file=sys.stderr,
+    )
+    return app
+
+
 # Run the Flask app in debug mode (from Flask quickstart pattern:
 # https://flask.palletsprojects.com/en/latest/quickstart/)
 if __name__ == "__main__":
-    # making sure the sqlite table exists before the server starts
-    init_db()
-    app.run(debug=True)
+    # making sure the sqlite tables exist before the server starts
+    create_app().run(debug=True)
@@ -0,0 +1,339 @@
+"""Benchmarks for the dashboard, uploads, validation and review paths.
+
+Builds synthetic gnib_uploads.db files (in the original flat uploads format, so
+init_db() also gets timed migrating them) with 10k / 100k / 1M rows, then drives
+the app through Flask's test client and writes the timings as JSON:
+
+    python bench.py                              # 10k and 100k rows
+    python bench.py --rows 10000 100000 1000000 --out bench.json
+    python bench.py --compare old.json           # exit 1 on a regression
+
+Generated databases are kept in --data-dir and reused by later runs; every run
+works on a fresh copy, so approvals and uploads never leak between runs.
+Numbers are only comparable between runs on the same machine.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import app as gnib
+import db
+
+DEFAULT_ROWS = [10_000, 100_000]
+DEFAULT_ITERATIONS = 30
+DOCS_PER_APPLICATION = 5
+# a result slower than this much (relative) than the baseline is a regression
+DEFAULT_THRESHOLD = 0.20
+
+MAGIC = {"pdf": b"%PDF-1.4\n", "png": b"\x89PNG\r\n\x1a\n", "jpg": b"\xff\xd8\xff\xe0"}
+
+
+# -------- synthetic data --------
+
+def build_legacy_db(path: str, rows: int, seed: int = 1):
+    """a gnib_uploads.db like the app wrote before any migration, with `rows` uploads"""
+    rng = random.Random(seed)
+    categories = [(p, c, docs) for p, cats in gnib.DOC_MAP.items() for c, docs in cats.items()]
+    start = datetime(2024, 1, 1)
+    span = 2 * 365 * 24 * 3600
+
+    def generate():
+        made = 0
+        while made < rows:
+            code = "".join(rng.choice("0123456789") for _ in range(8))
+            purpose, category, docs = rng.choice(categories)
+            at = start + timedelta(seconds=rng.randrange(span))
+            for doc_type in docs[:min(len(docs), DOCS_PER_APPLICATION)]:
+                if made == rows:
+                    return
+                made += 1
+                status = rng.choices(
+                    ("pending", "approved", "rejected"), (70, 20, 10))[0]
+                expiry = "2030-01-01" if doc_type == "passport" else None
+                yield (code, purpose, category, doc_type,
+                       f"{doc_type}_{made}.pdf", expiry, status,
+                       at.strftime("%Y-%m-%d %H:%M:%S"))
+                at += timedelta(seconds=rng.randrange(1, 120))
+
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            application_code TEXT NOT NULL,
+            purpose TEXT NOT NULL,
+            category TEXT NOT NULL,
+            doc_type TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            expiry_date TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            uploaded_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.executemany(
+        """
+        INSERT INTO uploads (application_code, purpose, category, doc_type,
+                             filename, expiry_date, status, uploaded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        generate(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_db(data_dir: str, rows: int) -> str:
+    """path of the cached synthetic db for this size, built on first use"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"gnib_uploads_{rows}.db")
+    if not os.path.exists(path):
+        tmp = path + ".building"
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        build_legacy_db(tmp, rows)
+        os.replace(tmp, path)
+    return path
+
+
+def synthetic_file(ext: str, size: int) -> bytes:
+    """random bytes behind the right magic number, so each upload is a new blob"""
+    head = MAGIC["jpg" if ext == "jpeg" else ext]
+    return head + os.urandom(max(0, size - len(head)))
+
+
+# -------- timing --------
+
+def measure(name: str, rows: int, fn, iterations: int, warmup: int = 2,
+            items_per_call: int = 1) -> dict:
+    """run fn() warmup + iterations times and summarise the wall times"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    total = sum(times)
+    return {
+        "name": name,
+        "rows": rows,
+        "iterations": iterations,
+        "min_ms": round(times[0] * 1000, 3),
+        "median_ms": round(statistics.median(times) * 1000, 3),
+        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 3),
+        "mean_ms": round(total / len(times) * 1000, 3),
+        "ops_per_sec": round(iterations * items_per_call / total, 1) if total else None,
+    }
+
+
+def expect(resp, *codes):
+    if resp.status_code not in codes:
+        raise RuntimeError(f"unexpected HTTP {resp.status_code}: {resp.data[:200]!r}")
+    return resp
+
+
+# -------- scenarios --------
+
+def bench_dashboard(client, conn, rows, iterations):
+    code = conn.execute(
+        "SELECT code FROM applications ORDER BY id DESC LIMIT 1").fetchone()[0]
+    results = []
+    for name, query in (
+        ("dashboard", ""),
+        ("dashboard_search_code", f"?code={code}"),
+        ("dashboard_filter_status", "?status=approved"),
+        ("dashboard_filter_category_dates",
+         "?category=masters&date_from=2024-06-01&date_to=2024-12-31"),
+        ("dashboard_filter_readiness", "?readiness=awaiting"),
+    ):
+        results.append(measure(
+            name, rows, lambda q=query: expect(client.get(f"/admin{q}"), 200), iterations))
+
+    # 20 pages deep through the keyset cursor: stays as cheap as the first page
+    def deep_pages():
+        after = None
+        for _ in range(20):
+            rows_, after = gnib.list_uploads({}, gnib.decode_cursor(after) if after else None)
+            if not after:
+                break
+    with gnib.app.app_context():
+        results.append(measure("dashboard_20_pages", rows, deep_pages, max(3, iterations // 5)))
+    results.append(measure(
+        "applications_awaiting", rows,
+        lambda: expect(client.get("/admin/applications?readiness=awaiting"), 200),
+        iterations))
+    return results
+
+
+def bench_uploads(rows, iterations, file_size):
+    results = []
+    expiry = (datetime.today() + timedelta(days=365)).strftime("%Y-%m-%d")
+    for purpose, cats in gnib.DOC_MAP.items():
+        for category, docs in cats.items():
+            def upload_once():
+                # a new client is a new applicant, so every upload is a new application
+                client = gnib.app.test_client()
+                data = {"purpose": purpose, "category": category,
+                        "expiry_passport": expiry}
+                for i, doc_type in enumerate(docs):
+                    ext = ("pdf", "png", "jpg")[i % 3]
+                    data[f"document_{doc_type}"] = (
+                        io.BytesIO(synthetic_file(ext, file_size)), f"{doc_type}.{ext}")
+                resp = expect(client.post("/upload", data=data,
+                                          content_type="multipart/form-data"), 200)
+                if b"uploaded successfully" not in resp.data:
+                    raise RuntimeError(f"upload for {category} was not accepted")
+            results.append(measure(
+                f"upload_{category}", rows, upload_once, iterations,
+                items_per_call=len(docs)))
+    return results
+
+
+def bench_validate(client, rows, iterations):
+    body = {"purpose": "study", "category": "masters", "doc_type": "passport",
+            "expiry_date": "2030-01-01"}
+    return [measure(
+        "api_validate", rows,
+        lambda: expect(client.post("/api/validate", json=body), 200), iterations)]
+
+
+def bench_review(client, conn, rows, iterations):
+    batch = 100
+    bulk_runs = max(3, iterations // 10)
+    needed = 2 * (iterations + 2) + bulk_runs * batch
+    ids = [r[0] for r in conn.execute(
+        "SELECT id FROM documents ORDER BY id DESC LIMIT ?", (needed,))]
+    # small databases go round again (those repeats are cheaper no-op updates)
+    it = itertools.cycle(ids)
+    results = [
+        measure("approve_single", rows,
+                lambda: expect(client.get(f"/admin/approve/{next(it)}"), 302), iterations),
+        measure("reject_single", rows,
+                lambda: expect(client.get(f"/admin/reject/{next(it)}"), 302), iterations),
+    ]
+
+    def bulk():
+        chunk = [next(it) for _ in range(batch)]
+        expect(client.post("/admin/review", json={"status": "approved", "ids": chunk}), 200)
+    results.append(measure(
+        "bulk_review_100", rows, bulk, bulk_runs, warmup=0,
+        items_per_call=batch))
+    return results
+
+
+def run_size(rows: int, data_dir: str, iterations: int, file_size: int) -> list:
+    work = tempfile.mkdtemp(prefix="gnib_bench_")
+    try:
+        db_path = os.path.join(work, "gnib_uploads.db")
+        shutil.copy(legacy_db(data_dir, rows), db_path)
+        gnib.app.config.update(
+            TESTING=True,
+            DB_PATH=db_path,
+            UPLOAD_FOLDER=os.path.join(work, "uploads"),
+        )
+        os.makedirs(gnib.app.config["UPLOAD_FOLDER"])
+
+        start = time.perf_counter()
+        gnib.init_db()
+        results = [{
+            "name": "migrate_legacy_db", "rows": rows, "iterations": 1,
+            "median_ms": round((time.perf_counter() - start) * 1000, 3),
+        }]
+
+        conn = db.get_connection(db_path)
+        admin = gnib.app.test_client()
+        with admin.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+        results += bench_dashboard(admin, conn, rows, iterations)
+        results += bench_validate(gnib.app.test_client(), rows, iterations)
+        results += bench_uploads(rows, max(3, iterations // 3), file_size)
+        results += bench_review(admin, conn, rows, iterations)
+        return results
+    finally:
+        db.close_thread_connections()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# -------- output --------
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare(results: list, baseline: list, threshold: float) -> list:
+    """(name, rows, old_ms, new_ms) for every result slower than baseline by > threshold"""
+    old = {(r["name"], r["rows"]): r["median_ms"] for r in baseline}
+    slower = []
+    for r in results:
+        before = old.get((r["name"], r["rows"]))
+        if before and r["median_ms"] > before * (1 + threshold):
+            slower.append((r["name"], r["rows"], before, r["median_ms"]))
+    return slower
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS,
+                        help="database sizes to benchmark (default: 10000 100000)")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--file-kb", type=int, default=200,
+                        help="size of each synthetic uploaded file")
+    parser.add_argument("--data-dir", default="bench_data",
+                        help="where generated databases are cached")
+    parser.add_argument("--out", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in args.rows:
+        print(f"benchmarking {rows} rows...", file=sys.stderr)
+        results += run_size(rows, args.data_dir, args.iterations, args.file_kb * 1024)
+
+    report = {"environment": environment(), "results": results}
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f)["results"], args.threshold)
+        for name, rows, before, after in slower:
+            print(f"REGRESSION {name} @ {rows} rows: {before} ms -> {after} ms",
+                  file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
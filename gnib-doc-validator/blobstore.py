@@ -0,0 +1,84 @@
+"""Content-addressed document store.
+
+Every stored document lives once under uploads/blobs/<first 2 hex>/<sha256>,
+and the blobs table keeps its size, sniffed type and how many uploads rows
+point at it (refcount is maintained by triggers on the documents table, see the
+migrations in app.py; an original kept by image_ingest.py counts too). Uploading a file we already have - a resubmission, or
+the same offer letter used as college_letter and fees_proof - only adds a row
+that points at the existing blob, nothing new is written to disk.
+
+Anything else that works on file contents (OCR, previews) can key its results
+on the same hash.
+"""
+import hashlib
+import os
+import shutil
+from datetime import datetime
+
+from ingest import MAGIC_HEAD_SIZE, sniff_type
+
+BLOB_DIR = "blobs"
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def blob_path(upload_folder: str, sha256: str) -> str:
+    return os.path.join(upload_folder, BLOB_DIR, sha256[:2], sha256)
+
+
+def _register(conn, sha256: str, size: int, kind: str):
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO blobs (sha256, size, kind, refcount, created_at)
+        VALUES (?, ?, ?, 0, ?)
+        """,
+        (sha256, size, kind, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+
+
+def store_spooled(conn, upload_folder: str, spool) -> str:
+    """Keep an ingest.SpooledUpload in the store and return its hash.
+
+    If the blob is already on disk the spool is simply left for the request
+    teardown to delete, so a duplicate costs no extra write.
+    """
+    sha256 = spool.sha256
+    _register(conn, sha256, spool.size, spool.kind)
+    path = blob_path(upload_folder, sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        spool.claim(path)
+    return sha256
+
+
+def hash_file(path: str):
+    """returns (sha256, size, kind) for a file already on disk, read in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if not head:
+                head = chunk[:MAGIC_HEAD_SIZE]
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size, sniff_type(head)
+
+
+def adopt_file(conn, upload_folder: str, path: str) -> str:
+    """Put a loose (pre-blob-store) upload into the store and return its hash.
+    the blob is hard-linked (or copied) so the loose file stays valid until the
+    caller has committed the new blob_sha256 and deletes it.
+    """
+    sha256, size, kind = hash_file(path)
+    _register(conn, sha256, size, kind or "unknown")
+    dest = blob_path(upload_folder, sha256)
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+    return sha256
@@ -0,0 +1,69 @@
+"""ZIP archives built while they are being sent.
+
+zipfile can write to a stream it cannot seek in: every member then gets a data
+descriptor (sizes and CRC written after the data) instead of going back to
+patch its header. stream_zip() hands zipfile such a write-only sink and yields
+whatever landed in it after each chunk, so an archive of any size goes out
+piece by piece: no temp file, and never more than one chunk in memory.
+
+Documents are PDFs / JPEGs / PNGs, which are compressed already, so they are
+stored as they are (ZIP_STORED) instead of spending CPU on deflating them again.
+
+reference: https://docs.python.org/3/library/zipfile.html#zipfile.ZipFile.open
+"""
+import io
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _Sink(io.RawIOBase):
+    """write-only, unseekable file object that keeps what was written until drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(entries, chunk_size: int = CHUNK_SIZE):
+    """Yield a ZIP archive in pieces.
+
+    entries is an iterable of (name, source, modified) where source is the path
+    of a file to read in chunks, or bytes, and modified a unix timestamp (or None).
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for name, source, modified in entries:
+            info = zipfile.ZipInfo(name, time.localtime(modified or time.time())[:6])
+            if isinstance(source, bytes):
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, source)
+            else:
+                info.compress_type = zipfile.ZIP_STORED
+                # lets zipfile pick zip64 headers up front for very big files
+                info.file_size = os.path.getsize(source)
+                with open(source, "rb") as f, archive.open(info, "w") as member:
+                    while True:
+                        data = f.read(chunk_size)
+                        if not data:
+                            break
+                        member.write(data)
+                        if sink.chunks:
+                            yield sink.drain()
+            if sink.chunks:
+                yield sink.drain()
+    # the central directory is written when the archive is closed
+    yield sink.drain()
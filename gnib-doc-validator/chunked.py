@@ -0,0 +1,151 @@
+"""Resumable chunked uploads.
+
+A single multipart POST with every document means a dropped connection near the
+end re-sends all of it. Instead the browser can:
+
+    POST /upload/chunked              {"doc_type", "filename", "size"} -> upload id
+    PUT  /upload/chunked/<id>/<n>     raw bytes of chunk n (any order, in parallel)
+    GET  /upload/chunked/<id>         which chunks the server already has
+    POST /upload                      the normal form, with upload_<doc_type>=<id>
+                                      instead of the file: that is the finalize step
+
+Each chunk is written to uploads/.chunked/<id>/<n> (atomically, via a rename)
+and recorded in chunked_upload_parts, so re-sending a chunk is harmless and a
+client that lost its connection only sends what is missing. At finalize the
+chunks are joined into an ingest.SpooledUpload, which sizes, hashes and sniffs
+the file exactly like a normal upload, and upload() runs its usual checks.
+
+The upload id is a random token and is the only thing that gives access to an
+upload. Unfinished uploads are deleted after CHUNKED_UPLOAD_TTL.
+The tables are created by the migrations in app.py.
+"""
+import math
+import os
+import secrets
+import shutil
+import time
+
+from ingest import SpooledUpload
+
+CHUNK_DIR = ".chunked"
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+CHUNKED_UPLOAD_TTL = 24 * 3600
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class ChunkError(ValueError):
+    """the client sent something that does not fit the upload"""
+
+
+def upload_dir(upload_folder: str, upload_id: str) -> str:
+    return os.path.join(upload_folder, CHUNK_DIR, upload_id)
+
+
+def create(conn, upload_folder: str, doc_type: str, filename: str, size: int,
+           chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """start an upload and return its row. the caller has validated the fields"""
+    upload_id = secrets.token_urlsafe(24)
+    chunks = max(1, math.ceil(size / chunk_size))
+    os.makedirs(upload_dir(upload_folder, upload_id))
+    row = conn.execute(
+        """
+        INSERT INTO chunked_uploads
+        (id, doc_type, filename, size, chunk_size, chunks, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        RETURNING *
+        """,
+        (upload_id, doc_type, filename, size, chunk_size, chunks, time.time()),
+    ).fetchone()
+    conn.commit()
+    return row
+
+
+def get(conn, upload_id: str):
+    return conn.execute(
+        "SELECT * FROM chunked_uploads WHERE id = ? AND created_at > ?",
+        (upload_id, time.time() - CHUNKED_UPLOAD_TTL),
+    ).fetchone()
+
+
+def expected_size(upload, index: int) -> int:
+    """every chunk is chunk_size bytes except the last one"""
+    if index == upload["chunks"] - 1:
+        return upload["size"] - index * upload["chunk_size"]
+    return upload["chunk_size"]
+
+
+def received(conn, upload_id: str) -> list:
+    return [r["idx"] for r in conn.execute(
+        "SELECT idx FROM chunked_upload_parts WHERE upload_id = ? ORDER BY idx",
+        (upload_id,),
+    )]
+
+
+def put_chunk(conn, upload_folder: str, upload, index: int, stream):
+    """write chunk `index` from a readable stream. raises ChunkError if it does not fit"""
+    if not 0 <= index < upload["chunks"]:
+        raise ChunkError(f"Chunk {index} is out of range (0-{upload['chunks'] - 1}).")
+    want = expected_size(upload, index)
+
+    folder = upload_dir(upload_folder, upload["id"])
+    path = os.path.join(folder, str(index))
+    tmp_path = f"{path}.{secrets.token_hex(4)}.part"
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                data = stream.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                if size > want:
+                    break
+                f.write(data)
+        if size != want:
+            raise ChunkError(f"Chunk {index} must be {want} bytes.")
+        # a retried chunk simply replaces the earlier copy
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    conn.execute(
+        "INSERT OR IGNORE INTO chunked_upload_parts (upload_id, idx) VALUES (?, ?)",
+        (upload["id"], index),
+    )
+    conn.commit()
+
+
+def assemble(conn, upload_folder: str, upload, spool_dir: str, max_bytes: int):
+    """join all chunks into a SpooledUpload, or None while chunks are missing"""
+    if len(received(conn, upload["id"])) != upload["chunks"]:
+        return None
+    folder = upload_dir(upload_folder, upload["id"])
+    spool = SpooledUpload(spool_dir, max_bytes)
+    try:
+        for index in range(upload["chunks"]):
+            with open(os.path.join(folder, str(index)), "rb") as f:
+                shutil.copyfileobj(f, spool, COPY_BUFFER_SIZE)
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+
+def discard(conn, upload_folder: str, upload_id: str):
+    """forget an upload and its chunks (after finalize, or when it expired)"""
+    conn.execute("DELETE FROM chunked_upload_parts WHERE upload_id = ?", (upload_id,))
+    conn.execute("DELETE FROM chunked_uploads WHERE id = ?", (upload_id,))
+    conn.commit()
+    shutil.rmtree(upload_dir(upload_folder, upload_id), ignore_errors=True)
+
+
+def purge_expired(conn, upload_folder: str) -> int:
+    ids = [r["id"] for r in conn.execute(
+        "SELECT id FROM chunked_uploads WHERE created_at <= ?",
+        (time.time() - CHUNKED_UPLOAD_TTL,),
+    )]
+    for upload_id in ids:
+        discard(conn, upload_folder, upload_id)
+    return len(ids)
@@ -0,0 +1,159 @@
+"""Image normalization on ingest.
+
+Many passport uploads are full-resolution phone photos or browser screenshots,
+several times bigger than an admin or the OCR provider needs. After upload()
+has validated a JPEG/PNG, normalize() makes the copy that is actually kept:
+
+- the EXIF orientation is applied to the pixels (a phone stores a sideways
+  photo with a "rotate me" flag that OCR ignores), other metadata is dropped
+- images over max_pixels are downsampled to fit
+- JPEGs are re-encoded at the target quality; PNGs stay PNG, since the file
+  extension has to match the content, and are re-encoded with optimize
+
+A copy that was not rotated or shrunk is only used when it saves at least
+MIN_SAVING, so an already small JPEG is not re-compressed for a few bytes.
+
+What was done is recorded in image_normalizations, keyed by the hash of the
+original: before/after bytes and dimensions, and whether the original was kept
+too (a kept original counts as a reference in blobs.refcount, like a
+documents row). The same file uploaded again is looked up there and gets the
+same stored copy without being decoded again.
+
+Pillow is optional (loaded on first use, see previews.py); without it images
+are stored as they were uploaded.
+reference: https://pillow.readthedocs.io/en/stable/reference/ImageOps.html#PIL.ImageOps.exif_transpose
+and https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#jpeg-saving
+"""
+import io
+import time
+
+import previews
+from ingest import SpooledUpload
+
+KINDS = ("jpeg", "png")
+DEFAULT_MAX_PIXELS = 6_000_000
+DEFAULT_QUALITY = 85
+# an untouched image is only re-encoded if that makes it this much smaller
+MIN_SAVING = 0.1
+EXIF_ORIENTATION = 0x0112
+
+
+def normalize(spool, spool_dir: str, max_bytes: int,
+              max_pixels: int = DEFAULT_MAX_PIXELS, quality: int = DEFAULT_QUALITY):
+    """(new SpooledUpload, info dict) with the normalized image, or None when
+    the upload should be stored as it is. the caller closes the new spool.
+    """
+    PIL = previews.load_pil()
+    if PIL is None or spool.kind not in KINDS:
+        return None
+    spool.flush()
+    try:
+        image = PIL.Image.open(spool.path)
+        fmt = image.format
+        before = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        scale = min(1.0, (max_pixels / (before[0] * before[1])) ** 0.5)
+        if scale < 1 and fmt == "JPEG":
+            # decode at 1/2, 1/4 or 1/8 straight away when that is still big enough
+            image.draft(image.mode, (int(before[0] * scale), int(before[1] * scale)))
+        image = PIL.ImageOps.exif_transpose(image)
+        if scale < 1:
+            # sides of the rotated image, at the original resolution
+            w, h = before if orientation < 5 else before[::-1]
+            image = image.resize(
+                (max(1, int(w * scale)), max(1, int(h * scale))), PIL.Image.LANCZOS)
+
+        buf = io.BytesIO()
+        if fmt == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buf, "JPEG", quality=quality, optimize=True, progressive=True,
+                       icc_profile=image.info.get("icc_profile"))
+        else:
+            image.save(buf, "PNG", optimize=True)
+    except Exception:
+        # validated already; whatever Pillow can't handle is kept as uploaded
+        return None
+
+    data = buf.getvalue()
+    changed = orientation != 1 or scale < 1
+    if not changed and len(data) > spool.size * (1 - MIN_SAVING):
+        return None
+    # written through a SpooledUpload, so it is hashed and sniffed like an upload
+    out = SpooledUpload(spool_dir, max_bytes)
+    out.write(data)
+    if out.too_large:
+        out.close()
+        return None
+    out.flush()
+    return out, {
+        "original_sha256": spool.sha256,
+        "stored_sha256": out.sha256,
+        "original_bytes": spool.size,
+        "stored_bytes": out.size,
+        "original_width": before[0],
+        "original_height": before[1],
+        "width": image.size[0],
+        "height": image.size[1],
+        "rotated": int(orientation != 1),
+    }
+
+
+def lookup(conn, original_sha256: str):
+    """the normalization row of an original we have seen before, or None"""
+    return conn.execute(
+        "SELECT * FROM image_normalizations WHERE original_sha256 = ?",
+        (original_sha256,),
+    ).fetchone()
+
+
+def record(conn, info: dict, kept_original: bool):
+    """remember a normalization. the caller commits.
+    an upsert, not INSERT OR REPLACE: the triggers that count a kept original in
+    blobs.refcount (migration 14 in app.py) only see updates, not replaces.
+    an original kept once stays kept"""
+    conn.execute(
+        """
+        INSERT INTO image_normalizations
+        (original_sha256, stored_sha256, original_bytes, stored_bytes,
+         original_width, original_height, width, height, rotated,
+         kept_original, created_at)
+        VALUES (:original_sha256, :stored_sha256, :original_bytes, :stored_bytes,
+                :original_width, :original_height, :width, :height, :rotated,
+                :kept_original, :created_at)
+        ON CONFLICT (original_sha256) DO UPDATE SET
+            stored_sha256 = excluded.stored_sha256,
+            original_bytes = excluded.original_bytes,
+            stored_bytes = excluded.stored_bytes,
+            original_width = excluded.original_width,
+            original_height = excluded.original_height,
+            width = excluded.width,
+            height = excluded.height,
+            rotated = excluded.rotated,
+            kept_original = MAX(kept_original, excluded.kept_original),
+            created_at = excluded.created_at
+        """,
+        dict(info, kept_original=int(kept_original), created_at=time.time()),
+    )
+
+
+def keep_original(conn, original_sha256: str):
+    """note that the original of a normalization is stored as well, which also
+    counts it in blobs.refcount (trigger). the caller commits"""
+    conn.execute(
+        "UPDATE image_normalizations SET kept_original = 1 WHERE original_sha256 = ?",
+        (original_sha256,),
+    )
+
+
+def savings(conn) -> dict:
+    """totals over everything normalized so far"""
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS images,
+               COALESCE(SUM(original_bytes), 0) AS original_bytes,
+               COALESCE(SUM(stored_bytes), 0) AS stored_bytes
+        FROM image_normalizations
+        """
+    ).fetchone()
+    return dict(row)
@@ -0,0 +1,116 @@
+"""Single-pass upload ingestion.
+
+By default Werkzeug buffers every uploaded file (in memory or a temp file) and
+upload() then had to seek around to measure it and copy it again with
+file.save(). Here we plug our own stream into Werkzeug's multipart parser
+(Request._get_file_stream), so while the body is being parsed each file part is
+written in chunks straight to a temp file next to the uploads folder, and in
+the same pass we count its size, hash it with SHA-256 and sniff the magic bytes.
+
+Once a part goes over the size limit we stop writing it (and throw away what we
+already wrote), so an oversized document never costs more than the limit on disk.
+Keeping the file is a rename (os.replace), not a copy.
+
+reference: https://werkzeug.palletsprojects.com/en/latest/wrappers/#werkzeug.wrappers.Request._get_file_stream
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+
+import metrics
+
+# file signatures for the types we accept
+# reference: https://en.wikipedia.org/wiki/List_of_file_signatures
+MAGIC_TYPES = [
+    (b"%PDF-", "pdf"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+]
+MAGIC_HEAD_SIZE = 16
+
+# which sniffed type each allowed extension must have
+EXTENSION_TYPES = {"pdf": "pdf", "jpg": "jpeg", "jpeg": "jpeg", "png": "png"}
+
+
+def sniff_type(head: bytes):
+    """returns 'pdf' / 'jpeg' / 'png' from the first bytes of a file, or None"""
+    for magic, kind in MAGIC_TYPES:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+class SpooledUpload:
+    """Writable/readable temp file that measures, hashes and sniffs as it is written.
+
+    Werkzeug only needs write/read/readline/seek on it, everything that is not
+    defined here is passed through to the underlying temp file.
+    """
+
+    def __init__(self, spool_dir: str, max_bytes: int):
+        os.makedirs(spool_dir, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(
+            dir=spool_dir, prefix="part_", delete=False)
+        self.path = self._file.name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.too_large = False
+        self.claimed = False
+        self._hash = hashlib.sha256()
+        self._head = b""
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.too_large:
+            # already over the limit, just let the parser drain the part
+            return len(data)
+        if self.size > self.max_bytes:
+            self.too_large = True
+            self._file.truncate(0)
+            return len(data)
+        if len(self._head) < MAGIC_HEAD_SIZE:
+            self._head += data[:MAGIC_HEAD_SIZE - len(self._head)]
+        self._hash.update(data)
+        self._file.write(data)
+        return len(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def kind(self):
+        return sniff_type(self._head)
+
+    def claim(self, dest_path: str):
+        """keep the spooled file by moving it to dest_path (same filesystem = rename)"""
+        self._file.close()
+        os.replace(self.path, dest_path)
+        self.claimed = True
+
+    def close(self):
+        # anything nobody claimed is deleted at the end of the request
+        self._file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class IngestRequest(Request):
+    """Flask request class that spools file parts through SpooledUpload."""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        config = current_app.config
+        spool_dir = config.get("INGEST_SPOOL_DIR") or os.path.join(
+            config["UPLOAD_FOLDER"], ".incoming")
+        return SpooledUpload(spool_dir, config["INGEST_MAX_FILE_BYTES"])
+
+    def _load_form_data(self):
+        # receiving + spooling the body shows up as the "body" phase in the metrics
+        with metrics.timed_phase("body"):
+            super()._load_form_data()
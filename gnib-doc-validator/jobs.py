@@ -0,0 +1,269 @@
+"""Small durable job queue stored in the app's own SQLite db.
+
+Slow work (OCR calls and friends) is written to the jobs table by the request
+handler and picked up by `flask run-worker` processes, so a Passenger worker
+never waits on it. The life of a job:
+
+    queued --lease--> running --ok--> done
+       ^                 |
+       |   error, tries  |  error, no tries left,
+       +---- left -------+  or PermanentJobError ---> dead
+
+A lease is only valid until lease_expires (the "visibility timeout"); if a
+worker dies mid-job the job becomes leasable again once that time passes.
+While a handler runs, work() keeps pushing lease_expires forward from a side
+thread (Heartbeat), so a slow job - an OCR call with its retries and quota
+waits can take several minutes - is never handed to a second worker while the
+first one is still on it.
+Failed attempts are retried with exponential backoff, and after max_attempts
+the job is parked as 'dead' (our dead-letter queue) until someone requeues it.
+A handler raises PermanentJobError for errors retrying can't fix (missing
+configuration, a row that was deleted), and the job goes to 'dead' at once.
+
+The table itself is created by the migrations in app.py.
+"""
+import json
+import random
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_VISIBILITY_TIMEOUT = 120  # seconds a leased job stays hidden
+
+
+class PermanentJobError(Exception):
+    """raised by a handler when trying again can't succeed: no retries, straight to dead"""
+BACKOFF_BASE = 5                  # seconds before the first retry
+BACKOFF_MAX = 15 * 60
+FINISHED_JOB_TTL = 7 * 24 * 3600  # done jobs are purged after a week
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def backoff_delay(attempts: int) -> float:
+    """exponential backoff with a bit of jitter so retries don't line up"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def enqueue(conn, kind: str, payload: dict, dedupe_key: str = None,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS, delay: float = 0) -> int:
+    """Add a job and return its id.
+
+    With a dedupe_key, an identical job that is still queued/running is reused
+    instead of adding a second one (e.g. an admin clicking "Scan" twice).
+    The caller commits.
+    """
+    if dedupe_key:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)",
+            (dedupe_key, *ACTIVE_STATUSES),
+        ).fetchone()
+        if row:
+            return row["id"]
+
+    now = time.time()
+    cur = conn.execute(
+        """
+        INSERT INTO jobs (kind, payload, status, dedupe_key, max_attempts,
+                          run_after, created_at, updated_at)
+        VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)
+        """,
+        (kind, json.dumps(payload), dedupe_key, max_attempts, now + delay, now, now),
+    )
+    return cur.lastrowid
+
+
+def lease(conn, worker_id: str, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT):
+    """Claim the next runnable job for worker_id, or return None."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # leases that ran out belong to a worker that died or hung:
+        # put them back in the queue, or dead-letter them if out of attempts
+        conn.execute(
+            """
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                last_error = COALESCE(last_error, 'lease expired'),
+                leased_by = NULL, lease_expires = NULL, updated_at = ?
+            WHERE status = 'running' AND lease_expires < ?
+            """,
+            (now, now),
+        )
+        job = conn.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, leased_by = ?,
+                lease_expires = ?, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'queued' AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1
+            )
+            RETURNING *
+            """,
+            (worker_id, now + visibility_timeout, now, now),
+        ).fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job
+
+
+def complete(conn, job_id: int, worker_id: str, result) -> bool:
+    """mark a leased job done. returns False if the lease was lost meanwhile"""
+    cur = conn.execute(
+        """
+        UPDATE jobs
+        SET status = 'done', result = ?, leased_by = NULL, lease_expires = NULL,
+            updated_at = ?
+        WHERE id = ? AND status = 'running' AND leased_by = ?
+        """,
+        (json.dumps(result), time.time(), job_id, worker_id),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def extend_lease(conn, job_id: int, worker_id: str,
+                 visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+    """push the lease of a running job visibility_timeout into the future.
+    returns False if worker_id does not hold it any more"""
+    now = time.time()
+    cur = conn.execute(
+        """
+        UPDATE jobs SET lease_expires = ?, updated_at = ?
+        WHERE id = ? AND status = 'running' AND leased_by = ?
+        """,
+        (now + visibility_timeout, now, job_id, worker_id),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+class Heartbeat:
+    """extends the lease of the job a worker is running, every third of the
+    visibility timeout, from a daemon thread with its own connection.
+    a worker that dies stops beating, and its lease runs out as before.
+    """
+
+    def __init__(self, get_conn, worker_id: str, visibility_timeout: float):
+        self.get_conn = get_conn
+        self.worker_id = worker_id
+        self.visibility_timeout = visibility_timeout
+        self.job_id = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.visibility_timeout / 3):
+            job_id = self.job_id
+            if job_id is None:
+                continue
+            try:
+                extend_lease(self.get_conn(), job_id, self.worker_id,
+                             self.visibility_timeout)
+            except Exception:
+                # db busy: the next beat tries again, well before the lease ends
+                pass
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def fail(conn, job, worker_id: str, error: str, permanent: bool = False) -> bool:
+    """record a failed attempt: retry later with backoff, or dead-letter it"""
+    now = time.time()
+    if permanent or job["attempts"] >= job["max_attempts"]:
+        status, run_after = "dead", job["run_after"]
+    else:
+        status, run_after = "queued", now + backoff_delay(job["attempts"])
+    cur = conn.execute(
+        """
+        UPDATE jobs
+        SET status = ?, run_after = ?, last_error = ?, leased_by = NULL,
+            lease_expires = NULL, updated_at = ?
+        WHERE id = ? AND status = 'running' AND leased_by = ?
+        """,
+        (status, run_after, error, now, job["id"], worker_id),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def requeue_dead(conn) -> int:
+    """give every dead-lettered job a fresh set of attempts"""
+    now = time.time()
+    cur = conn.execute(
+        """
+        UPDATE jobs SET status = 'queued', attempts = 0, run_after = ?, updated_at = ?
+        WHERE status = 'dead'
+        """,
+        (now, now),
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def purge_finished(conn, older_than: float = FINISHED_JOB_TTL) -> int:
+    cur = conn.execute(
+        "DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+        (time.time() - older_than,),
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def get(conn, job_id: int):
+    return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def run_job(conn, job, handlers: dict, worker_id: str):
+    """run one leased job through its handler and record the outcome"""
+    handler = handlers.get(job["kind"])
+    if handler is None:
+        return fail(conn, job, worker_id, f"no handler for job kind {job['kind']!r}")
+    try:
+        result = handler(json.loads(job["payload"]))
+    except PermanentJobError:
+        return fail(conn, job, worker_id, traceback.format_exc(limit=5), permanent=True)
+    except Exception:
+        return fail(conn, job, worker_id, traceback.format_exc(limit=5))
+    return complete(conn, job["id"], worker_id, result)
+
+
+def work(get_conn, handlers: dict, worker_id: str, poll_interval: float = 1.0,
+         visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+         once: bool = False, should_stop=lambda: False) -> int:
+    """Worker loop: lease, run, repeat. returns how many jobs it ran.
+    with once=True it stops as soon as the queue is empty (handy for tests/cron).
+    """
+    ran = 0
+    last_purge = 0.0
+    heartbeat = Heartbeat(get_conn, worker_id, visibility_timeout)
+    try:
+        while not should_stop():
+            conn = get_conn()
+            job = lease(conn, worker_id, visibility_timeout)
+            if job is None:
+                if once:
+                    break
+                if time.time() - last_purge > 3600:
+                    purge_finished(conn)
+                    last_purge = time.time()
+                time.sleep(poll_interval)
+                continue
+            heartbeat.job_id = job["id"]
+            try:
+                run_job(conn, job, handlers, worker_id)
+            finally:
+                heartbeat.job_id = None
+            ran += 1
+    finally:
+        heartbeat.stop()
+    return ran
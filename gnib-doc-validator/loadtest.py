@@ -0,0 +1,410 @@
+"""End-to-end load test against a locally started server.
+
+bench.py times single requests through the test client; this drives mixed,
+concurrent traffic over real HTTP at the app as deployed (started through
+create_app(), like passenger_wsgi.py does) to see how many applicants and admins one deployment
+can take:
+
+- applicants: open the upload page, send a multi-file upload, then keep polling
+  their checklist
+- admins: browse the dashboard (filters, next pages), approve documents and run
+  OCR scans, waiting for each scan job to finish
+
+The server runs in a child process on a throwaway db/uploads folder, together
+with `run-worker` style job workers; OCR goes to ocr_stub.OcrStub with the
+latency you choose, never to the real OCR.Space.
+
+    python loadtest.py --applicants 20 --admins 2 --duration 60 --ocr-latency 1.5
+    python loadtest.py --server-processes 4 --out load.json
+
+Prints latency percentiles, error rate and throughput per route (and writes
+them as JSON with --out).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import requests
+
+from ocr_stub import OcrStub
+
+ADMIN_USERNAME = "loadtest"
+ADMIN_PASSWORD = "loadtest"
+
+PNG_HEAD = b"\x89PNG\r\n\x1a\n"
+PDF_HEAD = b"%PDF-1.4\n"
+
+
+# -------- server side (runs in the child process) --------
+
+def serve(port: int, workdir: str, server_processes: int, job_workers: int):
+    """start the app the way passenger_wsgi.py does (create_app), on a scratch
+    db, plus job workers"""
+    import multiprocessing
+
+    from werkzeug.serving import run_simple
+
+    started = time.perf_counter()
+    import app as gnib
+
+    application = gnib.create_app({
+        "DB_PATH": os.path.join(workdir, "gnib_uploads.db"),
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+    }, started=started)
+
+    for _ in range(job_workers):
+        multiprocessing.Process(
+            target=gnib._worker_process, args=(False,), daemon=True).start()
+
+    run_simple(
+        "127.0.0.1", port, application,
+        threaded=server_processes <= 1,
+        processes=max(1, server_processes),
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, stub_url: str, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        ADMIN_USERNAME=ADMIN_USERNAME,
+        ADMIN_PASSWORD=ADMIN_PASSWORD,
+        OCR_SPACE_API_KEY="loadtest",
+        OCR_SPACE_URL=stub_url,
+        OCR_RATE_PER_MINUTE=str(args.ocr_rate),
+        OCR_RATE_BURST=str(max(1, int(args.ocr_rate // 60))),
+        JINJA_CACHE_DIR=os.path.join(workdir, "jinja"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve",
+         "--port", str(port), "--workdir", workdir,
+         "--server-processes", str(args.server_processes),
+         "--job-workers", str(args.job_workers)],
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # own process group, so stop_server() also reaches forked workers
+        start_new_session=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return proc, base_url
+        except requests.ConnectionError:
+            if proc.poll() is not None:
+                stop_server(proc)
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError("server did not come up within 30s")
+
+
+def stop_server(proc):
+    """stop the server with its request processes and job workers"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=10)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+# -------- load side --------
+
+class Recorder:
+    """thread-safe per-route latencies and errors"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+
+    def add(self, route: str, seconds: float, ok: bool, detail: str = ""):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+                self.error_samples.setdefault(route, detail)
+
+    def report(self, elapsed: float) -> list:
+        rows = []
+        for route, times in sorted(self.latencies.items()):
+            times = sorted(times)
+
+            def pct(p):
+                return round(times[min(len(times) - 1, int(len(times) * p))] * 1000, 1)
+            rows.append({
+                "route": route,
+                "requests": len(times),
+                "errors": self.errors[route],
+                "error_rate": round(self.errors[route] / len(times), 4),
+                "rps": round(len(times) / elapsed, 2),
+                "p50_ms": round(statistics.median(times) * 1000, 1),
+                "p90_ms": pct(0.90),
+                "p95_ms": pct(0.95),
+                "p99_ms": pct(0.99),
+                "max_ms": round(times[-1] * 1000, 1),
+                "first_error": self.error_samples.get(route),
+            })
+        return rows
+
+
+class User(threading.Thread):
+    """one simulated person with their own cookie jar"""
+
+    def __init__(self, base_url: str, recorder: Recorder, stop_at: float,
+                 think_time: float, seed: int):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.recorder = recorder
+        self.stop_at = stop_at
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.http = requests.Session()
+
+    def call(self, route: str, method: str, path: str, ok_statuses=(200,), check=None,
+             **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        kwargs.setdefault("timeout", 60)
+        start = time.perf_counter()
+        try:
+            resp = self.http.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.add(route, time.perf_counter() - start, False, repr(e))
+            return None
+        ok = resp.status_code in ok_statuses and (check is None or check(resp))
+        self.recorder.add(route, time.perf_counter() - start, ok,
+                          "" if ok else f"HTTP {resp.status_code}")
+        return resp
+
+    def pause(self):
+        time.sleep(self.rng.uniform(0.5, 1.5) * self.think_time)
+
+    def running(self) -> bool:
+        return time.time() < self.stop_at
+
+
+class Applicant(User):
+
+    def __init__(self, *args, file_kb: int, checklist_polls: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_kb = file_kb
+        self.checklist_polls = checklist_polls
+
+    def random_file(self, head: bytes) -> bytes:
+        return head + os.urandom(self.file_kb * 1024 - len(head))
+
+    def run(self):
+        while self.running():
+            # a new applicant each round
+            self.http = requests.Session()
+            self.call("GET /upload", "GET", "/upload")
+            self.pause()
+
+            expiry = (datetime.today() + timedelta(days=365)).strftime("%Y-%m-%d")
+            files = {
+                # an image passport goes to (stub) OCR when scanned, the PDFs
+                # are read locally if they have a text layer (these don't)
+                "document_passport": ("passport.png", self.random_file(PNG_HEAD), "image/png"),
+                "document_college_letter": ("letter.pdf", self.random_file(PDF_HEAD), "application/pdf"),
+                "document_insurance": ("insurance.pdf", self.random_file(PDF_HEAD), "application/pdf"),
+            }
+            self.call(
+                "POST /upload", "POST", "/upload",
+                data={"purpose": "work", "category": "graduate_1g",
+                      "expiry_passport": expiry},
+                files=files,
+                check=lambda r: b"uploaded successfully" in r.content,
+            )
+
+            for _ in range(self.checklist_polls):
+                if not self.running():
+                    return
+                self.pause()
+                self.call("GET /checklist", "GET", "/checklist")
+
+
+class Admin(User):
+
+    UPLOAD_ID = re.compile(r'data-upload-id="(\d+)"')
+    NEXT_PAGE = re.compile(r'href="(/admin\?[^"]*after=[^"]+)"')
+
+    def __init__(self, *args, scan_timeout: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scan_timeout = scan_timeout
+
+    def scan(self, upload_id: str):
+        """start an OCR scan and wait for its job, timing the whole thing too"""
+        started = time.perf_counter()
+        resp = self.call("GET /admin/scan/<id>", "GET", f"/admin/scan/{upload_id}",
+                         ok_statuses=(200, 302))
+        if resp is None or resp.status_code == 200:
+            return  # cached result rendered directly, or an error
+        match = re.search(r"/admin/jobs/(\d+)", resp.headers.get("Location", ""))
+        if not match:
+            self.recorder.add("OCR scan end-to-end", time.perf_counter() - started,
+                              False, "scan did not redirect to a job")
+            return
+        job_url = f"/admin/jobs/{match.group(1)}.json"
+        while time.perf_counter() - started < self.scan_timeout:
+            time.sleep(0.25)
+            resp = self.call("GET /admin/jobs/<id>.json", "GET", job_url)
+            if resp is None or resp.status_code != 200:
+                continue
+            status = resp.json()["job"]["status"]
+            if status in ("done", "dead"):
+                self.recorder.add("OCR scan end-to-end", time.perf_counter() - started,
+                                  status == "done", f"job {status}")
+                return
+        self.recorder.add("OCR scan end-to-end", time.perf_counter() - started,
+                          False, "timed out")
+
+    def run(self):
+        self.call("POST /admin/login", "POST", "/admin/login",
+                  data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD},
+                  ok_statuses=(302,))
+        while self.running():
+            resp = self.call("GET /admin", "GET", "/admin")
+            page = resp.text if resp is not None else ""
+            self.pause()
+
+            action = self.rng.random()
+            if action < 0.3:
+                self.call("GET /admin?filters", "GET", "/admin",
+                          params={"status": "pending", "purpose": "work"})
+            elif action < 0.5:
+                next_page = self.NEXT_PAGE.search(page)
+                if next_page:
+                    self.call("GET /admin?after", "GET", next_page.group(1).replace("&amp;", "&"))
+            elif action < 0.7:
+                ids = [int(i) for i in self.UPLOAD_ID.findall(page)[:5]]
+                if ids:
+                    self.call("POST /admin/review", "POST", "/admin/review",
+                              json={"status": "approved", "ids": ids})
+            else:
+                ids = self.UPLOAD_ID.findall(page)
+                if ids:
+                    self.scan(self.rng.choice(ids))
+            self.pause()
+
+
+def print_report(rows: list, elapsed: float):
+    header = (f"{'route':<28}{'reqs':>7}{'err%':>7}{'rps':>8}"
+              f"{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    print(f"\n{elapsed:.1f}s of load")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['route']:<28}{r['requests']:>7}{r['error_rate'] * 100:>6.1f}%"
+              f"{r['rps']:>8}{r['p50_ms']:>9}{r['p90_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['max_ms']:>9}")
+    for r in rows:
+        if r["first_error"]:
+            print(f"  first error on {r['route']}: {r['first_error']}")
+
+
+def run_load(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="gnib_load_")
+    stub = OcrStub(latency=args.ocr_latency).start()
+    proc = None
+    try:
+        proc, base_url = start_server(workdir, stub.url, args)
+        recorder = Recorder()
+        started = time.time()
+        stop_at = started + args.duration
+        users = [
+            Applicant(base_url, recorder, stop_at, args.think_time, seed=i,
+                      file_kb=args.file_kb, checklist_polls=args.checklist_polls)
+            for i in range(args.applicants)
+        ] + [
+            Admin(base_url, recorder, stop_at, args.think_time, seed=1000 + i,
+                  scan_timeout=args.scan_timeout)
+            for i in range(args.admins)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.time() - started
+        return {
+            "settings": {k: v for k, v in vars(args).items() if k not in ("command", "out")},
+            "elapsed_s": round(elapsed, 2),
+            "ocr_stub_requests": stub.requests,
+            "routes": recorder.report(elapsed),
+        }
+    finally:
+        if proc is not None:
+            stop_server(proc)
+        stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command")
+
+    srv = sub.add_parser("serve", help=argparse.SUPPRESS)
+    srv.add_argument("--port", type=int, required=True)
+    srv.add_argument("--workdir", required=True)
+    srv.add_argument("--server-processes", type=int, default=1)
+    srv.add_argument("--job-workers", type=int, default=2)
+
+    parser.add_argument("--applicants", type=int, default=10,
+                        help="concurrent applicants (upload, then poll the checklist)")
+    parser.add_argument("--admins", type=int, default=2,
+                        help="concurrent admins (dashboard, review, OCR scans)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="average pause between a user's actions, seconds")
+    parser.add_argument("--file-kb", type=int, default=300, help="size of each uploaded file")
+    parser.add_argument("--checklist-polls", type=int, default=5)
+    parser.add_argument("--ocr-latency", type=float, default=1.0,
+                        help="seconds the stub OCR endpoint takes per call")
+    parser.add_argument("--ocr-rate", type=float, default=600,
+                        help="OCR calls per minute allowed by the client's token bucket")
+    parser.add_argument("--scan-timeout", type=float, default=60)
+    parser.add_argument("--server-processes", type=int, default=1,
+                        help="1 = one threaded process, N = N single-threaded processes")
+    parser.add_argument("--job-workers", type=int, default=2)
+    parser.add_argument("--out", help="also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.port, args.workdir, args.server_processes, args.job_workers)
+        return 0
+
+    report = run_load(args)
+    print_report(report["routes"], report["elapsed_s"])
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
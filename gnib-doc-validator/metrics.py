@@ -0,0 +1,468 @@
+"""Prometheus-style metrics: counters and histograms kept in memory, exposed as text.
+
+Every Passenger worker and every `flask run-worker` process counts for itself
+(no locking across processes on the hot path). Now and then each process writes
+a snapshot of its numbers into the metric_snapshots table (one row per process),
+and /admin/metrics adds all rows up, so the endpoint shows the whole
+installation and not just the worker that happened to answer the scrape.
+Rows of processes that have exited are folded into one 'retired' row.
+
+Gauges are different: they are set right before rendering from data the db
+already shares (queue sizes, cache size), so they are never snapshotted.
+
+TimedConnection is a sqlite3.Connection that times every statement, and the
+per-request phase totals (sql / template / file) let a request's latency be
+split into where it went. Statement timing covers preparing and running up to
+the first row, rows fetched later are not included. DDL, PRAGMA and
+transaction statements aren't timed, and the query labels are kept short and
+capped (query_label) so the number of series stays bounded.
+
+reference: https://prometheus.io/docs/instrumenting/exposition_formats/ and
+https://prometheus.io/docs/practices/histograms/
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+RETIRED = "retired"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def reset(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """set at scrape time, never added up across processes"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # per-bucket counts (not cumulative), the +Inf bucket last, then the sum
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def snapshot(self) -> dict:
+        """{name: [[label values, value], ...]} for counters and histograms"""
+        data = {}
+        for metric in self.metrics.values():
+            if metric.kind == "gauge":
+                continue
+            with metric.lock:
+                rows = [[list(k), v if metric.kind == "counter" else list(v)]
+                        for k, v in metric.values.items()]
+            if rows:
+                data[metric.name] = rows
+        return data
+
+    def render(self, merged: dict) -> str:
+        """Prometheus text format for merged snapshot values plus our live gauges"""
+        lines = []
+        for metric in self.metrics.values():
+            if metric.kind == "gauge":
+                with metric.lock:
+                    values = dict(metric.values)
+            else:
+                values = merged.get(metric.name, {})
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key in sorted(values):
+                labels = list(zip(metric.labels, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(values[key])}")
+                    continue
+                counts = values[key]
+                running = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), counts[:-1]):
+                    running += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(
+                        f"{metric.name}_bucket{_labels(labels + [('le', le)])} {running}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {_number(counts[-1])}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {running}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge(snapshots) -> dict:
+    """add snapshots up: {name: {label values tuple: value}}"""
+    merged = defaultdict(dict)
+    for snapshot in snapshots:
+        for name, rows in snapshot.items():
+            values = merged[name]
+            for key, value in rows:
+                key = tuple(key)
+                if isinstance(value, list):
+                    old = values.get(key)
+                    values[key] = value if old is None else [a + b for a, b in zip(old, value)]
+                else:
+                    values[key] = values.get(key, 0) + value
+    return merged
+
+
+# -------- the app's metrics --------
+
+HTTP_REQUESTS = Counter(
+    "gnib_http_requests_total", "HTTP requests by route, method and status",
+    ("route", "method", "status"))
+HTTP_SECONDS = Histogram(
+    "gnib_http_request_seconds", "time to handle a request, by route",
+    ("route", "method"))
+HTTP_PHASE_SECONDS = Histogram(
+    "gnib_http_request_phase_seconds",
+    "time a request spent in sqlite, template rendering and file writes",
+    ("route", "phase"))
+SQL_SECONDS = Histogram(
+    "gnib_sql_query_seconds", "time to run each SQL statement (until its first row)",
+    ("query",), buckets=QUERY_BUCKETS)
+UPLOADED_DOCUMENTS = Counter(
+    "gnib_uploaded_documents_total", "documents stored, by doc type", ("doc_type",))
+UPLOADED_BYTES = Counter(
+    "gnib_uploaded_bytes_total", "bytes of documents stored, by doc type", ("doc_type",))
+OCR_SECONDS = Histogram(
+    "gnib_ocr_provider_seconds",
+    "time spent waiting on the OCR provider per call, quota waits and retries included",
+    ("outcome",), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+OCR_CACHE_LOOKUPS = Counter(
+    "gnib_ocr_cache_lookups_total", "OCR cache lookups by result (hit/miss)", ("result",))
+JOB_SECONDS = Histogram(
+    "gnib_job_seconds", "time to run a background job, by kind and outcome",
+    ("kind", "outcome"), buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+STARTUP_SECONDS = Histogram(
+    "gnib_worker_startup_seconds",
+    "time for a worker process to get ready (import, init_db, templates, total)",
+    ("phase",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+OCR_CACHE_ENTRIES = Gauge("gnib_ocr_cache_entries", "results in the OCR cache")
+OCR_CACHE_BYTES = Gauge("gnib_ocr_cache_bytes", "size of the OCR cache")
+NORMALIZED_IMAGES = Gauge("gnib_normalized_images", "uploaded images normalized on ingest")
+NORMALIZED_IMAGE_BYTES = Gauge(
+    "gnib_normalized_image_bytes",
+    "total size of the normalized images as uploaded (original) and as kept (stored)",
+    ("stage",))
+JOBS = Gauge("gnib_jobs", "background jobs by status", ("status",))
+
+
+# -------- per-request phases --------
+
+_local = threading.local()
+
+
+def begin_phases():
+    _local.phases = defaultdict(float)
+
+
+def end_phases() -> dict:
+    phases = getattr(_local, "phases", None)
+    _local.phases = None
+    return phases or {}
+
+
+def add_phase(name: str, seconds: float):
+    phases = getattr(_local, "phases", None)
+    if phases is not None:
+        phases[name] += seconds
+
+
+@contextmanager
+def timed_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+
+# -------- timed sqlite connection --------
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+# schema changes, pragmas and transaction control run once or carry no query
+# worth a series of its own
+_UNTIMED = re.compile(
+    r"\s*(CREATE|DROP|ALTER|PRAGMA|BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE"
+    r"|VACUUM|ANALYZE|REINDEX)\b", re.IGNORECASE)
+# a label longer than this becomes its start plus a hash of the whole statement
+QUERY_LABEL_CHARS = 60
+# distinct query labels per process, statements seen after that count as "other"
+MAX_QUERY_LABELS = 100
+_shapes = {}
+_query_names = {}
+_seen_labels = set()
+_seen_labels_lock = threading.Lock()
+
+
+def query_shape(sql: str) -> str:
+    """the statement with whitespace squeezed and IN (?, ?, ...) lists folded,
+    so bulk actions with 3 or 300 ids are the same statement"""
+    shape = _shapes.get(sql)
+    if shape is None:
+        shape = _PLACEHOLDER_LIST.sub("?, ...", _WHITESPACE.sub(" ", sql).strip())
+        if len(_shapes) < 2000:
+            _shapes[sql] = shape
+    return shape
+
+
+def query_label(sql: str):
+    """short, stable label of a statement for gnib_sql_query_seconds, or None for
+    statements that aren't timed (DDL, PRAGMA, BEGIN/COMMIT).
+    every label is a series in every scrape, so they are capped: long statements
+    are cut to QUERY_LABEL_CHARS plus a fingerprint, and past MAX_QUERY_LABELS
+    distinct labels new ones are counted as "other".
+    """
+    if sql in _query_names:
+        return _query_names[sql]
+    if _UNTIMED.match(sql):
+        name = None
+    else:
+        name = query_shape(sql)
+        if len(name) > QUERY_LABEL_CHARS:
+            digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+            name = f"{name[:QUERY_LABEL_CHARS].rstrip()} ... #{digest}"
+        with _seen_labels_lock:
+            if name not in _seen_labels:
+                if len(_seen_labels) >= MAX_QUERY_LABELS:
+                    name = "other"
+                else:
+                    _seen_labels.add(name)
+    if len(_query_names) < 2000:
+        _query_names[sql] = name
+    return name
+
+
+def _observe_query(conn, sql: str, parameters, seconds: float):
+    label = query_label(sql)
+    if label is not None:
+        SQL_SECONDS.observe(seconds, query=label)
+    add_phase("sql", seconds)
+    slow_log = conn.slow_log
+    if slow_log is not None and seconds >= slow_log.threshold:
+        slow_log.record(conn, sql, parameters, seconds)
+
+
+def _first(seq_of_parameters):
+    """parameters of the first row of an executemany, if we can see them without
+    using up an iterator"""
+    if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters:
+        return seq_of_parameters[0]
+    return ()
+
+
+class TimedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_query(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_query(self.connection, sql, _first(seq_of_parameters),
+                           time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records how long each statement takes.
+    pass it as the factory to db.open_connection / db.get_connection.
+    set slow_log to a slowlog.SlowQueryLog to also log the slow ones.
+    """
+
+    slow_log = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_query(self, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_query(self, sql, _first(seq_of_parameters),
+                           time.perf_counter() - start)
+
+
+# -------- sharing between processes --------
+
+_process = {"pid": None, "id": None, "flushed_at": 0.0}
+_flush_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # a forked worker starts counting from zero, its parent keeps its own numbers
+    REGISTRY.reset()
+    _process["pid"] = None
+    _process["flushed_at"] = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def process_id() -> str:
+    if _process["pid"] != os.getpid():
+        _process["pid"] = os.getpid()
+        _process["id"] = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+    return _process["id"]
+
+
+def flush(conn):
+    """write this process's snapshot to the metric_snapshots table"""
+    with _flush_lock:
+        conn.execute(
+            """
+            INSERT INTO metric_snapshots (process, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (process) DO UPDATE
+            SET data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (process_id(), json.dumps(REGISTRY.snapshot()), time.time()),
+        )
+        conn.commit()
+        _process["flushed_at"] = time.monotonic()
+
+
+def maybe_flush(conn, interval: float):
+    """flush if the last one is older than interval seconds. skipped while the
+    connection is inside a transaction, so we never commit somebody else's work"""
+    if time.monotonic() - _process["flushed_at"] < interval or conn.in_transaction:
+        return
+    try:
+        flush(conn)
+    except sqlite3.OperationalError:
+        # db busy: the numbers are still here, next time
+        conn.rollback()
+
+
+def _exited(process: str) -> bool:
+    """True for rows of processes on this host that are gone"""
+    host, _, rest = process.partition(":")
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(rest.split(":")[0]), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        pass
+    return False
+
+
+def collect(conn) -> str:
+    """flush our own numbers, add up every process and render the text format"""
+    flush(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("SELECT process, data FROM metric_snapshots").fetchall()
+        gone = [r for r in rows if r["process"] != RETIRED and _exited(r["process"])]
+        if gone:
+            retired = [json.loads(r["data"]) for r in rows if r["process"] == RETIRED]
+            retired = merge(retired + [json.loads(r["data"]) for r in gone])
+            conn.execute(
+                "INSERT OR REPLACE INTO metric_snapshots (process, data, updated_at) "
+                "VALUES (?, ?, ?)",
+                (RETIRED, json.dumps({name: [[list(k), v] for k, v in values.items()]
+                                      for name, values in retired.items()}),
+                 time.time()),
+            )
+            conn.executemany(
+                "DELETE FROM metric_snapshots WHERE process = ?",
+                [(r["process"],) for r in gone])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return REGISTRY.render(merge(json.loads(r["data"]) for r in rows))
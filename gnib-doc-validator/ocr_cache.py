@@ -0,0 +1,113 @@
+"""OCR results cache, persisted in the app's SQLite db.
+
+Results are keyed by (file content sha256, engine, language), so scanning the
+same document again - or the same file under another upload id - is answered
+from the db instead of another round-trip to the rate-limited OCR provider.
+
+The cache is bounded by the total size of the cached text (max_bytes); when it
+grows past that, the least recently used entries are evicted. Hit/miss/eviction
+counters live in ocr_cache_stats so every worker process adds to the same
+numbers. Tables are created by the migrations in app.py.
+"""
+import time
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+def _bump(conn, name: str, amount: int = 1):
+    conn.execute(
+        "UPDATE ocr_cache_stats SET value = value + ? WHERE name = ?",
+        (amount, name),
+    )
+
+
+def get(conn, sha256: str, engine: str, language: str, count_miss: bool = True):
+    """cached row (text, source) for this file/engine/language, or None on a miss.
+    pass count_miss=False for a quick peek that will be followed by a real lookup.
+    """
+    row = conn.execute(
+        """
+        SELECT text, source FROM ocr_cache
+        WHERE sha256 = ? AND engine = ? AND language = ?
+        """,
+        (sha256, engine, language),
+    ).fetchone()
+    if row is None:
+        if count_miss:
+            _bump(conn, "misses")
+            conn.commit()
+        return None
+
+    conn.execute(
+        """
+        UPDATE ocr_cache SET hits = hits + 1, last_used_at = ?
+        WHERE sha256 = ? AND engine = ? AND language = ?
+        """,
+        (time.time(), sha256, engine, language),
+    )
+    _bump(conn, "hits")
+    conn.commit()
+    return row
+
+
+def put(conn, sha256: str, engine: str, language: str, text: str,
+        source: str = "ocr", max_bytes: int = DEFAULT_MAX_BYTES):
+    """store a fresh result, then evict LRU entries until we are under max_bytes"""
+    size = len(text.encode("utf-8"))
+    now = time.time()
+    old = conn.execute(
+        "SELECT size FROM ocr_cache WHERE sha256 = ? AND engine = ? AND language = ?",
+        (sha256, engine, language),
+    ).fetchone()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO ocr_cache
+        (sha256, engine, language, text, source, size, hits, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)
+        """,
+        (sha256, engine, language, text, source, size, now, now),
+    )
+    _bump(conn, "bytes", size - (old["size"] if old else 0))
+    evict(conn, max_bytes)
+    conn.commit()
+
+
+def evict(conn, max_bytes: int) -> int:
+    """drop least recently used entries while the cache is over max_bytes"""
+    evicted = 0
+    total = conn.execute(
+        "SELECT value FROM ocr_cache_stats WHERE name = 'bytes'").fetchone()[0]
+    while total > max_bytes:
+        rows = conn.execute(
+            """
+            SELECT sha256, engine, language, size FROM ocr_cache
+            ORDER BY last_used_at LIMIT 50
+            """
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            if total <= max_bytes:
+                break
+            conn.execute(
+                "DELETE FROM ocr_cache WHERE sha256 = ? AND engine = ? AND language = ?",
+                (row["sha256"], row["engine"], row["language"]),
+            )
+            total -= row["size"]
+            evicted += 1
+    if evicted:
+        conn.execute(
+            "UPDATE ocr_cache_stats SET value = ? WHERE name = 'bytes'", (total,))
+        _bump(conn, "evictions", evicted)
+    return evicted
+
+
+def stats(conn) -> dict:
+    numbers = {r["name"]: r["value"] for r in conn.execute(
+        "SELECT name, value FROM ocr_cache_stats")}
+    numbers["by_source"] = {r["source"]: r["n"] for r in conn.execute(
+        "SELECT source, COUNT(*) AS n FROM ocr_cache GROUP BY source")}
+    numbers["entries"] = sum(numbers["by_source"].values())
+    lookups = numbers["hits"] + numbers["misses"]
+    numbers["hit_ratio"] = numbers["hits"] / lookups if lookups else 0.0
+    return numbers
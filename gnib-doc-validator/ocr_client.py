@@ -0,0 +1,251 @@
+"""Resilient client for the OCR.Space API.
+
+A bare requests.post per document meant a new TCP+TLS handshake every time, no
+retry when the provider hiccups and nothing keeping us under its rate limit.
+OcrSpaceClient wraps that up:
+
+- one requests.Session with a keep-alive connection pool, shared by all threads
+- retries with exponential backoff on timeouts, connection errors, 429 and 5xx
+- a circuit breaker: after a run of failures we stop calling the provider for
+  a while and fail fast, then let a single trial call through
+- a token bucket that paces calls to the configured quota (calls per minute).
+  SharedTokenBucket keeps the bucket in SQLite so every worker process draws
+  from the same quota.
+
+reference: https://ocr.space/OCRAPI and
+https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URL = "https://api.ocr.space/parse/image"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OcrError(RuntimeError):
+    """the provider could not give us text for this document"""
+
+
+class CircuitOpenError(OcrError):
+    """the provider failed too often recently, we are not calling it for now"""
+
+
+class QuotaExceededError(OcrError):
+    """no call allowed within the quota before our wait limit ran out"""
+
+
+class TokenBucket:
+    """In-process token bucket: `rate` calls per minute, bursts up to `burst`."""
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self) -> float:
+        """take a token if there is one; returns 0, or how long to wait for one"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout: float = 60.0) -> bool:
+        """block until a call is allowed. False if that would take longer than timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Same bucket, but its state lives in a SQLite row (the rate_limits table)
+    so all processes and threads using that db share one quota.
+    get_conn must return a connection that is not inside a transaction.
+    """
+
+    def __init__(self, get_conn, name: str, rate_per_minute: float, burst: int = 1):
+        super().__init__(rate_per_minute, burst)
+        self.get_conn = get_conn
+        self.name = name
+
+    def _take(self) -> float:
+        conn = self.get_conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            tokens = self.burst if row is None else min(
+                self.burst, row["tokens"] + (now - row["updated_at"]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return wait
+
+
+class CircuitBreaker:
+    """closed -> (failure_threshold failures in a row) -> open -> (reset_timeout)
+    -> half-open: one trial call; success closes it again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def cancel_trial(self):
+        """the trial call never reached the provider, let the next caller try"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class OcrSpaceClient:
+    """Thread-safe OCR.Space client, create one per process and reuse it."""
+
+    def __init__(self, api_key: str, url: str = DEFAULT_URL, language: str = "eng",
+                 engine: str = "1", timeout: float = 30, max_retries: int = 3,
+                 backoff_base: float = 1.0, bucket: TokenBucket = None,
+                 quota_wait: float = 60.0, breaker: CircuitBreaker = None,
+                 pool_size: int = 10):
+        self.api_key = api_key
+        self.url = url
+        self.language = language
+        self.engine = engine
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.bucket = bucket
+        self.quota_wait = quota_wait
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt: int, retry_after=None) -> float:
+        if retry_after and retry_after.isdigit():
+            # honour the provider's Retry-After, within reason
+            return min(float(retry_after), 60.0)
+        return self.backoff_base * 2 ** attempt * random.uniform(0.8, 1.2)
+
+    def _post(self, fileobj, filename: str):
+        fileobj.seek(0)
+        return self.session.post(
+            self.url,
+            files={"file": (filename, fileobj)},
+            data={
+                "apikey": self.api_key,
+                "language": self.language,
+                "OCREngine": self.engine,
+            },
+            timeout=self.timeout,
+        )
+
+    def parse(self, fileobj, filename: str) -> list:
+        """OCR one file (seekable file object) and return the text of each page."""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    "OCR provider is failing, not calling it for now "
+                    f"(last error: {last_error or 'earlier requests'})")
+            if self.bucket and not self.bucket.acquire(self.quota_wait):
+                self.breaker.cancel_trial()
+                raise QuotaExceededError("OCR quota used up, try again later")
+
+            retry_after = None
+            try:
+                resp = self._post(fileobj, filename)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                last_error = f"{type(e).__name__}: {e}"
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return self._parse_response(resp)
+                last_error = f"HTTP {resp.status_code}"
+                retry_after = resp.headers.get("Retry-After")
+
+            self.breaker.record_failure()
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, retry_after))
+
+        raise OcrError(f"OCR provider failed after {self.max_retries + 1} tries: {last_error}")
+
+    @staticmethod
+    def _parse_response(resp) -> list:
+        # basic JSON parsing based on OCR.Space docs
+        try:
+            data = resp.json()
+        except ValueError:
+            raise OcrError(f"OCR provider sent a non-JSON reply (HTTP {resp.status_code})")
+
+        if data.get("IsErroredOnProcessing"):
+            # the API returns error info in ErrorMessage or ErrorDetails
+            err = data.get("ErrorMessage") or data.get("ErrorDetails")
+            raise OcrError(f"OCR error from provider: {err}")
+
+        # ParsedResults has one entry per page, each with its ParsedText
+        return [(r.get("ParsedText") or "").strip()
+                for r in data.get("ParsedResults") or []]
@@ -0,0 +1,85 @@
+"""Local stand-in for the OCR.Space API, for tests and load testing.
+
+Answers POST /parse/image like the real service (JSON with ParsedResults),
+after a configurable delay. `failures` is a list of HTTP status codes to send
+back first, one per request, before it starts answering normally - handy for
+testing retries and the circuit breaker.
+
+    stub = OcrStub(latency=0.5).start()
+    ... point OCR_SPACE_URL at stub.url ...
+    stub.stop()
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OcrStub:
+
+    def __init__(self, latency: float = 0.0, failures=None, text: str = "STUB OCR TEXT",
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.failures = list(failures or [])
+        self.text = text
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/parse/image"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _next_status(self) -> int:
+        with self.lock:
+            self.requests += 1
+            return self.failures.pop(0) if self.failures else 200
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(stub.latency)
+                status = stub._next_status()
+                if status != 200:
+                    self._reply(status, {"error": "stub failure"})
+                    return
+                if b'name="apikey"' not in body:
+                    self._reply(200, {"IsErroredOnProcessing": True,
+                                      "ErrorMessage": ["No API key"]})
+                    return
+                match = re.search(rb'filename="([^"]*)"', body)
+                filename = match.group(1).decode() if match else "file"
+                self._reply(200, {
+                    "IsErroredOnProcessing": False,
+                    "ParsedResults": [{"ParsedText": f"{stub.text} ({filename})"}],
+                })
+
+            def _reply(self, status: int, payload: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass  # keep test/load output clean
+
+        return Handler
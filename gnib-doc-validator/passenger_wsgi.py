@@ -1,5 +1,10 @@
-import sys, os
+import sys, os, time
+
+# taken before anything is imported, so create_app() can report the import time
+started = time.perf_counter()
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import app as application
+from app import create_app
+
+application = create_app(started=started)
@@ -0,0 +1,74 @@
+"""Local PDF text-layer extraction.
+
+Most PDFs we receive (offer letters, insurance certificates, fee receipts) are
+generated digitally and already carry their text, so reading it locally takes
+milliseconds and no network call. Only pages without a usable text layer
+(scans / photos saved as PDF) still need the remote OCR provider.
+
+pypdf is an optional dependency: without it every PDF simply goes to remote OCR.
+It is imported on first use, not with the app, since it adds ~60 ms to every
+worker start and most requests never read a PDF.
+reference: https://pypdf.readthedocs.io/en/stable/user/extract-text.html
+"""
+import importlib.util
+import io
+
+# a page with fewer characters than this is treated as image-only
+MIN_PAGE_CHARS = 20
+
+_pypdf = []
+
+
+def _load():
+    """the pypdf module, or None when it is not installed"""
+    if not _pypdf:
+        try:
+            import pypdf
+        except ImportError:  # pragma: no cover - optional dependency
+            pypdf = None
+        _pypdf.append(pypdf)
+    return _pypdf[0]
+
+
+def __getattr__(name):
+    # keeps `pdf_text.pypdf` / `from pdf_text import pypdf` working, lazily
+    if name == "pypdf":
+        return _load()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def available() -> bool:
+    if _pypdf:
+        return _pypdf[0] is not None
+    return importlib.util.find_spec("pypdf") is not None
+
+
+def extract_pages(path: str):
+    """text of every page, or None if the file cannot be read locally
+    (no pypdf, damaged or encrypted PDF...) and should go to remote OCR as a whole
+    """
+    pypdf = _load()
+    if pypdf is None:
+        return None
+    try:
+        reader = pypdf.PdfReader(path)
+        return [(page.extract_text() or "").strip() for page in reader.pages]
+    except Exception:
+        return None
+
+
+def pages_needing_ocr(page_texts: list) -> list:
+    """indexes of pages whose text layer is missing or too thin to trust"""
+    return [i for i, text in enumerate(page_texts) if len(text) < MIN_PAGE_CHARS]
+
+
+def subset_pdf(path: str, page_indexes: list) -> bytes:
+    """a new PDF with only the given pages, so just those go to remote OCR"""
+    pypdf = _load()
+    reader = pypdf.PdfReader(path)
+    writer = pypdf.PdfWriter()
+    for i in page_indexes:
+        writer.add_page(reader.pages[i])
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
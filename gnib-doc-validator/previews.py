@@ -0,0 +1,196 @@
+"""Small JPEG previews of uploaded documents for the admin dashboard.
+
+A preview is a thumbnail of a JPEG/PNG upload, or the first page of a PDF. It
+is made by a background job (kind "preview") right after upload() stores the
+file, and kept on disk under uploads/.previews/<sha[:2]>/<sha>.jpg - keyed by
+the content hash like the blob store, so the same file uploaded twice is
+rendered once.
+
+The cache is bounded by its total size: the least recently used previews are
+deleted until it fits in max_bytes again. "Used" is the file's mtime, which the
+dashboard touches when it serves a preview (at most once an hour per file, so
+viewing a page doesn't turn into 50 writes). Checking means walking the whole
+cache, so a process only does it on its first new preview and then each time
+it has written another EVICT_SLACK of max_bytes; the cache can overshoot by
+about that much per worker process.
+
+PDF pages are rasterized with pdftoppm (poppler) when it is installed. Without
+it, pypdf can't render a page, but a scanned PDF is one big image per page, so
+the largest image on page 1 is used; a text-only PDF then gets no preview.
+A file we can't make a preview for gets an empty "<sha>.none" marker instead,
+so it isn't queued again on every dashboard view. Markers take no space and
+are never evicted, or the file would be queued (and fail) all over again.
+
+Pillow is an optional dependency, imported on first use like pypdf in
+pdf_text.py. Without it there are no previews and the dashboard shows none.
+reference: https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.thumbnail
+and https://poppler.freedesktop.org/ (pdftoppm)
+"""
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pdf_text
+
+PREVIEW_DIR = ".previews"
+DEFAULT_SIZE = 320
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+QUALITY = 70
+# how stale a preview's mtime may get before serving it touches the file again
+TOUCH_INTERVAL = 3600
+# share of max_bytes a process writes between two walks of the cache
+EVICT_SLACK = 0.05
+
+_pil = []
+# bytes of previews this process wrote since it last checked the cache size,
+# None until the first check
+_written = {"bytes": None}
+
+
+def load_pil():
+    """the PIL package with Image and ImageOps loaded, or None when not installed.
+    image_ingest.py uses it too, so Pillow is imported in one place"""
+    if not _pil:
+        try:
+            import PIL.Image
+            import PIL.ImageOps
+        except ImportError:  # pragma: no cover - optional dependency
+            PIL = None
+        _pil.append(PIL)
+    return _pil[0]
+
+
+def available() -> bool:
+    if _pil:
+        return _pil[0] is not None
+    return importlib.util.find_spec("PIL") is not None
+
+
+def preview_path(upload_folder: str, sha256: str) -> str:
+    return os.path.join(upload_folder, PREVIEW_DIR, sha256[:2], f"{sha256}.jpg")
+
+
+def marker_path(upload_folder: str, sha256: str) -> str:
+    """empty file saying "no preview possible for this content" """
+    return os.path.join(upload_folder, PREVIEW_DIR, sha256[:2], f"{sha256}.none")
+
+
+def _pdf_first_page(PIL, path: str, size: int):
+    pdftoppm = shutil.which("pdftoppm")
+    if pdftoppm:
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "page")
+            subprocess.run(
+                [pdftoppm, "-f", "1", "-l", "1", "-singlefile", "-jpeg",
+                 "-scale-to", str(size), path, out],
+                check=True, capture_output=True, timeout=60,
+            )
+            image = PIL.Image.open(out + ".jpg")
+            image.load()
+            return image
+    pypdf = pdf_text.pypdf
+    if pypdf is None:
+        return None
+    images = list(pypdf.PdfReader(path).pages[0].images)
+    if not images:
+        return None
+    return max(images, key=lambda i: len(i.data)).image
+
+
+def render(path: str, kind: str, size: int = DEFAULT_SIZE):
+    """JPEG bytes of a preview at most size x size, or None if we can't make one
+    (no Pillow, a text-only PDF without pdftoppm, a damaged file...)"""
+    PIL = load_pil()
+    if PIL is None:
+        return None
+    try:
+        if kind == "pdf":
+            image = _pdf_first_page(PIL, path, size)
+            if image is None:
+                return None
+        else:
+            image = PIL.Image.open(path)
+            # a JPEG can be decoded at 1/2, 1/4 or 1/8 scale straight away
+            image.draft("RGB", (size, size))
+            image = PIL.ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ("RGBA", "LA", "P"):
+            # transparent PNGs would turn black as JPEG, put them on white
+            image = image.convert("RGBA")
+            background = PIL.Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        buf = io.BytesIO()
+        image.convert("RGB").save(buf, "JPEG", quality=QUALITY, optimize=True)
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+def _write(path: str, data: bytes):
+    """write through a temp file + rename so a reader never sees half a preview"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def generate(upload_folder: str, sha256: str, source: str, kind: str,
+             size: int = DEFAULT_SIZE, max_bytes: int = DEFAULT_MAX_BYTES) -> dict:
+    """render and cache the preview of one file, then trim the cache"""
+    data = render(source, kind, size)
+    if data is None:
+        _write(marker_path(upload_folder, sha256), b"")
+        return {"preview": False, "bytes": 0, "evicted": 0}
+    _write(preview_path(upload_folder, sha256), data)
+    written = _written["bytes"]
+    if written is not None and written + len(data) < max_bytes * EVICT_SLACK:
+        _written["bytes"] = written + len(data)
+        return {"preview": True, "bytes": len(data), "evicted": 0}
+    _written["bytes"] = 0
+    return {"preview": True, "bytes": len(data), "evicted": evict(upload_folder, max_bytes)}
+
+
+def touch(path: str):
+    """mark a preview as used, for the LRU eviction"""
+    now = time.time()
+    try:
+        if now - os.stat(path).st_mtime > TOUCH_INTERVAL:
+            os.utime(path, (now, now))
+    except OSError:
+        pass
+
+
+def evict(upload_folder: str, max_bytes: int) -> int:
+    """delete least recently used previews while the cache is over max_bytes.
+    .none markers are left alone"""
+    files = []
+    total = 0
+    root = os.path.join(upload_folder, PREVIEW_DIR)
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if not name.endswith(".jpg"):
+                continue  # a .none marker, or a .tmp still being written
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    return evicted
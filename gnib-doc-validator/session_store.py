@@ -0,0 +1,191 @@
+"""Server-side sessions.
+
+Flask's default session lives entirely in a signed cookie, so every request
+from an applicant re-sent (and re-verified) purpose, category and the whole
+uploaded_docs dict, and each Passenger/gunicorn worker only knew what the
+cookie told it. Here the cookie carries just a random session id; the data sits
+in a backend store (the sessions table in SQLite by default) and is read with
+one primary-key lookup.
+
+regenerate() swaps the id for a fresh one while keeping the data (call it when
+the privilege level changes, i.e. on login and logout), so an id somebody
+planted or saw before login is worth nothing afterwards - OWASP's fix for
+session fixation.
+
+Each process also keeps the most recently used sessions decoded in a small LRU.
+Rows carry a version number that goes up on every save, and the lookup only
+sends the stored payload back when our cached version is stale, so a session
+changed by another worker is never served from an old copy.
+
+reference: https://flask.palletsprojects.com/en/latest/api/#flask.sessions.SessionInterface
+"""
+import copy
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# on average one save in this many also clears out expired sessions
+PURGE_EVERY = 500
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(d):
+            d.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # the id regenerate() replaced, its row is deleted on save
+        self.replaces = None
+
+    def regenerate(self):
+        """move the data to a new random id, the old one stops working"""
+        if self.replaces is None:
+            self.replaces = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SqliteSessionStore:
+    """Session backend on the app's SQLite db (sessions table, see app.py migrations).
+    A backend only needs load / save / delete / purge_expired.
+    """
+
+    def __init__(self, get_conn):
+        self.get_conn = get_conn
+
+    def load(self, sid: str, cached_version=None):
+        """returns (version, payload) or None if the session is unknown/expired.
+        payload is None when cached_version is still current.
+        """
+        row = self.get_conn().execute(
+            """
+            SELECT version,
+                   CASE WHEN version = ? THEN NULL ELSE data END AS data
+            FROM sessions WHERE id = ? AND expires_at > ?
+            """,
+            (cached_version, sid, time.time()),
+        ).fetchone()
+        return (row["version"], row["data"]) if row else None
+
+    def save(self, sid: str, payload: str, expires_at: float) -> int:
+        """store the payload and return its new version"""
+        conn = self.get_conn()
+        version = conn.execute(
+            """
+            INSERT INTO sessions (id, data, version, expires_at) VALUES (?, ?, 1, ?)
+            ON CONFLICT (id) DO UPDATE
+            SET data = excluded.data, version = version + 1,
+                expires_at = excluded.expires_at
+            RETURNING version
+            """,
+            (sid, payload, expires_at),
+        ).fetchone()[0]
+        conn.commit()
+        return version
+
+    def delete(self, sid: str):
+        conn = self.get_conn()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self.get_conn()
+        conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in `store`, the cookie only holds the session id."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, lru_size: int = 1024):
+        self.store = store
+        self.lru_size = lru_size
+        self._lru = OrderedDict()  # sid -> (version, data)
+        self._lru_lock = threading.Lock()
+
+    def _cached(self, sid):
+        with self._lru_lock:
+            entry = self._lru.get(sid)
+            if entry is not None:
+                self._lru.move_to_end(sid)
+            return entry
+
+    def _remember(self, sid, version, data):
+        if not self.lru_size:
+            return
+        with self._lru_lock:
+            self._lru[sid] = (version, copy.deepcopy(data))
+            self._lru.move_to_end(sid)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._lru_lock:
+            self._lru.pop(sid, None)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            cached = self._cached(sid)
+            found = self.store.load(sid, cached[0] if cached else None)
+            if found is not None:
+                version, payload = found
+                if payload is None:
+                    data = copy.deepcopy(cached[1])
+                else:
+                    data = self.serializer.loads(payload)
+                    self._remember(sid, version, data)
+                return ServerSideSession(data, sid=sid)
+            self._forget(sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaces is not None:
+            self.store.delete(session.replaces)
+            self._forget(session.replaces)
+
+        if not session:
+            # emptied (e.g. logout of everything): drop the row and the cookie
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                self._forget(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not (session.modified or self.should_set_cookie(app, session)):
+            return
+
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.new:
+            version = self.store.save(
+                session.sid, self.serializer.dumps(dict(session)), expires_at)
+            self._remember(session.sid, version, dict(session))
+            if random.randrange(PURGE_EVERY) == 0:
+                self.store.purge_expired()
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            partitioned=self.get_cookie_partitioned(app),
+        )
@@ -0,0 +1,179 @@
+"""Slow-query log for the sqlite connections.
+
+Turned on with SLOW_QUERY_MS in .env. Every statement that takes longer than
+that (timed by metrics.TimedConnection) is written as one JSON line to a
+rotating log file with:
+
+- the statement (whitespace squeezed, IN (?, ?, ...) lists folded)
+- the shape of its bound parameters - types and count, never the values,
+  since those are application codes and dates of real people
+- the EXPLAIN QUERY PLAN output, and which tables it reads with a full scan.
+  uploads is a view over documents/applications, so a scan "of uploads" is
+  reported as a scan of those (the plan's aliases are mapped back to tables)
+- the endpoint that ran it, when there is one
+
+The plan is looked up once per statement shape and remembered, so a query that
+is slow a thousand times costs one EXPLAIN. /admin/slow-queries summarizes the
+log (current file plus rotated ones).
+
+reference: https://sqlite.org/eqp.html and
+https://docs.python.org/3/library/logging.handlers.html#rotatingfilehandler
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+from metrics import query_shape
+
+PLAN_CACHE_SIZE = 256
+
+# "SCAN documents" is a full table scan, "SCAN documents USING INDEX ..." is not
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+# plans name tables by their alias ("SCAN d" inside the uploads view)
+_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|"
+                    r"INNER\b|CROSS\b|USING\b|GROUP\b|ORDER\b|LIMIT\b)(\w+)", re.I)
+
+
+def param_shape(parameters) -> str:
+    """e.g. "(str, int, NoneType)", runs folded: "(int x 300)". named: "{code: str}" """
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(
+            f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    runs = []
+    for value in parameters or ():
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(n if c == 1 else f"{n} x {c}" for n, c in runs) + ")"
+
+
+def explain(conn, sql: str, parameters=()) -> list:
+    """EXPLAIN QUERY PLAN as indented lines. runs on the raw connection class so
+    it is neither timed nor logged itself"""
+    try:
+        rows = sqlite3.Connection.execute(
+            conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def aliases(*sql_texts) -> dict:
+    """{alias: table} for the "FROM table alias" / "JOIN table AS alias" in the SQL"""
+    found = {}
+    for sql in sql_texts:
+        for table, alias in _ALIAS.findall(sql):
+            found.setdefault(alias, table)
+    return found
+
+
+def full_scans(plan: list, names: dict = None) -> list:
+    """tables read with a full scan. names maps plan aliases back to tables"""
+    names = names or {}
+    scanned = {m.group(1) for line in plan for m in [_FULL_SCAN.match(line.strip())] if m}
+    return sorted(names.get(name, name) for name in scanned)
+
+
+class SlowQueryLog:
+    """writes statements slower than threshold_ms to a RotatingFileHandler.
+    context is a callable returning where we are (the Flask endpoint) or None.
+    """
+
+    def __init__(self, path: str, threshold_ms: float, max_bytes: int = 5 * 1024 * 1024,
+                 backups: int = 3, context=None):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.backups = backups
+        self.context = context
+        self._plans = OrderedDict()
+        self._plans_lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"{__name__}.{os.path.abspath(path)}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def _plan(self, conn, sql: str, parameters):
+        """(plan lines, fully scanned tables), looked up once per statement"""
+        with self._plans_lock:
+            found = self._plans.get(sql)
+            if found is not None:
+                self._plans.move_to_end(sql)
+                return found
+        plan = explain(conn, sql, parameters)
+        try:
+            views = [r[0] for r in sqlite3.Connection.execute(
+                conn, "SELECT sql FROM sqlite_master WHERE type = 'view'")]
+        except sqlite3.Error:
+            views = []
+        found = plan, full_scans(plan, aliases(sql, *views))
+        with self._plans_lock:
+            self._plans[sql] = found
+            while len(self._plans) > PLAN_CACHE_SIZE:
+                self._plans.popitem(last=False)
+        return found
+
+    def record(self, conn, sql: str, parameters, seconds: float):
+        plan, scans = self._plan(conn, sql, parameters)
+        entry = {
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "ms": round(seconds * 1000, 2),
+            "query": query_shape(sql),
+            "params": param_shape(parameters),
+            "plan": plan,
+            "full_scans": scans,
+            "route": self.context() if self.context else None,
+            "pid": os.getpid(),
+        }
+        self.logger.info(json.dumps(entry))
+
+    def files(self) -> list:
+        """the log and its rotated copies, oldest first"""
+        names = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        return [n for n in names if os.path.exists(n)]
+
+    def summary(self) -> list:
+        """one dict per statement shape, the most total time first"""
+        by_query = {}
+        for name in self.files():
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    item = by_query.setdefault(entry["query"], {
+                        "query": entry["query"], "count": 0, "total_ms": 0.0,
+                        "max_ms": 0.0, "params": set(), "routes": set()})
+                    item["count"] += 1
+                    item["total_ms"] += entry["ms"]
+                    item["max_ms"] = max(item["max_ms"], entry["ms"])
+                    item["params"].add(entry["params"])
+                    if entry.get("route"):
+                        item["routes"].add(entry["route"])
+                    # files are read oldest first, so these end up the latest
+                    item["last_seen"] = entry["ts"]
+                    item["plan"] = entry["plan"]
+                    item["full_scans"] = entry["full_scans"]
+        for item in by_query.values():
+            item["avg_ms"] = item["total_ms"] / item["count"]
+            item["params"] = sorted(item["params"])
+            item["routes"] = sorted(item["routes"])
+        return sorted(by_query.values(), key=lambda i: i["total_ms"], reverse=True)
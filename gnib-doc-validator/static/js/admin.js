@@ -0,0 +1,83 @@
+// Admin dashboard: approve / reject without reloading the page.
+// Talks to POST /admin/review (see admin_bulk_review in app.py), which writes
+// all the changes in one transaction and answers with the ids it updated.
+
+const uploadsTable = document.getElementById("uploadsTable");
+const reviewFeedback = document.getElementById("review-feedback");
+
+const statusBadges = {
+  approved: `<span class="badge bg-success">Approved</span>`,
+  rejected: `<span class="badge bg-danger">Rejected</span>`,
+  pending: `<span class="badge bg-secondary">Pending</span>`
+};
+
+function showReviewMessage(kind, text) {
+  reviewFeedback.innerHTML = `<div class="alert alert-${kind} py-2">${text}</div>`;
+}
+
+// swap the status badge of every updated row
+function markRows(ids, status) {
+  ids.forEach(id => {
+    const row = uploadsTable.querySelector(`tr[data-upload-id="${id}"]`);
+    if (!row) return;
+    row.querySelector(".status-cell").innerHTML = statusBadges[status];
+    const box = row.querySelector(".row-select");
+    if (box) box.checked = false;
+  });
+}
+
+async function sendReview(body) {
+  const resp = await fetch(uploadsTable.dataset.reviewUrl, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body)
+  });
+  const data = await resp.json();
+  if (!resp.ok || !data.ok) {
+    throw new Error((data.errors || ["Review failed."]).join(" "));
+  }
+  return data;
+}
+
+async function review(body) {
+  try {
+    const data = await sendReview(body);
+    markRows(data.ids, data.status);
+    showReviewMessage("success", `${data.updated} document(s) marked ${data.status}.`);
+  } catch (err) {
+    showReviewMessage("danger", err.message);
+  }
+}
+
+// single-row Approve / Reject links (their href still works without JS)
+uploadsTable.querySelectorAll("a[data-review]").forEach(link => {
+  link.addEventListener("click", (e) => {
+    e.preventDefault();
+    const id = Number(link.closest("tr").dataset.uploadId);
+    review({ status: link.dataset.review, ids: [id] });
+  });
+});
+
+// bulk buttons: checked rows, or a whole application code
+document.querySelectorAll("button[data-bulk-review]").forEach(btn => {
+  btn.addEventListener("click", () => {
+    const status = btn.dataset.bulkReview;
+    if (btn.dataset.applicationCode) {
+      review({ status, application_code: btn.dataset.applicationCode });
+      return;
+    }
+    const ids = [...uploadsTable.querySelectorAll(".row-select:checked")]
+      .map(box => Number(box.value));
+    if (!ids.length) {
+      showReviewMessage("warning", "Select at least one document first.");
+      return;
+    }
+    review({ status, ids });
+  });
+});
+
+document.getElementById("selectAll").addEventListener("change", (e) => {
+  uploadsTable.querySelectorAll(".row-select").forEach(box => {
+    box.checked = e.target.checked;
+  });
+});
@@ -0,0 +1,41 @@
+// ---------------------------
+// Downscales / re-encodes one JPEG or PNG off the main thread (used by validation.js).
+// createImageBitmap applies the EXIF orientation, so the result is upright and
+// carries no metadata; OffscreenCanvas draws it at the new size and encodes it.
+// PNGs stay PNG (the server checks the content matches the extension).
+// Replies with the new Blob, or null when the original should be sent as it is.
+// reference: https://developer.mozilla.org/en-US/docs/Web/API/OffscreenCanvas/convertToBlob
+// ---------------------------
+self.onmessage = async (e) => {
+  const { id, file, type, maxPixels, maxBytes, quality } = e.data;
+  try {
+    const bitmap = await createImageBitmap(file, { imageOrientation: "from-image" });
+    const pixels = bitmap.width * bitmap.height;
+    const isJpeg = type === "image/jpeg";
+
+    // PNGs only get smaller by having fewer pixels, JPEGs also by a lower quality
+    if (pixels <= maxPixels && !(isJpeg && file.size > maxBytes)) {
+      bitmap.close();
+      self.postMessage({ id, blob: null });
+      return;
+    }
+
+    const scale = Math.min(1, Math.sqrt(maxPixels / pixels));
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(bitmap, 0, 0, width, height);
+    bitmap.close();
+
+    const blob = await canvas.convertToBlob({
+      type,
+      quality
+    });
+    self.postMessage({ id, blob: blob.size < file.size ? blob : null });
+  } catch (err) {
+    // anything the browser can't decode goes up unchanged, the server checks it
+    self.postMessage({ id, blob: null });
+  }
+};
@@ -187,9 +187,10 @@ form.addEventListener("submit", (e) => {
       return;
     }
 
-    if (file.size > 5 * 1024 * 1024) {
+    // a big photo may still fit once it is shrunk, that is checked again after
+    if (file.size > MAX_FILE_BYTES && !(canShrink && IMAGE_TYPES[ext])) {
       e.preventDefault();
-      feedback.innerHTML = `<div class="alert alert-danger">Each file must be under 5MB.</div>`;
+      feedback.innerHTML = `<div class="alert alert-danger">Each file must be under ${MAX_FILE_MB}MB.</div>`;
       return;
     }
   }
@@ -200,8 +201,206 @@ form.addEventListener("submit", (e) => {
     return;
   }
 
+  // all good: send the files in chunks first (see below), then submit the form
+  if (window.fetch && window.Blob && Blob.prototype.slice) {
+    e.preventDefault();
+    uploadInChunks(fileInputs);
+  }
+
 });
 
+// ---------------------------
+// Image shrinking before upload (worker: image_worker.js)
+// Phone photos and screenshots over the pixel or byte budget are downscaled and
+// re-encoded in a Web Worker, so the page stays responsive while a slow
+// connection gets a fraction of the bytes to send. The budgets come from the
+// server (IMAGE_MAX_PIXELS / IMAGE_QUALITY in app.py), which normalizes whatever
+// still arrives big (image_ingest.py). Without Worker + OffscreenCanvas the
+// files are sent as they are.
+// ---------------------------
+const MAX_FILE_MB = Number(form.dataset.maxFileMb || 5);
+const MAX_FILE_BYTES = MAX_FILE_MB * 1024 * 1024;
+const IMAGE_MAX_PIXELS = Number(form.dataset.imageMaxPixels || 6000000);
+const IMAGE_MAX_BYTES = 1024 * 1024;
+const IMAGE_QUALITY = Number(form.dataset.imageQuality || 85) / 100;
+const IMAGE_TYPES = { jpg: "image/jpeg", jpeg: "image/jpeg", png: "image/png" };
+
+let canShrink = Boolean(window.Worker && window.OffscreenCanvas &&
+                        window.createImageBitmap && form.dataset.imageWorker);
+let imageWorker = null;
+let nextShrinkId = 0;
+const pendingShrinks = new Map();
+
+function startImageWorker() {
+  imageWorker = new Worker(form.dataset.imageWorker);
+  imageWorker.onmessage = (e) => {
+    const done = pendingShrinks.get(e.data.id);
+    pendingShrinks.delete(e.data.id);
+    if (done) done(e.data.blob);
+  };
+  // the worker could not start: send everything as it is
+  imageWorker.onerror = () => {
+    canShrink = false;
+    pendingShrinks.forEach(done => done(null));
+    pendingShrinks.clear();
+  };
+}
+
+// resolves to a smaller File, or the original one
+function shrinkImage(file) {
+  const type = IMAGE_TYPES[file.name.split(".").pop().toLowerCase()];
+  if (!canShrink || !type) return Promise.resolve(file);
+  if (!imageWorker) startImageWorker();
+  return new Promise(resolve => {
+    const id = nextShrinkId++;
+    pendingShrinks.set(id, blob => resolve(blob
+      ? new File([blob], file.name, { type, lastModified: file.lastModified })
+      : file));
+    imageWorker.postMessage({
+      id, file, type,
+      maxPixels: IMAGE_MAX_PIXELS,
+      maxBytes: IMAGE_MAX_BYTES,
+      quality: IMAGE_QUALITY
+    });
+  });
+}
+
+// ---------------------------
+// Resumable chunked uploads (server side: chunked.py)
+// Every file is cut into chunks that are PUT a few at a time, across all files.
+// A failed chunk is retried with backoff; if the connection is gone for good
+// the upload ids are kept in localStorage, so pressing Upload again only sends
+// the chunks the server does not have yet. When everything is there the normal
+// form is submitted with upload_<doc_type>=<id> instead of the files, and
+// upload() runs its usual checks on them.
+// ---------------------------
+const PARALLEL_CHUNKS = 4;
+const CHUNK_RETRIES = 5;
+
+let uploading = false;
+
+function resumeKey(docType, file) {
+  return `chunked:${docType}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function postJSON(url, body) {
+  const resp = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body)
+  });
+  const data = await resp.json();
+  if (!resp.ok) throw new Error((data.errors || ["Upload failed."]).join(" "));
+  return data;
+}
+
+// an upload we started earlier for this exact file, or a new one
+async function openUpload(docType, file) {
+  const key = resumeKey(docType, file);
+  const known = localStorage.getItem(key);
+  if (known) {
+    const resp = await fetch(`/upload/chunked/${known}`);
+    if (resp.ok) return resp.json();
+    localStorage.removeItem(key);
+  }
+  const upload = await postJSON("/upload/chunked", {
+    doc_type: docType, filename: file.name, size: file.size
+  });
+  localStorage.setItem(key, upload.upload_id);
+  return upload;
+}
+
+async function putChunk(upload, file, index) {
+  const start = index * upload.chunk_size;
+  const body = file.slice(start, start + upload.chunk_size);
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const resp = await fetch(`/upload/chunked/${upload.upload_id}/${index}`, {
+        method: "PUT",
+        body
+      });
+      if (resp.ok) return;
+      // 4xx other than 429 will not get better by retrying
+      if (resp.status < 500 && resp.status !== 429) {
+        const data = await resp.json().catch(() => ({}));
+        throw Object.assign(new Error((data.errors || ["Upload failed."]).join(" ")), { fatal: true });
+      }
+    } catch (err) {
+      if (err.fatal || attempt >= CHUNK_RETRIES) throw err;
+    }
+    if (attempt >= CHUNK_RETRIES) throw new Error("Upload failed.");
+    await new Promise(r => setTimeout(r, 500 * 2 ** attempt));
+  }
+}
+
+function showProgress(done, total) {
+  const pct = total ? Math.round(100 * done / total) : 100;
+  feedback.innerHTML = `
+    <div class="progress" role="progressbar" aria-valuenow="${pct}" aria-valuemin="0" aria-valuemax="100">
+      <div class="progress-bar" style="width: ${pct}%">${pct}%</div>
+    </div>`;
+}
+
+async function uploadInChunks(fileInputs) {
+  if (uploading) return;
+  uploading = true;
+  try {
+    const selected = [...fileInputs].filter(input => input.files[0]);
+
+    // shrink big images first, the size limit applies to what is actually sent
+    if (canShrink) {
+      feedback.innerHTML = `<div class="alert alert-info">Preparing images&hellip;</div>`;
+    }
+    const files = await Promise.all(selected.map(input => shrinkImage(input.files[0])));
+    const tooBig = files.find(file => file.size > MAX_FILE_BYTES);
+    if (tooBig) {
+      uploading = false;
+      feedback.innerHTML = `<div class="alert alert-danger">Each file must be under ${MAX_FILE_MB}MB.</div>`;
+      return;
+    }
+
+    const uploads = await Promise.all(selected.map((input, i) =>
+      openUpload(input.name.replace("document_", ""), files[i])
+    ));
+
+    // one queue of missing chunks for all files, worked by PARALLEL_CHUNKS senders
+    const queue = [];
+    uploads.forEach((upload, i) => {
+      const have = new Set(upload.received);
+      for (let n = 0; n < upload.chunks; n++) {
+        if (!have.has(n)) queue.push([upload, files[i], n]);
+      }
+    });
+    const total = uploads.reduce((sum, u) => sum + u.chunks, 0);
+    let done = total - queue.length;
+    showProgress(done, total);
+
+    const sender = async () => {
+      while (queue.length) {
+        const [upload, file, n] = queue.shift();
+        await putChunk(upload, file, n);
+        showProgress(++done, total);
+      }
+    };
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, sender));
+
+    // finalize: the form goes to upload() with upload ids instead of files
+    selected.forEach((input, i) => {
+      const hidden = document.createElement("input");
+      hidden.type = "hidden";
+      hidden.name = input.name.replace("document_", "upload_");
+      hidden.value = uploads[i].upload_id;
+      form.appendChild(hidden);
+      input.disabled = true;
+    });
+    form.submit();
+  } catch (err) {
+    uploading = false;
+    feedback.innerHTML = `<div class="alert alert-danger">${err.message || "Upload failed."}
+      Press "Upload All Documents" again to continue where it stopped.</div>`;
+  }
+}
+
 // handles for when the page loads 
 document.addEventListener("DOMContentLoaded", () => {
   const p = purposeEl.value;
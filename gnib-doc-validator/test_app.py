@@ -1,5 +1,43 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import zipfile
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
+
+import flask
+
+import app as gnib
+import bench
+import blobstore
+import bundle
+import chunked
+import db
+import jobs
+import loadtest
+import metrics
+import ocr_cache
+import pdf_text
+import previews
+import slowlog
+from ingest import SpooledUpload
+from ocr_client import (CircuitBreaker, CircuitOpenError, OcrError,
+                        OcrSpaceClient, SharedTokenBucket, TokenBucket)
+from ocr_stub import OcrStub
+from session_store import ServerSideSessionInterface, SqliteSessionStore
+from pdf_text import pypdf
 from app import allowed_file, passport_is_valid
 
 
@@ -26,3 +64,1466 @@ class TestPassportExpiry(unittest.TestCase):
     def test_expired_passport(self):
         past_date = (datetime.today() - timedelta(days=365)
                      )
+
+
+class TestDbPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "test.db")
+
+    def tearDown(self):
+        db.close_thread_connections()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_connection_is_reused_in_wal_mode(self):
+        conn = db.get_connection(self.db_path)
+        self.assertIs(conn, db.get_connection(self.db_path))
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_each_thread_gets_its_own_connection(self):
+        main_conn = db.get_connection(self.db_path)
+        seen = []
+        t = threading.Thread(
+            target=lambda: seen.append(db.get_connection(self.db_path)))
+        t.start()
+        t.join()
+        self.assertIsNot(seen[0], main_conn)
+
+    def test_release_rolls_back_open_transaction(self):
+        conn = db.get_connection(self.db_path)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+        db.release(conn)
+        self.assertEqual(conn.execute(
+            "SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def test_closed_connection_is_replaced(self):
+        conn = db.get_connection(self.db_path)
+        conn.close()
+        self.assertIsNot(db.get_connection(self.db_path), conn)
+
+
+class AppTestCase(unittest.TestCase):
+    """base class: points the app at a throwaway db + uploads folder"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        gnib.app.config.update(
+            TESTING=True,
+            DB_PATH=os.path.join(self.tmp, "test.db"),
+            UPLOAD_FOLDER=os.path.join(self.tmp, "uploads"),
+        )
+        os.makedirs(gnib.app.config["UPLOAD_FOLDER"])
+        gnib.init_db()
+        self.client = gnib.app.test_client()
+
+    def tearDown(self):
+        db.close_thread_connections()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def login_admin(self):
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def add_uploads(self, n, **overrides):
+        conn = gnib.get_db_connection()
+        for i in range(n):
+            row = {
+                "application_code": "12345678",
+                "purpose": "study",
+                "category": "masters",
+                "doc_type": "passport",
+                "filename": f"file_{i}.pdf",
+                "expiry_date": None,
+                "status": "pending",
+                "uploaded_at": f"2025-12-{1 + i % 28:02d} 10:00:00",
+            }
+            row.update(overrides)
+            row["uploaded_at"] = int(datetime.strptime(
+                row["uploaded_at"], "%Y-%m-%d %H:%M:%S").timestamp())
+            gnib.insert_document(conn, **row)
+        conn.commit()
+
+    def post_graduate(self, files, expiry=None):
+        expiry = expiry or (datetime.today() + timedelta(days=365)).strftime("%Y-%m-%d")
+        data = {"purpose": "work", "category": "graduate_1g",
+                "expiry_passport": expiry}
+        for doc_type, (content, name) in files.items():
+            data[f"document_{doc_type}"] = (io.BytesIO(content), name)
+        return self.client.post("/upload", data=data,
+                                content_type="multipart/form-data")
+
+    def stored_files(self):
+        blobs = os.path.join(gnib.app.config["UPLOAD_FOLDER"], "blobs")
+        return [f for _, _, files in os.walk(blobs) for f in files]
+
+
+class TestDashboardPaging(AppTestCase):
+
+    def test_migrations_create_indexes(self):
+        conn = gnib.get_db_connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        self.assertEqual(version, len(gnib.MIGRATIONS))
+        names = {r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn("idx_documents_application", names)
+        self.assertIn("idx_documents_status", names)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        self.add_uploads(120)
+        seen, after = [], None
+        with gnib.app.app_context():
+            while True:
+                rows, cursor = gnib.list_uploads({}, gnib.decode_cursor(after), limit=50)
+                seen.extend(r["id"] for r in rows)
+                if not cursor:
+                    break
+                after = cursor
+        self.assertEqual(sorted(seen), list(range(1, 121)))
+
+    def test_dashboard_filters_by_status(self):
+        self.add_uploads(3)
+        self.add_uploads(2, status="approved", filename="approved.pdf")
+        self.login_admin()
+        resp = self.client.get("/admin?status=approved")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data.count(b"badge bg-success"), 2)
+        self.assertNotIn(b"badge bg-secondary", resp.data)
+
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 2048
+
+
+def make_pdf(*page_texts):
+    """tiny real PDF, one page per text (an empty text = image-only page)"""
+    n = len(page_texts)
+    font_id = 3 + 2 * n
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % (3 + 2 * i) for i in range(n)), n),
+    ]
+    for i, text in enumerate(page_texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text.encode() if text else b""
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (font_id, 4 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = io.BytesIO(b"%PDF-1.4\n")
+    out.seek(0, os.SEEK_END)
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+              % (len(objects) + 1, xref))
+    return out.getvalue()
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"0" * 2048
+
+
+class TestUploadIngestion(AppTestCase):
+
+    def test_valid_upload_is_moved_into_place(self):
+        resp = self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES + b"1", "insurance.pdf"),
+        })
+        self.assertIn(b"uploaded successfully", resp.data)
+        self.assertEqual(len(self.stored_files()), 3)
+        # no spooled temp files are left behind
+        spool = os.path.join(gnib.app.config["UPLOAD_FOLDER"], ".incoming")
+        self.assertEqual(os.listdir(spool), [])
+
+    def test_binary_files_bigger_than_a_read_chunk_are_accepted(self):
+        # random bytes have few line breaks, the parser must not mistake them for a huge field
+        png = PNG_BYTES + os.urandom(300 * 1024)
+        resp = self.post_graduate({
+            "passport": (png, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        self.assertIn(b"uploaded successfully", resp.data)
+
+    def test_oversized_file_is_rejected_and_not_kept(self):
+        big = b"%PDF-" + b"0" * (gnib.app.config["INGEST_MAX_FILE_BYTES"] + 1)
+        resp = self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (big, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        self.assertIn(b"File must be under", resp.data)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_upload_form_carries_the_image_budgets(self):
+        # validation.js shrinks images in the browser with the server's settings
+        page = self.client.get("/upload").data
+        self.assertIn(f'data-image-max-pixels="{gnib.IMAGE_MAX_PIXELS}"'.encode(), page)
+        self.assertIn(f'data-max-file-mb="{gnib.MAX_FILE_SIZE_MB}"'.encode(), page)
+        worker = self.client.get("/static/js/image_worker.js")
+        self.assertEqual(worker.status_code, 200)
+        self.assertIn(b"OffscreenCanvas", worker.data)
+        worker.close()
+
+    def test_content_must_match_extension(self):
+        resp = self.post_graduate({
+            "passport": (PDF_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        self.assertIn(b"not a valid PNG file", resp.data)
+
+    def test_request_over_content_length_is_refused(self):
+        gnib.app.config["MAX_CONTENT_LENGTH"] = 1024
+        try:
+            resp = self.post_graduate({"passport": (PNG_BYTES, "passport.png")})
+        finally:
+            gnib.app.config["MAX_CONTENT_LENGTH"] = (
+                gnib.MAX_DOCS * gnib.MAX_FILE_SIZE_MB + 1) * 1024 * 1024
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_spool_hashes_while_writing(self):
+        spool = SpooledUpload(self.tmp, max_bytes=10)
+        spool.write(b"%PDF-")
+        spool.write(b"1.4")
+        self.assertEqual(spool.size, 8)
+        self.assertEqual(spool.kind, "pdf")
+        self.assertEqual(spool.sha256, hashlib.sha256(b"%PDF-1.4").hexdigest())
+        spool.close()
+        self.assertFalse(os.path.exists(spool.path))
+
+
+class TestBlobStore(AppTestCase):
+
+    def blob_refcounts(self):
+        conn = gnib.get_db_connection()
+        return sorted(r[0] for r in conn.execute("SELECT refcount FROM blobs"))
+
+    def test_same_file_for_several_docs_is_stored_once(self):
+        files = {
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "offer.pdf"),
+            "insurance": (PDF_BYTES, "offer.pdf"),
+        }
+        self.post_graduate(files)
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(self.blob_refcounts(), [1, 2])
+
+        # resubmitting the same documents adds rows but no files
+        self.post_graduate(files)
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(self.blob_refcounts(), [2, 4])
+
+    def test_dedupe_command_adopts_loose_files(self):
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        for name in ("a_1_offer.pdf", "b_2_offer.pdf"):
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(PDF_BYTES)
+        self.add_uploads(1, filename="a_1_offer.pdf")
+        self.add_uploads(1, filename="b_2_offer.pdf")
+
+        result = gnib.app.test_cli_runner().invoke(args=["dedupe-uploads"])
+        self.assertIn("adopted 2 files into 1 blobs", result.output)
+        self.assertEqual(self.blob_refcounts(), [2])
+        self.assertFalse(os.path.exists(os.path.join(folder, "a_1_offer.pdf")))
+        row = gnib.get_db_connection().execute(
+            "SELECT * FROM uploads WHERE id = 1").fetchone()
+        with open(gnib.upload_file_path(row), "rb") as f:
+            self.assertEqual(f.read(), PDF_BYTES)
+
+    def test_migration_adopts_loose_files_once(self):
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        loose = os.path.join(folder, "a_1_offer.pdf")
+        with open(loose, "wb") as f:
+            f.write(PDF_BYTES)
+        self.add_uploads(1, filename="a_1_offer.pdf")
+        conn = gnib.get_db_connection()
+        # migration 13 on its own, as if the db had just been upgraded
+        gnib.adopt_loose_uploads(conn)
+        conn.commit()
+        sha = hashlib.sha256(PDF_BYTES).hexdigest()
+        self.assertEqual(conn.execute(
+            "SELECT blob_sha256 FROM documents").fetchone()[0], sha)
+        self.assertEqual(self.blob_refcounts(), [1])
+
+        # serving it no longer reads the whole file
+        self.login_admin()
+        with mock.patch.object(blobstore, "hash_file", side_effect=AssertionError):
+            resp = self.client.get("/admin/uploads/1/file")
+        self.assertEqual((resp.status_code, resp.get_etag()), (200, (sha, False)))
+        resp.close()
+
+        result = gnib.app.test_cli_runner().invoke(args=["dedupe-uploads"])
+        self.assertIn("1 leftover copies removed", result.output)
+        self.assertFalse(os.path.exists(loose))
+        self.assertEqual(self.client.get("/admin/uploads/1/file").status_code, 200)
+
+    def test_files_left_loose_are_never_hashed_per_request(self):
+        with open(os.path.join(gnib.app.config["UPLOAD_FOLDER"], "a_1_offer.pdf"), "wb") as f:
+            f.write(PDF_BYTES)
+        self.add_uploads(1, filename="a_1_offer.pdf")
+        self.login_admin()
+        with mock.patch.object(blobstore, "hash_file", side_effect=AssertionError):
+            resp = self.client.get("/admin/uploads/1/file")
+            etag = resp.get_etag()[0]
+            resp.close()
+            self.assertEqual(resp.status_code, 200)
+            resp = self.client.get("/admin/uploads/1/file",
+                                   headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(self.client.get("/admin/uploads/1/preview").status_code, 404)
+
+
+
+class TestJobQueue(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conn = gnib.get_db_connection()
+
+    def test_lease_complete(self):
+        job_id = jobs.enqueue(self.conn, "echo", {"x": 1})
+        self.conn.commit()
+        job = jobs.lease(self.conn, "w1")
+        self.assertEqual(job["id"], job_id)
+        self.assertIsNone(jobs.lease(self.conn, "w2"))
+        self.assertTrue(jobs.complete(self.conn, job_id, "w1", {"ok": True}))
+        self.assertEqual(jobs.get(self.conn, job_id)["status"], "done")
+
+    def test_expired_lease_is_picked_up_again(self):
+        job_id = jobs.enqueue(self.conn, "echo", {})
+        self.conn.commit()
+        jobs.lease(self.conn, "w1", visibility_timeout=-1)
+        job = jobs.lease(self.conn, "w2")
+        self.assertEqual((job["id"], job["attempts"]), (job_id, 2))
+        # the first worker lost its lease and cannot finish the job any more
+        self.assertFalse(jobs.complete(self.conn, job_id, "w1", None))
+
+    def test_lease_is_kept_while_a_slow_job_runs(self):
+        job_id = jobs.enqueue(self.conn, "slow", {})
+        self.conn.commit()
+        stolen = []
+
+        def slow(payload):
+            # three visibility timeouts later nobody else may have taken it
+            time.sleep(0.9)
+            stolen.append(jobs.lease(self.conn, "w2", visibility_timeout=0.3))
+            return "ok"
+
+        with gnib.app.app_context():
+            jobs.work(gnib.get_db_connection, {"slow": slow}, "w1",
+                      visibility_timeout=0.3, once=True)
+        self.assertEqual(stolen, [None])
+        job = jobs.get(self.conn, job_id)
+        self.assertEqual((job["status"], job["attempts"]), ("done", 1))
+
+    def test_failures_back_off_then_dead_letter(self):
+        job_id = jobs.enqueue(self.conn, "boom", {}, max_attempts=2)
+        self.conn.commit()
+        handlers = {"boom": lambda payload: 1 / 0}
+
+        jobs.run_job(self.conn, jobs.lease(self.conn, "w1"), handlers, "w1")
+        job = jobs.get(self.conn, job_id)
+        self.assertEqual(job["status"], "queued")
+        self.assertGreater(job["run_after"], time.time())
+
+        self.conn.execute("UPDATE jobs SET run_after = 0")
+        self.conn.commit()
+        jobs.run_job(self.conn, jobs.lease(self.conn, "w1"), handlers, "w1")
+        job = jobs.get(self.conn, job_id)
+        self.assertEqual(job["status"], "dead")
+        self.assertIn("ZeroDivisionError", job["last_error"])
+
+    def test_permanent_errors_are_dead_after_one_attempt(self):
+        with open(os.path.join(gnib.app.config["UPLOAD_FOLDER"], "scan.png"), "wb") as f:
+            f.write(PNG_BYTES)
+        self.add_uploads(1, filename="scan.png")
+        no_key = jobs.enqueue(self.conn, "ocr", {"upload_id": 1})
+        deleted = jobs.enqueue(self.conn, "ocr", {"upload_id": 99})
+        self.conn.commit()
+        with mock.patch.object(gnib, "OCR_SPACE_API_KEY", None):
+            with gnib.app.app_context():
+                jobs.work(gnib.get_db_connection, gnib.JOB_HANDLERS, "w1", once=True)
+        for job_id, error in ((no_key, "OCR_SPACE_API_KEY"), (deleted, "no longer exists")):
+            job = jobs.get(self.conn, job_id)
+            self.assertEqual((job["status"], job["attempts"]), ("dead", 1))
+            self.assertIn(error, job["last_error"])
+
+    def test_scan_route_enqueues_and_worker_runs_it(self):
+        self.add_uploads(1)
+        self.login_admin()
+        with mock.patch.object(gnib, "OCR_SPACE_API_KEY", "key"):
+            resp = self.client.get("/admin/scan/1")
+            again = self.client.get("/admin/scan/1")
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn("/admin/jobs/1", resp.headers["Location"])
+        self.assertEqual(again.headers["Location"], resp.headers["Location"])
+        self.assertIn(b"refresh", self.client.get("/admin/jobs/1").data)
+
+        result = {"text": "PASSPORT", "source": "ocr"}
+        with mock.patch.object(gnib, "ocr_document", return_value=result):
+            with gnib.app.app_context():
+                ran = jobs.work(gnib.get_db_connection, gnib.JOB_HANDLERS,
+                                "test", once=True)
+        self.assertEqual(ran, 1)
+        status = self.client.get("/admin/jobs/1.json").get_json()
+        self.assertEqual(status["job"]["status"], "done")
+        self.assertEqual(status["job"]["result"], result)
+
+    def test_dead_job_without_error_text_still_renders(self):
+        self.add_uploads(1)
+        self.login_admin()
+        job_id = jobs.enqueue(self.conn, "ocr", {"upload_id": 1}, max_attempts=1)
+        self.conn.commit()
+        job = jobs.lease(self.conn, "w1")
+        jobs.fail(self.conn, job, "w1", "  \n")
+        resp = self.client.get(f"/admin/jobs/{job_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"OCR failed: unknown error", resp.data)
+
+
+class TestOcrCache(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conn = gnib.get_db_connection()
+
+    def test_second_scan_of_same_content_skips_provider(self):
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "offer.pdf"),
+            "insurance": (PDF_BYTES, "offer.pdf"),
+        })
+        rows = self.conn.execute("SELECT * FROM uploads ORDER BY id").fetchall()
+        stub = OcrStub(text="OFFER LETTER").start()
+        self.addCleanup(stub.stop)
+
+        with mock.patch.object(gnib, "OCR_SPACE_API_KEY", "key"), \
+                mock.patch.object(gnib, "OCR_SPACE_URL", stub.url), \
+                gnib.app.app_context():
+            first = gnib.run_ocr_on_file(rows[1])
+            # insurance is the same file under another upload id
+            second = gnib.run_ocr_on_file(rows[2])
+
+        self.assertIn("OFFER LETTER", first)
+        self.assertEqual(second, first)
+        self.assertEqual(stub.requests, 1)
+        stats = ocr_cache.stats(self.conn)
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        # the scan route answers a cached document without queueing a job
+        self.login_admin()
+        resp = self.client.get(f"/admin/scan/{rows[2]['id']}")
+        self.assertIn(b"OFFER LETTER", resp.data)
+        self.assertEqual(self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE kind = 'ocr'").fetchone()[0], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        ocr_cache.put(self.conn, "a", "e", "eng", "x" * 60, max_bytes=100)
+        ocr_cache.put(self.conn, "b", "e", "eng", "y" * 30, max_bytes=100)
+        ocr_cache.get(self.conn, "a", "e", "eng")
+        ocr_cache.put(self.conn, "c", "e", "eng", "z" * 30, max_bytes=100)
+        self.assertIsNone(ocr_cache.get(self.conn, "b", "e", "eng"))
+        self.assertIsNotNone(ocr_cache.get(self.conn, "a", "e", "eng"))
+        stats = ocr_cache.stats(self.conn)
+        self.assertEqual((stats["bytes"], stats["evictions"]), (90, 1))
+
+
+class TestApplicationBatchScan(AppTestCase):
+
+    def fake_ocr(self, upload_row):
+        time.sleep(0.2)
+        if upload_row["doc_type"] == "insurance":
+            raise RuntimeError("provider down")
+        return {"text": f"text of {upload_row['doc_type']}", "source": "ocr"}
+
+    def test_documents_are_scanned_concurrently(self):
+        for doc_type in ("passport", "college_letter", "insurance"):
+            self.add_uploads(1, doc_type=doc_type)
+        self.add_uploads(1, application_code="99999999")
+        self.login_admin()
+
+        with mock.patch.object(gnib, "ocr_document", self.fake_ocr):
+            resp = self.client.get("/admin/scan/application/12345678")
+            page = resp.get_data(as_text=True)
+
+        self.assertIn("text of passport", page)
+        self.assertIn("text of college_letter", page)
+        self.assertIn("OCR failed: provider down", page)
+        self.assertIn("Scanned 3 documents", page)
+
+        summary = {}
+        with mock.patch.object(gnib, "ocr_document", self.fake_ocr), \
+                gnib.app.app_context():
+            results = list(gnib.scan_application("12345678", summary, workers=3))
+        self.assertEqual(len(results), 3)
+        self.assertLess(summary["wall_seconds"], summary["sequential_seconds"] / 2)
+
+
+@unittest.skipUnless(pdf_text.available(), "pypdf not installed")
+class TestPdfTextLayer(AppTestCase):
+
+    def upload_row(self, content):
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (content, "offer.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        return gnib.get_db_connection().execute(
+            "SELECT * FROM uploads WHERE doc_type = 'college_letter'").fetchone()
+
+    def test_pdf_with_text_layer_is_read_locally(self):
+        row = self.upload_row(make_pdf("Offer of a place on the MSc programme"))
+        with mock.patch.object(gnib, "ocr_space_pages") as provider, \
+                gnib.app.app_context():
+            result = gnib.ocr_document(row)
+        provider.assert_not_called()
+        self.assertEqual(result["source"], "text-layer")
+        self.assertIn("MSc programme", result["text"])
+
+    def test_only_image_pages_go_to_remote_ocr(self):
+        row = self.upload_row(make_pdf("Page one has real text on it", ""))
+        with mock.patch.object(gnib, "ocr_space_pages",
+                               return_value=["scanned page two"]) as provider, \
+                gnib.app.app_context():
+            result = gnib.ocr_document(row)
+        self.assertEqual(provider.call_count, 1)
+        sent = pypdf.PdfReader(provider.call_args[0][0])
+        self.assertEqual(len(sent.pages), 1)
+        self.assertEqual(result["source"], "text-layer+ocr")
+        self.assertIn("real text", result["text"])
+        self.assertIn("scanned page two", result["text"])
+
+
+class TestOcrClient(AppTestCase):
+
+    def make_client(self, stub, **kwargs):
+        kwargs.setdefault("backoff_base", 0.01)
+        return OcrSpaceClient("key", url=stub.url, **kwargs)
+
+    def start_stub(self, **kwargs):
+        stub = OcrStub(**kwargs).start()
+        self.addCleanup(stub.stop)
+        return stub
+
+    def test_retries_server_errors(self):
+        stub = self.start_stub(failures=[503, 500])
+        pages = self.make_client(stub).parse(io.BytesIO(PDF_BYTES), "a.pdf")
+        self.assertEqual(pages, ["STUB OCR TEXT (a.pdf)"])
+        self.assertEqual(stub.requests, 3)
+
+    def test_gives_up_after_max_retries(self):
+        stub = self.start_stub(failures=[502] * 5)
+        with self.assertRaises(OcrError):
+            self.make_client(stub, max_retries=2).parse(io.BytesIO(PDF_BYTES), "a.pdf")
+        self.assertEqual(stub.requests, 3)
+
+    def test_circuit_breaker_fails_fast_then_recovers(self):
+        stub = self.start_stub(failures=[500] * 3)
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+        client = self.make_client(stub, max_retries=0, breaker=breaker)
+        for _ in range(3):
+            with self.assertRaises(OcrError):
+                client.parse(io.BytesIO(PDF_BYTES), "a.pdf")
+        with self.assertRaises(CircuitOpenError):
+            client.parse(io.BytesIO(PDF_BYTES), "a.pdf")
+        self.assertEqual(stub.requests, 3)
+
+        time.sleep(0.25)  # half-open: one trial call goes through and succeeds
+        client.parse(io.BytesIO(PDF_BYTES), "a.pdf")
+        self.assertEqual(breaker.state, "closed")
+
+    def test_token_bucket_paces_calls(self):
+        bucket = TokenBucket(rate_per_minute=600, burst=2)  # one every 0.1 s
+        started = time.monotonic()
+        for _ in range(4):
+            self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+        # one call a minute: a second call can't be had within 10 ms
+        slow = TokenBucket(rate_per_minute=1, burst=1)
+        self.assertTrue(slow.acquire())
+        self.assertFalse(slow.acquire(timeout=0.01))
+
+    def test_shared_bucket_is_one_quota_for_all_users(self):
+        with gnib.app.app_context():
+            a = SharedTokenBucket(gnib.get_db_connection, "ocr", 1, burst=2)
+            b = SharedTokenBucket(gnib.get_db_connection, "ocr", 1, burst=2)
+            self.assertTrue(a.acquire(timeout=0))
+            self.assertTrue(b.acquire(timeout=0))
+            self.assertFalse(a.acquire(timeout=0))
+
+
+class TestBulkReview(AppTestCase):
+
+    def review(self, body):
+        return self.client.post("/admin/review", json=body)
+
+    def statuses(self):
+        return [r[0] for r in gnib.get_db_connection().execute(
+            "SELECT status FROM uploads ORDER BY id")]
+
+    def test_requires_admin(self):
+        self.assertEqual(self.review({"status": "approved", "ids": [1]}).status_code, 401)
+
+    def test_ids_are_updated_in_one_request(self):
+        self.add_uploads(4)
+        self.login_admin()
+        resp = self.review({"status": "approved", "ids": [1, 3, 3, 99]})
+        self.assertEqual(resp.get_json(),
+                         {"ok": True, "status": "approved", "ids": [1, 3, 99], "updated": 2})
+        self.assertEqual(self.statuses(), ["approved", "pending", "approved", "pending"])
+
+    def test_whole_application(self):
+        self.add_uploads(2)
+        self.add_uploads(1, application_code="99999999")
+        self.login_admin()
+        resp = self.review({"status": "rejected", "application_code": "12345678"})
+        self.assertEqual(resp.get_json()["ids"], [1, 2])
+        self.assertEqual(self.statuses(), ["rejected", "rejected", "pending"])
+
+    def test_bad_requests(self):
+        self.login_admin()
+        self.assertEqual(self.review({"status": "maybe", "ids": [1]}).status_code, 400)
+        self.assertEqual(self.review({"status": "approved", "ids": ["1"]}).status_code, 400)
+        self.assertEqual(self.review({"status": "approved"}).status_code, 400)
+
+
+class TestServerSideSessions(AppTestCase):
+
+    def test_cookie_only_carries_an_id(self):
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        cookie = self.client.get_cookie("session")
+        self.assertLess(len(cookie.value), 50)
+        row = gnib.get_db_connection().execute(
+            "SELECT data FROM sessions WHERE id = ?", (cookie.value,)).fetchone()
+        self.assertIn("uploaded_docs", row["data"])
+        # the checklist is rebuilt from the server-side copy
+        page = self.client.get("/checklist").get_data(as_text=True)
+        self.assertNotIn("Not uploaded", page)
+        self.assertIn("All required documents are ready", page)
+
+    def test_workers_never_serve_a_stale_cached_copy(self):
+        store = SqliteSessionStore(gnib.get_db_connection)
+        worker_a = ServerSideSessionInterface(store)
+        worker_b = ServerSideSessionInterface(store)
+        app = gnib.app
+
+        with app.test_request_context():
+            sess = worker_a.open_session(app, flask.request)
+            sess["purpose"] = "study"
+            worker_a.save_session(app, sess, app.response_class())
+            sid = sess.sid
+
+        def open_in(worker):
+            with app.test_request_context(headers={"Cookie": f"session={sid}"}):
+                return worker.open_session(app, flask.request)
+
+        # both workers now have version 1 cached
+        self.assertEqual(open_in(worker_a)["purpose"], "study")
+        self.assertEqual(open_in(worker_b)["purpose"], "study")
+
+        sess = open_in(worker_b)
+        sess["purpose"] = "work"
+        with app.test_request_context():
+            worker_b.save_session(app, sess, app.response_class())
+        self.assertEqual(open_in(worker_a)["purpose"], "work")
+
+    def test_login_and_logout_issue_a_new_session_id(self):
+        self.client.get("/")
+        planted = self.client.get_cookie("session").value
+        with mock.patch.object(gnib, "ADMIN_USERNAME", "admin"), \
+                mock.patch.object(gnib, "ADMIN_PASSWORD", "secret"):
+            self.client.post("/admin/login",
+                             data={"username": "admin", "password": "secret"})
+        logged_in = self.client.get_cookie("session").value
+        self.assertNotEqual(logged_in, planted)
+        conn = gnib.get_db_connection()
+        self.assertIsNone(conn.execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (planted,)).fetchone())
+        self.assertEqual(self.client.get("/admin").status_code, 200)
+
+        # whoever knew the id from before login is not logged in
+        other = gnib.app.test_client()
+        other.set_cookie("session", planted)
+        self.assertEqual(other.get("/admin").status_code, 302)
+
+        self.client.get("/admin/logout")
+        self.assertNotIn(self.client.get_cookie("session").value, (planted, logged_in))
+        other.set_cookie("session", logged_in)
+        self.assertEqual(other.get("/admin").status_code, 302)
+
+
+class TestChunkedUploads(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        gnib.app.config["UPLOAD_CHUNK_SIZE"] = 1024
+
+    def tearDown(self):
+        gnib.app.config["UPLOAD_CHUNK_SIZE"] = chunked.DEFAULT_CHUNK_SIZE
+        super().tearDown()
+
+    def start(self, doc_type, content, name):
+        resp = self.client.post("/upload/chunked", json={
+            "doc_type": doc_type, "filename": name, "size": len(content)})
+        self.assertEqual(resp.status_code, 201)
+        return resp.get_json()
+
+    def send(self, upload, content, indexes=None):
+        size = upload["chunk_size"]
+        for i in indexes if indexes is not None else range(upload["chunks"]):
+            resp = self.client.put(
+                f"/upload/chunked/{upload['upload_id']}/{i}",
+                data=content[i * size:(i + 1) * size])
+            self.assertEqual(resp.status_code, 200, resp.get_json())
+
+    def finalize(self, uploads):
+        data = {"purpose": "work", "category": "graduate_1g",
+                "expiry_passport": (datetime.today() + timedelta(days=365)).strftime("%Y-%m-%d")}
+        for doc_type, upload in uploads.items():
+            data[f"upload_{doc_type}"] = upload["upload_id"]
+        return self.client.post("/upload", data=data)
+
+    def test_chunks_in_any_order_resume_and_finalize(self):
+        letter = b"%PDF-" + os.urandom(3500)
+        files = {
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (letter, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        }
+        uploads = {d: self.start(d, *f) for d, f in files.items()}
+        self.assertEqual(uploads["college_letter"]["chunks"], 4)
+
+        # the connection "drops" after two chunks of the letter
+        self.send(uploads["college_letter"], letter, [3, 1])
+        status = self.client.get(
+            f"/upload/chunked/{uploads['college_letter']['upload_id']}").get_json()
+        self.assertEqual(status["received"], [1, 3])
+        self.send(uploads["college_letter"], letter, [0, 1, 2])
+        for d in ("passport", "insurance"):
+            self.send(uploads[d], files[d][0])
+
+        resp = self.finalize(uploads)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"uploaded successfully", resp.data)
+        self.assertIn(hashlib.sha256(letter).hexdigest(), self.stored_files())
+        # chunks and spooled copies are cleaned up
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        self.assertEqual(os.listdir(os.path.join(folder, ".chunked")), [])
+        self.assertEqual(os.listdir(os.path.join(folder, ".incoming")), [])
+
+    def test_incomplete_upload_fails_validation_and_can_be_finished(self):
+        letter = b"%PDF-" + os.urandom(1500)
+        uploads = {
+            "passport": self.start("passport", PNG_BYTES, "passport.png"),
+            "college_letter": self.start("college_letter", letter, "letter.pdf"),
+            "insurance": self.start("insurance", PDF_BYTES, "insurance.pdf"),
+        }
+        self.send(uploads["passport"], PNG_BYTES)
+        self.send(uploads["insurance"], PDF_BYTES)
+        self.send(uploads["college_letter"], letter, [0])
+
+        resp = self.finalize(uploads)
+        self.assertIn(b"not complete yet", resp.data)
+        self.assertEqual(self.stored_files(), [])
+
+        self.send(uploads["college_letter"], letter, [1])
+        resp = self.finalize(uploads)
+        self.assertIn(b"uploaded successfully", resp.data)
+
+    def test_bad_sizes_are_refused(self):
+        resp = self.client.post("/upload/chunked", json={
+            "doc_type": "passport", "filename": "p.pdf",
+            "size": gnib.app.config["INGEST_MAX_FILE_BYTES"] + 1})
+        self.assertEqual(resp.status_code, 400)
+
+        upload = self.start("passport", PDF_BYTES * 100, "p.pdf")
+        resp = self.client.put(f"/upload/chunked/{upload['upload_id']}/0", data=b"short")
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.put(f"/upload/chunked/{upload['upload_id']}/99", data=b"x")
+        self.assertEqual(resp.status_code, 400)
+
+
+class TestNormalizedSchema(AppTestCase):
+
+    LEGACY_COLUMNS = ("id, application_code, purpose, category, doc_type, filename,"
+                      " expiry_date, status, uploaded_at")
+
+    def test_existing_db_is_converted_in_place(self):
+        # the db that ships with the repo still has the original flat table
+        legacy = os.path.join(self.tmp, "legacy.db")
+        shutil.copy(os.path.join(os.path.dirname(gnib.__file__), "gnib_uploads.db"), legacy)
+        with sqlite3.connect(legacy) as conn:
+            before = conn.execute(
+                f"SELECT {self.LEGACY_COLUMNS} FROM uploads ORDER BY id").fetchall()
+            codes = {r[1] for r in before}
+        conn.close()
+
+        gnib.app.config["DB_PATH"] = legacy
+        gnib.init_db()
+        conn = gnib.get_db_connection()
+        after = [tuple(r) for r in conn.execute(
+            f"SELECT {self.LEGACY_COLUMNS} FROM uploads ORDER BY id")]
+        self.assertEqual(after, before)
+        self.assertEqual(
+            {r[0] for r in conn.execute("SELECT code FROM applications")}, codes)
+        kind = conn.execute(
+            "SELECT type FROM sqlite_master WHERE name = 'uploads'").fetchone()[0]
+        self.assertEqual(kind, "view")
+
+        # new documents carry on after the old ids
+        new_id = gnib.insert_document(
+            conn, before[0][1], "study", "masters", "insurance", "x.pdf", None,
+            int(time.time()))
+        self.assertEqual(new_id, before[-1][0] + 1)
+
+    def test_status_and_time_are_stored_as_integers(self):
+        self.add_uploads(1, status="rejected", uploaded_at="2025-12-01 10:00:00")
+        conn = gnib.get_db_connection()
+        row = conn.execute(
+            "SELECT status, uploaded_at, typeof(uploaded_at) FROM documents").fetchone()
+        self.assertEqual(row[0], gnib.UPLOAD_STATUSES.index("rejected"))
+        self.assertEqual(row[2], "integer")
+        self.assertEqual(datetime.fromtimestamp(row[1]), datetime(2025, 12, 1, 10))
+
+    def test_filters_use_the_documents_indexes(self):
+        conn = gnib.get_db_connection()
+        where, params = gnib.upload_filter_sql({"status": "pending"})
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM uploads WHERE " + " AND ".join(where)
+            + " ORDER BY uploaded_ts DESC, id DESC LIMIT 50", params))
+        self.assertIn("idx_documents_status", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestApplicationSummary(AppTestCase):
+
+    COLUMNS = ("required_count, uploaded_count, pending_count, approved_count,"
+               " rejected_count, ready, awaiting_review")
+
+    def summary(self, code="12345678"):
+        return tuple(gnib.get_db_connection().execute(
+            f"SELECT {self.COLUMNS} FROM application_summary s"
+            " JOIN applications a ON a.id = s.application_id WHERE a.code = ?",
+            (code,)).fetchone())
+
+    def rebuilt(self, code="12345678"):
+        """what a full recount gives, to compare the trigger-maintained row with"""
+        conn = gnib.get_db_connection()
+        conn.execute(gnib.SUMMARY_REFRESH_SQL.format(where="1"))
+        return self.summary(code)
+
+    def test_triggers_keep_the_summary_current(self):
+        # graduate_1g needs passport, college_letter and insurance
+        add = lambda doc_type, **kw: self.add_uploads(
+            1, purpose="work", category="graduate_1g", doc_type=doc_type, **kw)
+        add("passport")
+        add("passport", filename="again.pdf")
+        add("college_letter")
+        self.assertEqual(self.summary(), (3, 2, 3, 0, 0, 0, 0))
+
+        add("insurance")
+        self.assertEqual(self.summary(), (3, 3, 4, 0, 0, 1, 1))
+
+        conn = gnib.get_db_connection()
+        gnib.set_application_status(conn, "12345678", "approved")
+        self.assertEqual(self.summary(), (3, 3, 0, 4, 0, 1, 0))
+        gnib.set_upload_status(conn, [1], "rejected")
+        self.assertEqual(self.summary(), (3, 3, 0, 3, 1, 1, 0))
+
+        # removing the only insurance makes it incomplete again
+        conn.execute("DELETE FROM documents WHERE id = 4")
+        conn.execute("DELETE FROM documents WHERE id = 2")
+        self.assertEqual(self.summary(), (3, 2, 0, 1, 1, 0, 0))
+
+        # a new category brings its own requirements
+        conn.execute("UPDATE applications SET purpose = 'study', category = 'english_language'")
+        self.assertEqual(self.summary()[:2], (4, 2))
+        self.assertEqual(self.summary(), self.rebuilt())
+        # the applicant switching back while uploading goes through insert_document
+        add("insurance", filename="back.pdf")
+        self.assertEqual(self.summary()[:2], (3, 3))
+        self.assertEqual(self.summary(), self.rebuilt())
+
+    def test_dashboard_and_applications_filter_by_readiness(self):
+        for doc_type in ("passport", "college_letter", "insurance"):
+            self.add_uploads(1, application_code="11111111", purpose="work",
+                             category="graduate_1g", doc_type=doc_type)
+        self.add_uploads(1, application_code="22222222", purpose="work",
+                         category="graduate_1g")
+        self.login_admin()
+
+        page = self.client.get("/admin?readiness=awaiting").get_data(as_text=True)
+        self.assertEqual(page.count("<td>11111111</td>"), 3)
+        self.assertNotIn("22222222", page)
+
+        page = self.client.get("/admin/applications?readiness=incomplete").get_data(as_text=True)
+        self.assertIn("22222222", page)
+        self.assertNotIn("11111111", page)
+
+        plan = " ".join(r[3] for r in gnib.get_db_connection().execute(
+            "EXPLAIN QUERY PLAN SELECT application_id FROM application_summary"
+            " WHERE awaiting_review = 1 ORDER BY last_upload_at DESC,"
+            " application_id DESC"))
+        self.assertIn("idx_summary_awaiting", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        # keyset pages: complete applications first
+        with gnib.app.app_context():
+            first, cursor = gnib.list_applications("", limit=1)
+            second, last = gnib.list_applications(
+                "", gnib.decode_cursor(cursor, parts=3), limit=1)
+        self.assertEqual([first[0]["code"], second[0]["code"]], ["11111111", "22222222"])
+        self.assertIsNone(last)
+
+
+class TestMetrics(AppTestCase):
+
+    def scrape(self, **kwargs):
+        resp = self.client.get("/admin/metrics", **kwargs)
+        return resp, resp.get_data(as_text=True)
+
+    def test_upload_is_timed_per_route_and_phase(self):
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES + b"1", "insurance.pdf"),
+        })
+        self.login_admin()
+        resp, text = self.scrape()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn('gnib_http_requests_total{route="upload",method="POST",status="200"}', text)
+        for phase in ("body", "sql", "file", "template"):
+            self.assertIn(
+                f'gnib_http_request_phase_seconds_count{{route="upload",phase="{phase}"}}', text)
+        self.assertIn('gnib_uploaded_bytes_total{doc_type="insurance"}', text)
+        self.assertIn('gnib_sql_query_seconds_bucket{query="INSERT INTO documents', text)
+        # IN lists of any length are one series
+        self.assertEqual(metrics.query_label("SELECT 1\n WHERE id IN (?, ?,?)"),
+                         "SELECT 1 WHERE id IN (?, ...)")
+        self.assertIn('le="+Inf"', text)
+
+    def test_query_labels_stay_short_and_bounded(self):
+        self.assertIsNone(metrics.query_label("CREATE TABLE t (id INTEGER)"))
+        self.assertIsNone(metrics.query_label("  pragma user_version"))
+        long_sql = "SELECT " + ", ".join(f"col_{i}" for i in range(200)) + " FROM t"
+        label = metrics.query_label(long_sql)
+        self.assertLess(len(label), 80)
+        self.assertTrue(label.startswith("SELECT col_0, col_1"))
+        self.assertEqual(metrics.query_label(" ".join(long_sql.split(" "))), label)
+        with mock.patch.object(metrics, "MAX_QUERY_LABELS", 0), \
+                mock.patch.object(metrics, "_seen_labels", set()), \
+                mock.patch.object(metrics, "_query_names", {}):
+            self.assertEqual(metrics.query_label("SELECT 2"), "other")
+
+        self.post_graduate({"passport": (PNG_BYTES, "passport.png")})
+        self.login_admin()
+        _, text = self.scrape()
+        labels = set(re.findall(r'gnib_sql_query_seconds_count\{query="([^"]*)"', text))
+        self.assertTrue(labels)
+        self.assertLessEqual(len(labels), metrics.MAX_QUERY_LABELS + 1)
+        self.assertFalse([q for q in labels if q.upper().startswith(("CREATE", "PRAGMA"))])
+        self.assertLess(max(map(len, labels)), 80)
+
+    def test_admin_or_token_only(self):
+        self.assertEqual(self.scrape()[0].status_code, 302)
+        with mock.patch.object(gnib, "METRICS_TOKEN", "s3cret"):
+            resp, _ = self.scrape(headers={"Authorization": "Bearer wrong"})
+            self.assertEqual(resp.status_code, 302)
+            resp, text = self.scrape(headers={"Authorization": "Bearer s3cret"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("# TYPE gnib_http_request_seconds histogram", text)
+
+    def test_other_processes_are_added_and_exited_ones_retired(self):
+        conn = gnib.get_db_connection()
+        other = {"gnib_uploaded_documents_total": [[["metrics_test"], 5]]}
+        conn.executemany(
+            "INSERT INTO metric_snapshots (process, data, updated_at) VALUES (?, ?, 0)",
+            [(f"{socket.gethostname()}:{os.getpid()}:live", json.dumps(other)),
+             (f"{socket.gethostname()}:999999999:gone", json.dumps(other))],
+        )
+        conn.commit()
+        self.login_admin()
+        _, text = self.scrape()
+        self.assertIn('gnib_uploaded_documents_total{doc_type="metrics_test"} 10', text)
+        processes = {r[0] for r in conn.execute("SELECT process FROM metric_snapshots")}
+        self.assertIn(metrics.RETIRED, processes)
+        self.assertNotIn(f"{socket.gethostname()}:999999999:gone", processes)
+        # retiring does not change the totals
+        _, text = self.scrape()
+        self.assertIn('gnib_uploaded_documents_total{doc_type="metrics_test"} 10', text)
+
+
+class TestSlowQueryLog(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.log = slowlog.SlowQueryLog(
+            os.path.join(self.tmp, "logs", "slow.log"), threshold_ms=0,
+            context=lambda: flask.request.endpoint if flask.has_request_context() else None)
+        patcher = mock.patch.object(gnib, "slow_query_log", self.log)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [h.close() for h in self.log.logger.handlers])
+
+    def entries(self):
+        with open(self.log.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_statements_are_logged_with_shape_and_plan(self):
+        self.add_uploads(3)
+        conn = gnib.get_db_connection()
+        conn.execute("SELECT * FROM uploads WHERE filename = ? OR id IN (?, ?, ?)",
+                     ("file_1.pdf", 1, 2, 3)).fetchall()
+        conn.execute("SELECT * FROM documents WHERE id = ?", (1,)).fetchall()
+
+        by_query = {e["query"]: e for e in self.entries()}
+        scan = by_query["SELECT * FROM uploads WHERE filename = ? OR id IN (?, ...)"]
+        self.assertEqual(scan["params"], "(str, int x 3)")
+        self.assertIn("documents", scan["full_scans"])
+        self.assertTrue(scan["plan"])
+        lookup = by_query["SELECT * FROM documents WHERE id = ?"]
+        self.assertEqual(lookup["full_scans"], [])
+        self.assertTrue(any("USING INTEGER PRIMARY KEY" in line for line in lookup["plan"]))
+        # the EXPLAIN itself is not timed or logged
+        self.assertFalse(any(q.startswith("EXPLAIN") for q in by_query))
+
+    def test_admin_page_summarizes_the_log(self):
+        self.login_admin()
+        self.client.get("/admin")
+        summary = {q["query"]: q for q in self.log.summary()}
+        self.assertTrue(any("admin_dashboard" in q["routes"] for q in summary.values()))
+
+        resp = self.client.get("/admin/slow-queries")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Slow Queries", resp.data)
+        self.assertIn(b"<details>", resp.data)
+
+    def test_off_by_default(self):
+        with mock.patch.object(gnib, "slow_query_log", None):
+            self.login_admin()
+            resp = self.client.get("/admin/slow-queries")
+            self.assertIn(b"slow-query log is off", resp.data)
+
+
+class TestStartup(AppTestCase):
+
+    def test_heavy_modules_are_not_imported_with_the_app(self):
+        out = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, app; print(sorted({'requests', 'pypdf', 'PIL'} & set(sys.modules)))"],
+            cwd=os.path.dirname(os.path.abspath(gnib.__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(out.strip(), "[]")
+
+    def test_create_app_initializes_each_db_once_and_caches_templates(self):
+        cache_dir = os.path.join(self.tmp, "jinja")
+        env = gnib.app.jinja_env
+        self.addCleanup(setattr, env, "bytecode_cache", env.bytecode_cache)
+        env.cache.clear()
+        config = {"DB_PATH": os.path.join(self.tmp, "fresh.db")}
+        self.addCleanup(gnib.app.config.update, DB_PATH=gnib.app.config["DB_PATH"])
+
+        with mock.patch.object(gnib, "JINJA_CACHE_DIR", cache_dir), \
+                mock.patch.object(gnib, "init_db", wraps=gnib.init_db) as init_db, \
+                mock.patch("sys.stderr", io.StringIO()) as log:
+            self.assertIs(gnib.create_app(config, started=time.perf_counter()), gnib.app)
+            self.assertIn("import", gnib.app.config["STARTUP_TIMINGS"])
+            gnib.create_app(config)
+        self.assertEqual(init_db.call_count, 1)
+        self.assertTrue(gnib.schema_is_current(gnib.get_db_connection()))
+        self.assertTrue(os.listdir(cache_dir))
+        self.assertIn("ready in", log.getvalue())
+
+
+class TestExport(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_uploads(5)
+        self.add_uploads(2, status="approved", category="bachelors",
+                         filename="=HYPERLINK(1).pdf", uploaded_at="2025-11-01 09:00:00")
+        self.login_admin()
+
+    def test_csv_is_streamed_in_batches(self):
+        with mock.patch.object(gnib, "EXPORT_BATCH_SIZE", 2), \
+                mock.patch.object(gnib, "list_uploads", wraps=gnib.list_uploads) as pages:
+            resp = self.client.get("/admin/export.csv")
+            self.assertTrue(resp.is_streamed)
+            body = resp.get_data(as_text=True)
+        self.assertEqual(pages.call_count, 4)
+        self.assertTrue(all(call.args[2] == 2 for call in pages.call_args_list))
+        self.assertIn("attachment;", resp.headers["Content-Disposition"])
+
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 7)
+        stamps = [(r["uploaded_at"], int(r["id"])) for r in rows]
+        self.assertEqual(stamps, sorted(stamps, reverse=True))
+        # no formulas for spreadsheet apps
+        self.assertEqual(rows[-1]["filename"], "'=HYPERLINK(1).pdf")
+
+    def test_ndjson_with_filters(self):
+        resp = self.client.get("/admin/export.ndjson?status=approved&category=bachelors"
+                               "&date_from=2025-11-01&date_to=2025-11-01")
+        self.assertEqual(resp.content_type, "application/x-ndjson")
+        rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([r["status"] for r in rows], ["approved", "approved"])
+        self.assertEqual(rows[0]["filename"], "=HYPERLINK(1).pdf")
+
+    def test_admin_only_and_known_formats(self):
+        self.assertEqual(self.client.get("/admin/export.xml").status_code, 404)
+        with self.client.session_transaction() as sess:
+            sess.clear()
+        self.assertEqual(self.client.get("/admin/export.csv").status_code, 302)
+
+
+class TestApplicationBundle(AppTestCase):
+
+    def test_zip_has_every_document_and_a_manifest(self):
+        insurance = PDF_BYTES + b"1"
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (insurance, "insurance.pdf"),
+        })
+        code = gnib.get_db_connection().execute(
+            "SELECT code FROM applications").fetchone()[0]
+        self.login_admin()
+        resp = self.client.get(f"/admin/applications/{code}/bundle.zip")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.content_type, "application/zip")
+
+        archive = zipfile.ZipFile(io.BytesIO(resp.data))
+        self.assertIsNone(archive.testzip())
+        names = archive.namelist()
+        self.assertEqual(names[0], f"{code}/manifest.csv")
+        by_type = {n.split("/")[1]: n for n in names[1:]}
+        self.assertEqual(sorted(by_type), ["college_letter", "insurance", "passport"])
+        self.assertEqual(archive.read(by_type["passport"]), PNG_BYTES)
+        self.assertEqual(archive.read(by_type["insurance"]), insurance)
+        manifest = list(csv.DictReader(io.StringIO(
+            archive.read(f"{code}/manifest.csv").decode())))
+        self.assertEqual({r["doc_type"] for r in manifest},
+                         {"passport", "college_letter", "insurance"})
+        self.assertTrue(all(r["status"] == "pending" for r in manifest))
+
+    def test_missing_files_are_noted_and_unknown_codes_refused(self):
+        self.add_uploads(1)
+        self.login_admin()
+        resp = self.client.get("/admin/applications/12345678/bundle.zip")
+        archive = zipfile.ZipFile(io.BytesIO(resp.data))
+        self.assertEqual(archive.namelist(), ["12345678/manifest.csv"])
+        self.assertIn(b"file missing on server", archive.read("12345678/manifest.csv"))
+        self.assertEqual(
+            self.client.get("/admin/applications/nope/bundle.zip").status_code, 302)
+
+    def test_archive_goes_out_in_pieces(self):
+        path = os.path.join(self.tmp, "big.pdf")
+        with open(path, "wb") as f:
+            f.write(os.urandom(300 * 1024))
+        pieces = list(bundle.stream_zip([("big.pdf", path, None)], chunk_size=64 * 1024))
+        self.assertGreater(len(pieces), 4)
+        self.assertLess(max(len(p) for p in pieces), 65 * 1024)
+        with open(path, "rb") as f:
+            self.assertEqual(
+                zipfile.ZipFile(io.BytesIO(b"".join(pieces))).read("big.pdf"), f.read())
+
+
+class TestDocumentViewer(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.insurance = PDF_BYTES + os.urandom(4096)
+        self.post_graduate({
+            "passport": (PNG_BYTES, "passport.png"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (self.insurance, "insurance.pdf"),
+        })
+        row = gnib.get_db_connection().execute(
+            "SELECT id, blob_sha256 FROM uploads WHERE doc_type = 'insurance'").fetchone()
+        self.url = f"/admin/uploads/{row['id']}/file"
+        self.sha = row["blob_sha256"]
+
+    def test_admin_only_inline_with_content_hash_etag(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.login_admin()
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, self.insurance)
+        self.assertEqual(resp.mimetype, "application/pdf")
+        self.assertEqual(resp.get_etag(), (self.sha, False))
+        self.assertTrue(resp.headers["Content-Disposition"].startswith("inline"))
+        self.assertTrue(resp.cache_control.private)
+        self.assertFalse(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, gnib.FILE_CACHE_MAX_AGE)
+        resp.close()
+
+        resp = self.client.get(self.url, headers={"If-None-Match": f'"{self.sha}"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(self.client.get("/admin/uploads/999/file").status_code, 302)
+
+    def test_range_requests_get_partial_content(self):
+        self.login_admin()
+        resp = self.client.get(self.url, headers={"Range": "bytes=100-199"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.data, self.insurance[100:200])
+        self.assertEqual(resp.headers["Content-Range"],
+                         f"bytes 100-199/{len(self.insurance)}")
+        resp.close()
+
+    def test_offload_to_the_web_server(self):
+        self.login_admin()
+        with mock.patch.object(gnib, "FILE_OFFLOAD", "x-accel"):
+            resp = self.client.get(self.url)
+            self.assertEqual(resp.data, b"")
+            self.assertEqual(resp.headers["X-Accel-Redirect"],
+                             f"/protected-uploads/blobs/{self.sha[:2]}/{self.sha}")
+            self.assertEqual(resp.get_etag(), (self.sha, False))
+            resp = self.client.get(self.url, headers={"If-None-Match": f'"{self.sha}"'})
+            self.assertEqual(resp.status_code, 304)
+            self.assertNotIn("X-Accel-Redirect", resp.headers)
+        with mock.patch.object(gnib, "FILE_OFFLOAD", "x-sendfile"):
+            resp = self.client.get(self.url)
+            self.assertEqual(resp.headers["X-Sendfile"], os.path.abspath(
+                gnib.blobstore.blob_path(gnib.app.config["UPLOAD_FOLDER"], self.sha)))
+
+
+def make_jpeg(width, height, orientation=None):
+    from PIL import Image
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "navy").save(buf, "JPEG", exif=exif)
+    return buf.getvalue()
+
+
+@unittest.skipUnless(previews.available(), "Pillow is not installed")
+class TestPreviews(AppTestCase):
+
+    def run_jobs(self):
+        with gnib.app.app_context():
+            return jobs.work(gnib.get_db_connection, gnib.JOB_HANDLERS, "test", once=True)
+
+    def test_uploads_get_a_cached_preview_on_the_dashboard(self):
+        # a landscape photo taken with the phone on its side (EXIF orientation 6)
+        self.post_graduate({
+            "passport": (make_jpeg(1200, 600, orientation=6), "passport.jpg"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        conn = gnib.get_db_connection()
+        rows = {r["doc_type"]: r["id"] for r in conn.execute("SELECT * FROM uploads")}
+        # the two PDFs are the same content, so it is one job
+        self.assertEqual(conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE kind = 'preview'").fetchone()[0], 2)
+        self.login_admin()
+        url = f"/admin/uploads/{rows['passport']}/preview"
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.run_jobs(), 2)
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "image/jpeg")
+        self.assertTrue(resp.cache_control.private)
+        from PIL import Image
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (160, 320))
+        resp.close()
+        self.assertIn(url.encode(), self.client.get("/admin").data)
+
+        # that fake PDF can't be rendered: no preview, and no job queued again
+        resp = self.client.get(f"/admin/uploads/{rows['insurance']}/preview")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.run_jobs(), 0)
+
+        # a preview job has no OCR page, its status is the JSON view
+        job_id = conn.execute("SELECT id FROM jobs WHERE kind = 'preview'").fetchone()[0]
+        resp = self.client.get(f"/admin/jobs/{job_id}")
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.headers["Location"].endswith(f"/admin/jobs/{job_id}.json"))
+
+    def test_cache_is_trimmed_least_recently_used_first(self):
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        source = os.path.join(self.tmp, "photo.jpg")
+        with open(source, "wb") as f:
+            f.write(make_jpeg(800, 800))
+        for i, sha in enumerate(["a" * 64, "b" * 64, "c" * 64]):
+            previews.generate(folder, sha, source, "jpeg")
+            os.utime(previews.preview_path(folder, sha), (1000 + i, 1000 + i))
+        # "a" was viewed last
+        previews.touch(previews.preview_path(folder, "a" * 64))
+
+        one = os.path.getsize(previews.preview_path(folder, "a" * 64))
+        self.assertEqual(previews.evict(folder, 2 * one), 1)
+        left = {sha[0] for sha in ("a" * 64, "b" * 64, "c" * 64)
+                if os.path.exists(previews.preview_path(folder, sha))}
+        self.assertEqual(left, {"a", "c"})
+
+    def test_cache_is_only_walked_past_the_slack_and_keeps_markers(self):
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        source = os.path.join(self.tmp, "photo.jpg")
+        with open(source, "wb") as f:
+            f.write(make_jpeg(800, 800))
+        with mock.patch.dict(previews._written, {"bytes": None}), \
+                mock.patch.object(previews, "evict", wraps=previews.evict) as evict:
+            for sha in ("a" * 64, "b" * 64, "c" * 64):
+                previews.generate(folder, sha, source, "jpeg", max_bytes=10**9)
+            # the first preview of the process checks, the next ones fit in the slack
+            self.assertEqual(evict.call_count, 1)
+            previews.generate(folder, "d" * 64, source, "jpeg", max_bytes=1)
+            self.assertEqual(evict.call_count, 2)
+
+        broken = os.path.join(self.tmp, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not an image")
+        previews.generate(folder, "e" * 64, broken, "jpeg")
+        previews.evict(folder, 0)
+        self.assertTrue(os.path.exists(previews.marker_path(folder, "e" * 64)))
+        self.assertFalse(os.path.exists(previews.preview_path(folder, "a" * 64)))
+
+
+@unittest.skipUnless(previews.available(), "Pillow is not installed")
+class TestImageNormalization(AppTestCase):
+
+    def photo(self, width, height, orientation=None, **save):
+        """a noisy JPEG, so it doesn't compress to nothing like a flat color"""
+        from PIL import Image
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        buf = io.BytesIO()
+        Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(
+            buf, "JPEG", **dict({"quality": 95, "exif": exif}, **save))
+        return buf.getvalue()
+
+    def refcount(self, sha256):
+        row = gnib.get_db_connection().execute(
+            "SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return row["refcount"] if row else None
+
+    def upload_passport(self, content):
+        self.client = gnib.app.test_client()  # a new application each time
+        self.post_graduate({
+            "passport": (content, "passport_Screenshot_1.jpeg"),
+            "college_letter": (PDF_BYTES, "letter.pdf"),
+            "insurance": (PDF_BYTES, "insurance.pdf"),
+        })
+        return gnib.get_db_connection().execute(
+            "SELECT blob_sha256 FROM uploads WHERE doc_type = 'passport' "
+            "ORDER BY id DESC").fetchone()[0]
+
+    def test_big_sideways_photo_is_rotated_shrunk_and_recorded(self):
+        from PIL import Image
+        original = self.photo(1000, 500, orientation=6)
+        with mock.patch.object(gnib, "IMAGE_MAX_PIXELS", 200_000):
+            sha = self.upload_passport(original)
+            # the same file again is not decoded again, it gets the same copy
+            with mock.patch.object(gnib.image_ingest, "normalize") as normalize:
+                self.assertEqual(self.upload_passport(original), sha)
+            normalize.assert_not_called()
+
+        folder = gnib.app.config["UPLOAD_FOLDER"]
+        with Image.open(gnib.blobstore.blob_path(folder, sha)) as stored:
+            self.assertEqual(stored.size, (316, 632))
+            self.assertNotIn(0x0112, stored.getexif())
+        row = gnib.image_ingest.lookup(
+            gnib.get_db_connection(), hashlib.sha256(original).hexdigest())
+        self.assertEqual((row["stored_sha256"], row["original_bytes"], row["rotated"]),
+                         (sha, len(original), 1))
+        self.assertLess(row["stored_bytes"], row["original_bytes"] / 3)
+        # the original is not kept unless asked for
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_original_can_be_kept(self):
+        original = self.photo(800, 600, orientation=3)
+        with mock.patch.object(gnib, "IMAGE_KEEP_ORIGINAL", True):
+            sha = self.upload_passport(original)
+        original_sha = hashlib.sha256(original).hexdigest()
+        self.assertNotEqual(sha, original_sha)
+        self.assertTrue(os.path.exists(gnib.blobstore.blob_path(
+            gnib.app.config["UPLOAD_FOLDER"], original_sha)))
+        self.assertEqual(gnib.image_ingest.savings(gnib.get_db_connection())["images"], 1)
+        # the kept original is a referenced blob, not garbage
+        self.assertEqual(self.refcount(original_sha), 1)
+
+    def test_original_is_kept_for_a_file_normalized_before(self):
+        original = self.photo(800, 600, orientation=3)
+        original_sha = hashlib.sha256(original).hexdigest()
+        original_path = gnib.blobstore.blob_path(
+            gnib.app.config["UPLOAD_FOLDER"], original_sha)
+        sha = self.upload_passport(original)
+        self.assertFalse(os.path.exists(original_path))
+        # switched on later: the lookup shortcut must not skip storing it
+        with mock.patch.object(gnib, "IMAGE_KEEP_ORIGINAL", True):
+            self.assertEqual(self.upload_passport(original), sha)
+        self.assertTrue(os.path.exists(original_path))
+        row = gnib.image_ingest.lookup(gnib.get_db_connection(), original_sha)
+        self.assertEqual(row["kept_original"], 1)
+        self.assertEqual(self.refcount(original_sha), 1)
+        # uploading it a third time adds no second reference to the original
+        with mock.patch.object(gnib, "IMAGE_KEEP_ORIGINAL", True):
+            self.upload_passport(original)
+        self.assertEqual(self.refcount(original_sha), 1)
+
+    def test_small_upright_image_is_stored_as_uploaded(self):
+        # already saved the way we would save it, re-encoding gains nothing
+        original = self.photo(300, 200, quality=85, optimize=True, progressive=True)
+        sha = self.upload_passport(original)
+        self.assertEqual(sha, hashlib.sha256(original).hexdigest())
+        self.assertIsNone(gnib.image_ingest.lookup(gnib.get_db_connection(), sha))
+
+
+class TestBenchmarks(AppTestCase):
+
+    def test_small_run_writes_results_and_flags_regressions(self):
+        out = os.path.join(self.tmp, "bench.json")
+        code = bench.main(["--rows", "300", "--iterations", "2", "--file-kb", "4",
+                           "--data-dir", os.path.join(self.tmp, "bench_data"),
+                           "--out", out])
+        self.assertEqual(code, 0)
+        with open(out) as f:
+            results = json.load(f)["results"]
+        names = {r["name"] for r in results}
+        self.assertIn("dashboard_search_code", names)
+        self.assertIn("upload_masters", names)
+        self.assertIn("bulk_review_100", names)
+
+        baseline = [dict(r, median_ms=r["median_ms"] / 2) for r in results]
+        self.assertTrue(bench.compare(results, baseline, 0.2))
+        self.assertEqual(bench.compare(results, results, 0.2), [])
+
+
+class TestLoadHarness(unittest.TestCase):
+
+    def test_short_mixed_run_has_no_errors(self):
+        out = os.path.join(tempfile.mkdtemp(), "load.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(out), True)
+        code = loadtest.main(["--applicants", "2", "--admins", "1", "--duration", "2",
+                              "--think-time", "0.1", "--file-kb", "8",
+                              "--ocr-latency", "0.05", "--job-workers", "1", "--out", out])
+        self.assertEqual(code, 0)
+        with open(out) as f:
+            routes = {r["route"]: r for r in json.load(f)["routes"]}
+        self.assertIn("POST /upload", routes)
+        self.assertIn("GET /admin", routes)
+        for r in routes.values():
+            self.assertEqual(r["errors"], 0, r)